@@ -1,2 +1,18 @@
-from .main import *
-from . import beatmap, effects, image, io, metrics, presets, osu, utils
\ No newline at end of file
+# submodules and everything from `main` are imported on first use, so importing the package is fast and touches nothing on disk
+# names that `from beat_manipulator import *` always gave, besides numpy, scipy and os, which were there by accident
+__all__ = ['BM_EFFECTS', 'BM_METRICS', 'BM_SAMPLES', 'beatmap', 'beatswap', 'beatswap_stream', 'effects', 'image', 'io', 'main', 'metrics', 'osu', 'presets', 'song', 'utils']
+_submodules = ('beatmap', 'cache', 'effects', 'fingerprint', 'image', 'io', 'main', 'metrics', 'online', 'osu', 'parse', 'presets', 'render', 'utils')
+
+def __getattr__(name):
+    import importlib
+    if name in _submodules: return importlib.import_module(f'.{name}', __name__)
+    if not name.startswith('_'):
+        main = importlib.import_module('.main', __name__)
+        if hasattr(main, name):
+            globals()[name] = getattr(main, name)
+            return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    from . import main
+    return sorted(set(globals()) | set(_submodules) | {i for i in dir(main) if not i.startswith('_')})
@@ -7,37 +7,38 @@ def scale(beatmap:np.ndarray, scale:float, log = True, integer = True) -> np.nda
     assert scale>0, f"scale should be > 0, your scale is {scale}"
     if scale == 1: return beatmap
     else:
-        import math
         if log is True: print(f'scale={scale}; ')
-        a = 0
-        b = np.array([], dtype=int)
+        beatmap = np.asarray(beatmap)
         if scale%1==0:
-            while a < len(beatmap):
-                b = np.append(b, beatmap[int(a)])
-                a += scale
+            if len(beatmap) == 0: return np.array([], dtype=int)
+            return beatmap[::int(scale)].astype(np.result_type(int, beatmap.dtype))
         else:
-            if integer is True:
-                while a + 1 < len(beatmap):
-                    b = np.append(b, int((1 - (a % 1)) * beatmap[math.floor(a)] + (a % 1) * beatmap[math.ceil(a)]))
-                    a += scale
-            else:
-                while a + 1 < len(beatmap):
-                    b = np.append(b, (1 - (a % 1)) * beatmap[math.floor(a)] + (a % 1) * beatmap[math.ceil(a)])
-                    a += scale
-        return b
+            if len(beatmap) < 2: return np.array([], dtype=int)
+            # positions are summed one step at a time like `a += scale` would, so they round the same way
+            steps = int((len(beatmap) - 1) / scale) + 2
+            a = np.zeros(steps, dtype = np.float64)
+            np.cumsum(np.full(steps - 1, scale, dtype = np.float64), out = a[1:])
+            a = a[a + 1 < len(beatmap)]
+            if len(a) == 0: return np.array([], dtype=int)
+            # first position is an int 0, so a single beat keeps integer type
+            if len(a) == 1 and integer is False: return beatmap[:1].astype(np.result_type(int, beatmap.dtype))
+            fraction = a % 1
+            b = (1 - fraction) * beatmap[np.floor(a).astype(np.int64)] + fraction * beatmap[np.ceil(a).astype(np.int64)]
+            if integer is True: return b.astype(int)
+            return b
     
 def shift(beatmap:np.ndarray, shift:float, log = True, mode = 1) -> np.ndarray:
     if isinstance(shift, str): shift = utils._safer_eval(shift)
     if shift == 0: return beatmap
+    beatmap = np.asarray(beatmap)
     # positive shift
-    elif shift > 0:
+    if shift > 0:
         # full value of beats is removed from the beginning
         if shift >= 1: beatmap = beatmap[int(shift//1):]
-        # shift beatmap by the decimal value
+        # shift beatmap by the decimal value, in place, each beat moves towards the next one
         if shift%1 != 0:
             shift = shift%1
-            for i in range(len(beatmap) - int(shift) - 1):
-                beatmap[i] = int(beatmap[i] + shift * (beatmap[i + 1] - beatmap[i]))
+            beatmap[:-1] = np.trunc(beatmap[:-1] + shift * (beatmap[1:] - beatmap[:-1]))
 
     # negative shift
     else:
@@ -48,79 +49,174 @@ def shift(beatmap:np.ndarray, shift:float, log = True, mode = 1) -> np.ndarray:
                     step = int((beatmap[1] - beatmap[0]) / (int(shift//1) + 1))
                     beatmap = np.insert(arr = beatmap, obj = 1, values = np.linspace(start = beatmap[0] + step - 1, stop = 1 + beatmap[1] - step, num = int(shift//1)))
             elif mode == 2:
-                for i in range(int(shift//1)):
-                    beatmap = np.insert(arr = beatmap, obj = (i*2)+1, values = int((beatmap[i*2] + beatmap[(i*2)+1])/2))
-        # shift beatmap by the decimal value
+                # a beat in the middle of each of the first gaps
+                n = int(shift//1)
+                if n >= len(beatmap): raise IndexError(f"can't insert {n} beats between {len(beatmap)} beats")
+                beatmap = np.insert(arr = beatmap, obj = np.arange(1, n+1), values = np.trunc((beatmap[:n] + beatmap[1:n+1]) / 2))
+        # shift beatmap by the decimal value, in place, each beat moves towards the previous one
         if shift%1 != 0:
             shift = shift%1
-            for i in reversed(range(len(beatmap))):
-                if i==0: continue
-                beatmap[i] = int(beatmap[i] - shift * (beatmap[i] - beatmap[i-1]))
+            beatmap[1:] = np.trunc(beatmap[1:] - shift * (beatmap[1:] - beatmap[:-1]))
     return beatmap
 
-def generate(audio: np.ndarray, sr: int, lib='madmom.BeatDetectionProcessor', caching=True, filename: str = None, log = True, load_settings = True, split=None):
-    """Creates beatmap attribute with a list of positions of beats in samples."""
+def _key(fingerprint: str, lib: str) -> str:
+    """Cache key of a beatmap: audio fingerprint and detector"""
+    return f'{fingerprint}_{lib}'
+
+def settings(audio: np.ndarray = None, lib: str = 'madmom.BeatDetectionProcessor', key: str = None, sr: int = None) -> dict:
+    """Returns settings saved with a cached beatmap as a dict with `scale`, `shift`, `adjust` and `normalized`, or None"""
+    from . import cache, fingerprint
+    record = cache.beatmaps.get(key if key is not None else _key(fingerprint.full(audio, sr), lib))
+    if record is None: return None
+    return record[1].get('settings')
+
+def _check_length(audio, sr):
+    assert len(audio[0])>sr*2, f'Audio file is too short, len={len(audio[0])} samples, or {len(audio[0])/sr} seconds. Minimum length is 2 seconds, audio below that breaks madmom processors.'
+
+# RNN processors load several model files when created, so each process creates them once
+_processors = {}
+
+def _processor(kind = 'beats'):
+    if kind not in _processors:
+        import madmom
+        if kind == 'beats': _processors[kind] = madmom.features.beats.RNNBeatProcessor()
+        elif kind == 'downbeats': _processors[kind] = madmom.features.downbeats.RNNDownBeatProcessor()
+        else: assert False, f'kind = `{kind}` should be `beats` or `downbeats`'
+    return _processors[kind]
+
+def _window_activations(audio: np.ndarray, sr: int, kind = 'beats') -> np.ndarray:
+    import madmom
+    return np.asarray(_processor(kind)(madmom.audio.signal.Signal(audio.T, sr)), dtype = np.float32)
+
+def _windowed(audio: np.ndarray, sr: int, kind = 'beats', window: int = 300, overlap: int = 10, workers: int = 1) -> np.ndarray:
+    """Activations of overlapping windows of `window` seconds, crossfaded where they overlap, so RNN memory depends on window length and not on audio length.
+    Windows start on whole seconds, which are whole frames at 100 fps. With `workers` > 1 windows are processed in a process pool, at most two per worker are queued at a time."""
+    from collections import deque
+    window, overlap = int(window), int(overlap)
+    assert window > overlap >= 2, f'window = {window} and overlap = {overlap} should be whole seconds, with window > overlap >= 2, since audio shorter than 2 seconds breaks madmom processors'
+    length = len(audio[0])
+    step = window - overlap
+    starts = [0]
+    while starts[-1] + window*sr < length: starts.append(starts[-1] + step*sr)
+    ramp = (np.arange(overlap*100, dtype = np.float32) + 0.5) / (overlap*100)
+    out = np.zeros((int(np.ceil(length * 100 / sr)) + 1, 2) if kind == 'downbeats' else int(np.ceil(length * 100 / sr)) + 1, dtype = np.float32)
+    end = 0
+    def merge(k, act):
+        nonlocal end
+        weights = np.ones(len(act), dtype = np.float32)
+        if k > 0: weights[:overlap*100] = ramp[:len(weights[:overlap*100])]
+        if k < len(starts) - 1:
+            weights[step*100 : window*100] = 1 - ramp[:len(weights[step*100 : window*100])]
+            weights[window*100:] = 0
+        offset = starts[k] * 100 // sr
+        act = act[:len(out) - offset]
+        out[offset : offset + len(act)] += act * (weights[:len(act), None] if act.ndim == 2 else weights[:len(act)])
+        end = max(end, offset + len(act))
+    if workers is None or workers <= 1:
+        for k, start in enumerate(starts): merge(k, _window_activations(audio[:, start : start + window*sr], sr, kind))
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers = workers, initializer = _warm, initargs = ('madmom.DBNDownBeatTrackingProcessor' if kind == 'downbeats' else 'madmom',)) as pool:
+            pending = deque()
+            for k, start in enumerate(starts):
+                pending.append((k, pool.submit(_window_activations, np.ascontiguousarray(audio[:, start : start + window*sr]), sr, kind)))
+                if len(pending) >= 2 * workers: merge(pending[0][0], pending.popleft()[1].result())
+            while len(pending) > 0: merge(pending[0][0], pending.popleft()[1].result())
+    return out[:end]
+
+def _activations(audio, sr: int, kind = 'beats', fingerprint: str = None, caching = True, window: int = None, overlap: int = 10, workers: int = 1) -> np.ndarray:
+    """RNN beat (`kind = 'beats'`) or downbeat (`kind = 'downbeats'`) activations at 100 fps. Those are the slow part of madmom trackers, 
+    so they are cached by `fingerprint` and shared by all trackers. `audio` can be a function that returns it, then it is only called if activations aren't cached.
+    
+    If `window` is set, audio is processed in overlapping windows of that many seconds, see `_windowed`. Those activations are cached under the same key as full ones."""
+    from . import cache
+    if caching is True and fingerprint is not None:
+        record = cache.activations.get(f'{fingerprint}_{kind}')
+        if record is not None: return record[0]['act']
+    if callable(audio): audio = audio()
+    _check_length(audio, sr)
+    if window is not None and len(audio[0]) > window * sr: act = _windowed(audio, sr, kind, window, overlap, workers)
+    else: act = _window_activations(audio, sr, kind)
+    if caching is True and fingerprint is not None: cache.activations.put(f'{fingerprint}_{kind}', {'act': act}, {'kind': kind, 'sr': sr, 'fps': 100, 'window': window, 'overlap': overlap if window is not None else None})
+    return act
+
+def generate(audio: np.ndarray, sr: int, lib='madmom.BeatDetectionProcessor', caching=True, filename: str = None, log = True, load_settings = True, split=None, key: str = None, fingerprint: str = None, window: int = None, overlap: int = 10, workers: int = 1, return_settings = False):
+    """Creates beatmap attribute with a list of positions of beats in samples. 
+    
+    Beatmaps are cached by audio fingerprint and `lib`, `key` and `fingerprint` can be passed if they are already known. RNN activations of madmom trackers are cached by fingerprint alone, so switching between trackers only runs the RNN once.
+    With `fingerprint`, audio can be a function that returns it, then it is only called if neither beatmap nor activations are cached.
+    
+    For long recordings, `window` makes madmom trackers compute activations in overlapping windows of that many seconds, `workers` processes them in parallel. Trackers then run once on the joined activations.
+    
+    With `return_settings`, returns `(beatmap, settings)`, where settings are the ones `settings` would return, read from the same cache record as the beatmap."""
     if log is True: print(f'Analyzing beats using {lib}; ', end='')
+    from . import cache
+    from .fingerprint import full
+    if key is None and (caching is True or load_settings is True):
+        if fingerprint is None: fingerprint = full(audio, sr)
+        key = _key(fingerprint, lib)
+    beatmap = None
+    record = None
+    saved = None
 
     # load a beatmap if it is cached:
-    if caching is True and filename is not None:
-        audio_id=hex(len(audio[0]))
-        import os
-        if not os.path.exists('beat_manipulator/beatmaps'):
-            os.mkdir('beat_manipulator/beatmaps')
-        cacheDir="beat_manipulator/beatmaps/" + ''.join(filename.replace('\\', '/').split('/')[-1]) + "_"+lib+"_"+audio_id+'.txt'
-        try: 
-            beatmap=np.loadtxt(cacheDir, dtype=int)
+    if caching is True:
+        record = cache.beatmaps.get(key)
+        if record is not None:
+            beatmap = record[0]['beatmap']
             if log is True: print('loaded cached beatmap.')
-        except OSError: 
-            if log is True:print("beatmap hasn't been generated yet. Generating...")
-            beatmap = None
+        elif log is True: print("beatmap hasn't been generated yet. Generating...")
 
     #generate the beatmap
     if beatmap is None:
+        if caching is True and fingerprint is None:
+            if callable(audio): audio = audio()
+            fingerprint = full(audio, sr)
+        # trackers that use cached activations don't need the audio if they are cached
+        if callable(audio) and (lib.split('.')[0] != 'madmom' or lib in ('madmom.PatternTrackingProcessor', 'madmom.DBNBarTrackingProcessor')): audio = audio()
         if 'madmom' in lib.lower():
             from collections.abc import MutableMapping, MutableSequence
             import madmom
-            assert len(audio[0])>sr*2, f'Audio file is too short, len={len(audio[0])} samples, or {len(audio[0])/sr} seconds. Minimum length is 2 seconds, audio below that breaks madmom processors.'
+            if not callable(audio): _check_length(audio, sr)
         if lib=='madmom.BeatTrackingProcessor':
             proc = madmom.features.beats.BeatTrackingProcessor(fps=100)
-            act = madmom.features.beats.RNNBeatProcessor()(madmom.audio.signal.Signal(audio.T, sr))
+            act = _activations(audio, sr, 'beats', fingerprint, caching, window, overlap, workers)
             beatmap= proc(act)*sr
         elif lib=='madmom.BeatTrackingProcessor.constant':
             proc = madmom.features.beats.BeatTrackingProcessor(fps=100, look_ahead=None)
-            act = madmom.features.beats.RNNBeatProcessor()(madmom.audio.signal.Signal(audio.T, sr))
+            act = _activations(audio, sr, 'beats', fingerprint, caching, window, overlap, workers)
             beatmap= proc(act)*sr
         elif lib=='madmom.BeatTrackingProcessor.consistent':
             proc = madmom.features.beats.BeatTrackingProcessor(fps=100, look_ahead=None, look_aside=0)
-            act = madmom.features.beats.RNNBeatProcessor()(madmom.audio.signal.Signal(audio.T, sr))
+            act = _activations(audio, sr, 'beats', fingerprint, caching, window, overlap, workers)
             beatmap= proc(act)*sr
         elif lib=='madmom.BeatDetectionProcessor':
             proc = madmom.features.beats.BeatDetectionProcessor(fps=100)
-            act = madmom.features.beats.RNNBeatProcessor()(madmom.audio.signal.Signal(audio.T, sr))
+            act = _activations(audio, sr, 'beats', fingerprint, caching, window, overlap, workers)
             beatmap= proc(act)*sr
         elif lib=='madmom.BeatDetectionProcessor.consistent':
             proc = madmom.features.beats.BeatDetectionProcessor(fps=100, look_aside=0)
-            act = madmom.features.beats.RNNBeatProcessor()(madmom.audio.signal.Signal(audio.T, sr))
+            act = _activations(audio, sr, 'beats', fingerprint, caching, window, overlap, workers)
             beatmap= proc(act)*sr
         elif lib=='madmom.CRFBeatDetectionProcessor':
             proc = madmom.features.beats.CRFBeatDetectionProcessor(fps=100)
-            act = madmom.features.beats.RNNBeatProcessor()(madmom.audio.signal.Signal(audio.T, sr))
+            act = _activations(audio, sr, 'beats', fingerprint, caching, window, overlap, workers)
             beatmap= proc(act)*sr
         elif lib=='madmom.CRFBeatDetectionProcessor.constant':
             proc = madmom.features.beats.CRFBeatDetectionProcessor(fps=100, use_factors=True, factors=[0.5, 1, 2])
-            act = madmom.features.beats.RNNBeatProcessor()(madmom.audio.signal.Signal(audio.T, sr))
+            act = _activations(audio, sr, 'beats', fingerprint, caching, window, overlap, workers)
             beatmap= proc(act)*sr
         elif lib=='madmom.DBNBeatTrackingProcessor':
             proc = madmom.features.beats.DBNBeatTrackingProcessor(fps=100)
-            act = madmom.features.beats.RNNBeatProcessor()(madmom.audio.signal.Signal(audio.T, sr))
+            act = _activations(audio, sr, 'beats', fingerprint, caching, window, overlap, workers)
             beatmap= proc(act)*sr
         elif lib=='madmom.DBNBeatTrackingProcessor.1000':
             proc = madmom.features.beats.DBNBeatTrackingProcessor(fps=100, transition_lambda=1000)
-            act = madmom.features.beats.RNNBeatProcessor()(madmom.audio.signal.Signal(audio.T, sr))
+            act = _activations(audio, sr, 'beats', fingerprint, caching, window, overlap, workers)
             beatmap= proc(act)*sr
         elif lib=='madmom.DBNDownBeatTrackingProcessor':
             proc = madmom.features.downbeats.DBNDownBeatTrackingProcessor(beats_per_bar=[4], fps=100)
-            act = madmom.features.downbeats.RNNDownBeatProcessor()(madmom.audio.signal.Signal(audio.T, sr))
+            act = _activations(audio, sr, 'downbeats', fingerprint, caching, window, overlap, workers)
             beatmap= proc(act)*sr
             beatmap=beatmap[:,0]
         elif lib=='madmom.PatternTrackingProcessor': #broken
@@ -136,7 +232,7 @@ def generate(audio: np.ndarray, sr: int, lib='madmom.BeatDetectionProcessor', ca
             beatmap= proc(act)*sr
             beatmap=beatmap[:,0]
         elif lib=='madmom.DBNBarTrackingProcessor': #broken
-            beats = generate(audio=audio, sr=sr, filename=filename, lib='madmom.DBNBeatTrackingProcessor', caching = caching)
+            beats = generate(audio=audio, sr=sr, filename=filename, lib='madmom.DBNBeatTrackingProcessor', caching = caching, fingerprint = fingerprint)
             proc = madmom.features.downbeats.DBNBarTrackingProcessor(beats_per_bar=[4], fps=100)
             act = madmom.features.downbeats.RNNBarProcessor()(((madmom.audio.signal.Signal(audio.T, sr)), beats))
             beatmap= proc(act)*sr
@@ -146,30 +242,31 @@ def generate(audio: np.ndarray, sr: int, lib='madmom.BeatDetectionProcessor', ca
             beatmap = librosa.frames_to_samples(beat_frames[1])
         
         # save the beatmap and return
-        if caching is True: np.savetxt(cacheDir, beatmap.astype(int), fmt='%d')
         if not isinstance(beatmap, np.ndarray): beatmap=np.asarray(beatmap, dtype=int)
         else: beatmap=beatmap.astype(int)
+        if caching is True: 
+            import os
+            cache.beatmaps.put(key, {'beatmap': beatmap}, {'lib': lib, 'sr': sr, 'samples': None if callable(audio) else len(audio[0]), 'filename': None if filename is None else os.path.basename(filename), 'settings': None})
 
     if load_settings is True:
-        settingsDir="beat_manipulator/beatmaps/" + ''.join(filename.split('/')[-1]) + "_"+lib+"_"+audio_id+'_settings.txt'
-        if os.path.exists(settingsDir):
-            with open(settingsDir, 'r') as f:
-                settings = f.read().split(',')
-            if settings[0] != 'None': beatmap = scale(beatmap, settings[0], log = False)
-            if settings[1] != 'None': beatmap = shift(beatmap, settings[1], log = False)
-            if settings[2] != 'None': beatmap = np.sort(np.absolute(beatmap - int(settings[2])))
+        saved = record[1].get('settings') if record is not None else settings(key = key)
+        if saved is not None:
+            if saved['scale'] is not None: beatmap = scale(beatmap, saved['scale'], log = False)
+            if saved['shift'] is not None: beatmap = shift(beatmap, saved['shift'], log = False)
+            if saved['adjust'] is not None: beatmap = np.sort(np.absolute(beatmap - int(saved['adjust'])))
 
+    if return_settings is True: return beatmap, saved
     return beatmap
 
 
 
-def save_settings(audio: np.ndarray, filename: str = None, lib: str = 'madmom.BeatDetectionProcessor', scale: float = None, shift: float = None, adjust: int = None, normalized: str = None, log = True, overwrite = 'ask'):
+def save_settings(audio: np.ndarray, filename: str = None, lib: str = 'madmom.BeatDetectionProcessor', scale: float = None, shift: float = None, adjust: int = None, normalized: str = None, log = True, overwrite = 'ask', key: str = None, sr: int = None):
+    """Saves settings with the cached beatmap, they are applied every time it is loaded. `sr` should be the same as when the beatmap was generated"""
     if isinstance(overwrite, str): overwrite = overwrite.lower()
-    audio_id=hex(len(audio[0]))
-    cacheDir="beat_manipulator/beatmaps/" + ''.join(filename.split('/')[-1]) + "_"+lib+"_"+audio_id+'.txt'
-    import os
-    assert os.path.exists(cacheDir), f"Beatmap `{cacheDir}` doesn't exist"
-    settingsDir="beat_manipulator/beatmaps/" + ''.join(filename.split('/')[-1]) + "_"+lib+"_"+audio_id+'_settings.txt'
+    from . import cache, fingerprint
+    if key is None: key = _key(fingerprint.full(audio, sr), lib)
+    record = cache.beatmaps.get(key)
+    assert record is not None, f"Beatmap of `{filename}` generated with `{lib}` isn't cached"
 
     try: 
         a = utils._safer_eval_strict(scale)
@@ -183,13 +280,67 @@ def save_settings(audio: np.ndarray, filename: str = None, lib: str = 'madmom.Be
     
     if adjust == 0: adjust = None
 
-    if os.path.exists(settingsDir):
+    if record[1].get('settings') is not None:
         if overwrite == 'ask' or overwrite =='a': 
-            what = input(f'`{settingsDir}` already exists. Overwrite (y/n)?: ')
+            what = input(f'Settings for `{filename}` already exist. Overwrite (y/n)?: ')
             if not (what.lower() == 'y' or what.lower() == 'yes'): return
         elif not (overwrite == 'true' or overwrite =='y' or overwrite =='yes' or overwrite is True): return
     
-    with open(settingsDir, 'w') as f:
-        f.write(f'{scale},{shift},{adjust},{normalized}')
-    if log is True: print(f"Saved scale = `{scale}`, shift = `{shift}`, adjust = `{adjust}` to `{settingsDir}`")
+    record[1]['settings'] = {'scale': scale, 'shift': shift, 'adjust': adjust, 'normalized': normalized}
+    cache.beatmaps.put(key, *record)
+    if log is True: print(f"Saved scale = `{scale}`, shift = `{shift}`, adjust = `{adjust}` for `{filename}`")
+
+def features(audio: np.ndarray, beatmap: np.ndarray, fingerprint: str = None, caching = True) -> dict:
+    """Feature table of every beat that `%` metrics are read from, see `metrics.features`. Cached by audio `fingerprint` and the beatmap itself"""
+    import hashlib
+    from . import cache, metrics
+    beatmap = np.asarray(beatmap, dtype = np.int64)
+    key = f'{fingerprint}_features_{hashlib.blake2b(beatmap.tobytes(), digest_size = 16).hexdigest()}' if fingerprint is not None else None
+    if caching is True and key is not None:
+        record = cache.features.get(key)
+        if record is not None: return record[0]
+    table = metrics.features(audio, beatmap)
+    if caching is True and key is not None: cache.features.put(key, table, {'beats': len(beatmap)})
+    return table
+
+def _warm(lib: str):
+    """Process pool initializer, creates RNN processors before the first file"""
+    try:
+        if 'downbeat' in lib.lower(): _processor('downbeats')
+        elif 'madmom' in lib.lower(): _processor('beats')
+    except Exception: pass
+
+def _generate_file(path: str, lib: str, caching = True, sampled = False):
+    from . import main
+    song = main.song(path, log = False, lazy = True, sampled = sampled)
+    song.beatmap_generate(lib = lib, caching = caching, load_settings = False)
+    return song.beatmap
+
+def generate_many(paths: list, lib = 'madmom.BeatDetectionProcessor', workers: int = None, caching = True, log = True, sampled = False) -> list:
+    """Generates beatmaps of many audio files in a process pool and caches them. Each worker creates RNN processors once and reuses them for every file.
 
+    Returns a list with a beatmap for each path, or the exception if that file failed, other files are not affected. `workers` defaults to number of CPUs, 1 runs everything in this process.
+    `sampled` identifies files by `fingerprint.sampled`, which is faster for long recordings."""
+    import os, time
+    if workers is None: workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(paths)))
+    results = [None] * len(paths)
+    start = time.perf_counter()
+    def report(i, done):
+        if log is True: print(f'[{done}/{len(paths)}] {time.perf_counter() - start:.1f}s {"failed" if isinstance(results[i], Exception) else "done"}: {paths[i]}' + (f' - {results[i]}' if isinstance(results[i], Exception) else ''))
+    if workers == 1:
+        _warm(lib)
+        for i, path in enumerate(paths):
+            try: results[i] = _generate_file(path, lib, caching, sampled)
+            except Exception as e: results[i] = e
+            report(i, i+1)
+        return results
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    with ProcessPoolExecutor(max_workers = workers, initializer = _warm, initargs = (lib,)) as pool:
+        futures = {pool.submit(_generate_file, path, lib, caching, sampled): i for i, path in enumerate(paths)}
+        for done, future in enumerate(as_completed(futures), 1):
+            i = futures[future]
+            try: results[i] = future.result()
+            except Exception as e: results[i] = e
+            report(i, done)
+    return results
@@ -0,0 +1,191 @@
+import numpy as np, os, atexit, contextlib
+# content addressed caches. Each record is one binary file named by a hash of its key,
+# an index.json keeps sizes and last use times. It is written every `save_every` writes and at exit, not on every write,
+# and directory is scanned once when the index is loaded, so records whose index entry was never saved are still evicted.
+
+def _replace(path: str, write):
+    """Calls `write(file)` on a temporary file next to `path`, then renames it to `path`, so that readers only ever see complete files"""
+    import tempfile
+    fd, temp = tempfile.mkstemp(dir = os.path.dirname(path), prefix = '.', suffix = '.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f: write(f)
+        os.replace(temp, path)
+    except BaseException:
+        if os.path.exists(temp): os.remove(temp)
+        raise
+
+@contextlib.contextmanager
+def _locked(path: str):
+    """Holds an exclusive lock on `path` file, so that one process at a time merges and writes an index"""
+    with open(path, 'a+b') as f:
+        try: import fcntl
+        except ImportError: fcntl = None
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try: yield
+            finally: fcntl.flock(f, fcntl.LOCK_UN)
+            return
+        # windows
+        import msvcrt, time
+        while True:
+            try:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                break
+            except OSError: time.sleep(0.01)
+        try: yield
+        finally:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+class store:
+    """Directory of binary records. A record is a dict of arrays plus a json-serializable `meta` dict, stored as one `.npz` file.
+    Least recently used records are deleted when total size goes above `max_size` bytes. Directory is created on first write.
+    Index is written after `save_every` writes, by `flush()` and at exit."""
+    def __init__(self, path: str, max_size: int = 2**30, save_every: int = 64):
+        self.path = path
+        self.max_size = max_size
+        self.save_every = save_every
+        self.hits = 0
+        self.misses = 0
+        self._index = None
+        self._removed = set()
+        self._unsaved = 0
+
+    def _name(self, key: str) -> str:
+        import hashlib
+        return hashlib.blake2b(key.encode(), digest_size = 20).hexdigest() + '.npz'
+
+    def _load_index(self) -> dict:
+        """index from disk, `{name: [size, last used]}`"""
+        import json
+        try:
+            with open(os.path.join(self.path, 'index.json'), 'r') as f: return json.load(f)
+        except (OSError, ValueError): return {}
+
+    @property
+    def index(self) -> dict:
+        if self._index is None:
+            self._index = self._load_index()
+            self._scan()
+        return self._index
+
+    def _scan(self):
+        """Adds records that are missing from the index, for example written by a process that exited before saving it, and drops ones that are gone"""
+        try: files = {e.name: e for e in os.scandir(self.path) if e.name.endswith('.npz') and not e.name.startswith('.')}
+        except OSError: return
+        for name in list(self._index):
+            if name not in files:
+                del self._index[name]
+                self._removed.add(name)
+                self._unsaved += 1
+        for name, e in files.items():
+            if name in self._index: continue
+            try: stat = e.stat()
+            except OSError: continue
+            self._index[name] = [stat.st_size, stat.st_mtime]
+            self._unsaved += 1
+
+    def _save_index(self):
+        """Merges index with the one on disk, which other processes might have changed, and writes it"""
+        import json
+        with _locked(os.path.join(self.path, 'index.lock')):
+            for name, (size, used) in self._load_index().items():
+                if name in self._removed: continue
+                if name not in self.index or self.index[name][1] < used: self.index[name] = [size, used]
+            self._removed.clear()
+            self._unsaved = 0
+            _replace(os.path.join(self.path, 'index.json'), lambda f: f.write(json.dumps(self._index).encode()))
+
+    def get(self, key: str):
+        """Returns `(arrays, meta)`, or None if record doesn't exist"""
+        import json, time, zipfile
+        name = self._name(key)
+        try:
+            with np.load(os.path.join(self.path, name), allow_pickle = False) as f:
+                arrays = {k: f[k] for k in f.files if k != '__meta__'}
+                meta = json.loads(str(f['__meta__']))
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile, EOFError):
+            self.misses += 1
+            if self.index.pop(name, None) is not None: self._removed.add(name)
+            return None
+        self.hits += 1
+        self.index[name] = [self.index[name][0] if name in self.index else os.path.getsize(os.path.join(self.path, name)), time.time()]
+        return arrays, meta
+
+    def put(self, key: str, arrays: dict, meta: dict = None):
+        """Writes a record, replacing the old one, then evicts least recently used records if cache is too big"""
+        import json, time
+        os.makedirs(self.path, exist_ok = True)
+        name = self._name(key)
+        path = os.path.join(self.path, name)
+        index = self.index
+        _replace(path, lambda f: np.savez(f, __meta__ = np.array(json.dumps(meta if meta is not None else {})), **arrays))
+        index[name] = [os.path.getsize(path), time.time()]
+        self._removed.discard(name)
+        self._evict(keep = name)
+        self._unsaved += 1
+        if self._unsaved >= self.save_every: self._save_index()
+
+    def _evict(self, keep: str = None):
+        size = sum(i[0] for i in self.index.values())
+        for name, (record_size, _) in sorted(self.index.items(), key = lambda i: i[1][1]):
+            if size <= self.max_size: break
+            if name == keep: continue
+            try: os.remove(os.path.join(self.path, name))
+            except OSError: pass
+            del self.index[name]
+            self._removed.add(name)
+            size -= record_size
+
+    def remove(self, key: str):
+        name = self._name(key)
+        try: os.remove(os.path.join(self.path, name))
+        except OSError: pass
+        self.index.pop(name, None)
+        self._removed.add(name)
+        self._unsaved += 1
+
+    def flush(self):
+        """Writes the index with records written and read since the last write"""
+        if self._index is not None and os.path.isdir(self.path): self._save_index()
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'records': len(self.index), 'size': sum(i[0] for i in self.index.values()), 'max_size': self.max_size}
+
+def _user_dir() -> str:
+    """Cache directory of the user, `%LOCALAPPDATA%` on windows, `~/Library/Caches` on mac, `$XDG_CACHE_HOME` or `~/.cache` elsewhere"""
+    import sys
+    if sys.platform == 'win32': root = os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), 'AppData', 'Local')
+    elif sys.platform == 'darwin': root = os.path.join(os.path.expanduser('~'), 'Library', 'Caches')
+    else: root = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(root, 'beat_manipulator')
+
+# caches are in the user cache directory, unless `BM_CACHE` environment variable or `directory` puts them somewhere else
+DIR = os.environ.get('BM_CACHE') or _user_dir()
+
+# beatmaps with their settings and detector
+beatmaps = store(os.path.join(DIR, 'beatmaps'), max_size = 256 * 2**20)
+# RNN beat and downbeat activations of madmom trackers
+activations = store(os.path.join(DIR, 'activations'), max_size = 256 * 2**20)
+# feature tables of beats that `%` metrics read, by fingerprint and beatmap
+features = store(os.path.join(DIR, 'features'), max_size = 256 * 2**20)
+# fingerprints of audio files by path, size, modification time and header, so that lazy songs don't have to be decoded
+fingerprints = store(os.path.join(DIR, 'fingerprints'), max_size = 16 * 2**20)
+
+def directory(path: str):
+    """Moves all caches to `path`, records in the old directory are left there"""
+    global DIR
+    DIR = path
+    for name, s in (('beatmaps', beatmaps), ('activations', activations), ('features', features), ('fingerprints', fingerprints)):
+        s.flush()
+        s.path = os.path.join(path, name)
+        s._index = None
+        s._removed.clear()
+        s._unsaved = 0
+
+def flush():
+    """Writes indexes of all caches"""
+    for s in (beatmaps, activations, features, fingerprints): s.flush()
+
+atexit.register(flush)
@@ -1,8 +1,8 @@
 import numpy as np
-from . import io
 
 def deco_abs(effect):
     def stuff(*args, **kwargs):
+        from . import io
         if len(args)>0: audio = args[0]
         else: audio = kwargs['audio']
         if not isinstance(audio, np.ndarray): audio = io._load(audio)
@@ -16,30 +16,73 @@ def deco_abs(effect):
 
 
 
-def volume(audio: np.ndarray, v: float):
-    return audio*v
+def volume(audio: np.ndarray, v: float = 0, out: np.ndarray = None):
+    if v is None: v = 0
+    return np.multiply(audio, v, out = out)
 
-def speed(audio: np.ndarray, s: float = 2, precision:int = 24):
+# default quality of `speed`, `quality` argument of `speed` and `song.beatswap` sets it per call: "nearest" repeats and skips samples like it always did, 
+# "linear" interpolates between them, "sinc" is polyphase resampling with a windowed sinc lowpass, which doesn't alias but is slower
+SPEED_QUALITY = 'nearest'
+# lowpass filters for "sinc" speed, by (numerator, denominator) of the speed ratio
+_filters = {}
+
+def _ratio(s: float, precision:int = 24) -> tuple:
+    """`s` as (numerator, denominator), same rounding as speed always used"""
     if s%1 != 0 and (1/s)%1 != 0:
         import fractions
         s = fractions.Fraction(s).limit_denominator(precision)
-        audio = np.repeat(audio, s.denominator, axis=1)
-        return audio[:,::s.numerator]
-    elif s%1 == 0:
-        return audio[:,::int(s)]
+        return s.numerator, s.denominator
+    elif s%1 == 0: return int(s), 1
+    else: return 1, int(1/s)
+
+def _filter(num: int, den: int) -> np.ndarray:
+    if (num, den) not in _filters:
+        import scipy.signal
+        rate = max(num, den)
+        _filters[(num, den)] = scipy.signal.firwin(20 * rate + 1, 1 / rate, window = ('kaiser', 5.0))
+    return _filters[(num, den)]
+
+def speed(audio: np.ndarray, s: float = 2, precision:int = 24, quality: str = None):
+    """Changes speed and pitch by `s` by resampling. Output always has `ceil(length * den / num)` samples, where `num/den` is `|s|` as a fraction, negative `s` also reverses it.
+    
+    `quality` is "nearest", "linear" or "sinc", `SPEED_QUALITY` by default."""
+    # reversed before resampling, so that the last sample is kept, like stepping backwards through the audio always did
+    if s < 0: return speed(audio[:, ::-1], -s, precision, quality)
+    if quality is None: quality = SPEED_QUALITY
+    assert quality in ('nearest', 'linear', 'sinc'), f'unknown speed quality "{quality}", use "nearest", "linear" or "sinc"'
+    num, den = _ratio(s, precision)
+    length = audio.shape[1]
+    out_length = -(-length * den // num)
+    if quality == 'nearest':
+        if den == 1: return audio[:,::num]
+        if num == 1: return np.repeat(audio, den, axis=1)
+        return audio[:, np.arange(out_length) * num // den]
+    elif quality == 'linear':
+        if den == 1: return audio[:,::num]
+        position = np.arange(out_length) * (num / den)
+        left = position.astype(np.int64)
+        right = np.minimum(left + 1, length - 1)
+        fraction = (position - left).astype(audio.dtype)
+        return audio[:, left] + (audio[:, right] - audio[:, left]) * fraction
     else:
-        return np.repeat(audio, int(1/s), axis=1)
+        if num == den: return audio
+        import scipy.signal
+        return scipy.signal.resample_poly(audio, den, num, axis = 1, window = _filter(num, den)).astype(audio.dtype, copy = False)
 
-def channel(audio: np.ndarray, c:int = None):
+def channel(audio: np.ndarray, c:int = None, out: np.ndarray = None):
+    """Swaps channels, or mutes channel `c`. Modifies `audio` in place, unless `out` is given"""
+    if out is None: out = audio
+    elif out is not audio and np.may_share_memory(audio, out): audio = audio.copy()
     if c is None:
-        audio[0], audio[1] = audio[1], audio[0]
-        return audio
-    elif c == 0:
-        audio[0] = 0
-        return audio
-    else:
-        audio[1] = 0
-        return audio
+        left = audio[0].copy() if out is audio else audio[0]
+        out[0] = audio[1]
+        out[1] = left
+        return out
+    muted = 0 if c == 0 else 1
+    for i in range(len(out)):
+        if i == muted: out[i] = 0
+        elif out is not audio: out[i] = audio[i]
+    return out
     
 def downsample(audio: np.ndarray, d:int = 10):
     return np.repeat(audio[:,::d], d, axis=1)
@@ -49,11 +92,11 @@ def gradient(audio: np.ndarray, number: int = 1):
         audio = np.gradient(audio, axis=1)
     return audio
 
-def bitcrush(audio: np.ndarray, b:float = 4):
+def bitcrush(audio: np.ndarray, b:float = 4, out: np.ndarray = None):
     if 1/b > 1:
-        return np.around(audio, decimals=int(1/b))
+        return np.around(audio, decimals=int(1/b), out = out)
     else: 
-        return np.around(audio*b, decimals = 1)
+        return np.around(np.multiply(audio, b, out = out), decimals = 1, out = out)
 
 def reverse(audio: np.ndarray):
     return audio[:,::-1]
@@ -61,14 +104,26 @@ def reverse(audio: np.ndarray):
 def normalize(audio: np.ndarray):
     return audio*(1/np.max(np.abs(audio)))
 
-def clip(audio: np.ndarray):
-    return np.clip(audio, -1, 1)
+def clip(audio: np.ndarray, v = None, out: np.ndarray = None):
+    return np.clip(audio, -1, 1, out = out)
 
-def to_sidechain(audio: np.ndarray):
+def to_sidechain(audio: np.ndarray, attack: int = 500, release: int = 500):
+    """Ducking envelope of `audio`, `|1 - sum of |audio| around each sample|`. The window starts ducking `attack` samples before a hit and lets go `release` samples after it,
+    defaults are the 1000 sample box that was always used. Moving sum is done with a cumulative sum, so it's O(N) for any window."""
     audio = np.clip(np.abs(audio), -1, 1)
-    for channel in range(len(audio)):
-        audio[channel] = np.abs(1 - np.convolve(audio[channel], np.ones(shape=(1000)), mode = 'same'))
-    return audio
+    length = audio.shape[1]
+    total = np.zeros((len(audio), length + 1))
+    np.cumsum(audio, axis = 1, out = total[:, 1:])
+    # sum of [i - release, i + attack), clamped to the audio
+    window = np.empty((len(audio), length))
+    ahead = max(length - attack, 0)
+    window[:, :ahead] = total[:, attack:attack + ahead]
+    window[:, ahead:] = total[:, length:]
+    behind = min(release, length)
+    window[:, :behind] -= total[:, :1]
+    window[:, behind:] -= total[:, :length - behind]
+    window -= 1
+    return np.abs(window).astype(audio.dtype, copy = False)
 
 
 
@@ -81,4 +136,74 @@ BM_EFFECTS = {
     "g": "gradient",
     "b": bitcrush,
     "r": "reverse",
-}
\ No newline at end of file
+}
+
+class capabilities:
+    """What renderer can assume about an effect, so that it can run effect chains without copying the beat every step.
+
+    `length` - output is as long as input. `pointwise` - every sample only depends on itself. 
+    `kernel` - `kernel(audio, v, out)` writes the result into `out`, which can be `audio` itself, instead of allocating.
+    `mutates` - calling the effect can modify its input, so it never gets a view of the song.
+    `batch` - effect has `batch(beats, values, reset)`, which processes consecutive beats as one continuous stream."""
+    def __init__(self, length = False, pointwise = False, kernel = None, mutates = False, batch = False):
+        self.length = length
+        self.pointwise = pointwise
+        self.kernel = kernel
+        self.mutates = mutates
+        self.batch = batch
+
+# by effect, both the ones in BM_EFFECTS and clip, which renderer applies to every beat. 
+# Effects that aren't here use their `capabilities` attribute, or are treated as `capabilities(mutates = True)` if they don't have one
+BM_CAPABILITIES = {
+    "volume": capabilities(length = True, pointwise = True, kernel = volume),
+    speed: capabilities(),
+    channel: capabilities(length = True, kernel = channel, mutates = True),
+    "downsample": capabilities(),
+    "gradient": capabilities(length = True),
+    bitcrush: capabilities(length = True, pointwise = True, kernel = bitcrush),
+    "reverse": capabilities(length = True),
+    clip: capabilities(length = True, pointwise = True, kernel = clip),
+}
+
+def register(letter: str, effect, length = False, pointwise = False, kernel = None, mutates = True, batch = False):
+    """Adds an effect to `BM_EFFECTS` under `letter`, with its capabilities. `effect(audio, v)` returns the processed audio"""
+    BM_EFFECTS[letter] = effect
+    BM_CAPABILITIES[effect] = capabilities(length = length, pointwise = pointwise, kernel = kernel, mutates = mutates, batch = batch)
+
+class plugin_chain:
+    """Pedalboard plugins as an effect, for example `BM_EFFECTS['R'] = plugin_chain(pedalboard.Reverb(), sr = song.sr)`, then `1R, 2, 3R, 4R`.
+    Value of the effect is how much of the processed beat is mixed in, 1 by default.
+    
+    Renderer joins consecutive beats with the same effect chain and processes them with one plugin call, so reverb tails
+    and compressor state carry over from one beat to the next, and plugin overhead is paid once per run of beats."""
+    capabilities = capabilities(length = True, batch = True)
+    def __init__(self, *plugins, sr: int = 44100):
+        import threading
+        self.plugins = plugins
+        self.sr = sr
+        self._board = None
+        self._lock = threading.Lock()
+
+    @property
+    def board(self):
+        if self._board is None:
+            import pedalboard
+            self._board = self.plugins[0] if len(self.plugins) == 1 and isinstance(self.plugins[0], pedalboard.Pedalboard) else pedalboard.Pedalboard(list(self.plugins))
+        return self._board
+
+    def batch(self, beats: list, values: list, reset: bool = True) -> list:
+        """Processes beats as one continuous stream in one plugin call and splits it back. Plugins keep their state from the previous call unless `reset`"""
+        lengths = [len(beat[0]) for beat in beats]
+        audio = np.ascontiguousarray(np.concatenate(beats, axis = 1) if len(beats) > 1 else beats[0], dtype = np.float32)
+        with self._lock: processed = self.board(audio, self.sr, reset = reset)
+        # plugins with latency can return less audio than they were given
+        missing = len(audio[0]) - len(processed[0])
+        if missing > 0: processed = np.concatenate((np.zeros((len(processed), missing), dtype = processed.dtype), processed), axis = 1)
+        elif missing < 0: processed = processed[:, :len(audio[0])]
+        result = np.split(processed, np.cumsum(lengths[:-1]), axis = 1)
+        for i, v in enumerate(values):
+            if v is not None and v != 1: result[i] = result[i] * v + beats[i] * (1 - v)
+        return result
+
+    def __call__(self, audio: np.ndarray, v: float = None):
+        return self.batch([audio], [v])[0]
@@ -0,0 +1,31 @@
+import numpy as np
+# audio fingerprints, used as cache keys. Audio is hashed as 16 bit PCM, so float noise far below
+# what a file can store doesn't change the fingerprint, and same audio always gets the same one no matter where it came from.
+
+BLOCK = 2**16
+
+def _pcm(audio: np.ndarray) -> np.ndarray:
+    """16 bit PCM of float audio, computed in float64 so that float32 and float64 copies of same audio agree. Other types stay the same"""
+    if np.issubdtype(audio.dtype, np.floating): return np.ascontiguousarray(np.round(np.clip(audio.astype(np.float64), -1, 1) * 32767).astype(np.int16))
+    return np.ascontiguousarray(audio)
+
+def _hash(mode: str, audio: np.ndarray, sr: int = None):
+    import hashlib
+    return hashlib.blake2b(f'{mode},{audio.shape},{sr}'.encode(), digest_size = 16)
+
+def full(audio: np.ndarray, sr: int = None) -> str:
+    """Hashes all of the audio, `BLOCK` samples at a time"""
+    audio = np.asarray(audio)
+    h = _hash('full', audio, sr)
+    for i in range(0, audio.shape[-1], BLOCK): h.update(_pcm(audio[..., i:i+BLOCK]).data)
+    return h.hexdigest()
+
+def sampled(audio: np.ndarray, sr: int = None, blocks: int = 64, size: int = 4096) -> str:
+    """Hashes shape, sample rate and `blocks` evenly spaced blocks of `size` samples. Much faster for long audio, but only notices changes inside those blocks.
+    Audio that is shorter than all blocks combined gets the `full` fingerprint."""
+    audio = np.asarray(audio)
+    length = audio.shape[-1]
+    if length <= blocks * size: return full(audio, sr)
+    h = _hash('sampled', audio, sr)
+    for i in np.linspace(0, length - size, blocks).astype(np.int64): h.update(_pcm(audio[..., i:i+size]).data)
+    return h.hexdigest()
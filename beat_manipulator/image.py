@@ -67,4 +67,6 @@ def write(image, output, mode = 'r', max_size = 4096, rotate = True, contrast=1)
     image = image*(255*contrast)
     image = cv2.resize(src=image, dsize=(w, h), interpolation = cv2.INTER_NEAREST)
     if rotate is True: image = np.rot90(image)
+    import os
+    if os.path.dirname(output) != '': os.makedirs(os.path.dirname(output), exist_ok=True)
     cv2.imwrite(output, image)
@@ -1,8 +1,132 @@
 
-import numpy as np
+import numpy as np, os
 from . import main
 
-def open_audio(path:str = None, lib:str = 'auto', normalize = True) -> tuple:
+# directory for decoded audio, set it to enable the decode cache
+decode_cache: str = None
+
+def _decoded_name(path: str, normalize) -> tuple:
+    """(prefix, name) of decoded audio in the cache, files are named `{name}_{decoder}_{samplerate}.npy`.
+    Prefix depends on file path, name also on file size and modification time"""
+    import hashlib
+    stat = os.stat(path)
+    prefix = hashlib.blake2b(f'{os.path.abspath(path)},{normalize}'.encode(), digest_size = 16).hexdigest()
+    return prefix, f'{prefix}_{hashlib.blake2b(f"{stat.st_size},{stat.st_mtime_ns}".encode(), digest_size = 8).hexdigest()}'
+
+def _decoded_get(path: str, libs: list, normalize, cache: str):
+    """(audio, samplerate) from the cache with audio as a copy-on-write memory map, or None. Audio of the first decoder in `libs` that is in the cache is used"""
+    import glob
+    try:
+        _, name = _decoded_name(path, normalize)
+        for lib in libs:
+            for i in glob.glob(os.path.join(glob.escape(cache), f'{name}_{glob.escape(lib)}_*.npy')):
+                return np.load(i, mmap_mode = 'c', allow_pickle = False), int(i[:-4].split('_')[-1])
+    except (OSError, ValueError): return None
+
+def _decoded_put(path: str, lib: str, normalize, cache: str, audio: np.ndarray, sr: int):
+    """Writes audio that `lib` decoded to the cache and removes older versions of the same file"""
+    import glob
+    from .cache import _replace
+    os.makedirs(cache, exist_ok = True)
+    prefix, name = _decoded_name(path, normalize)
+    name = f'{name}_{lib}_{sr}.npy'
+    _replace(os.path.join(cache, name), lambda f: np.save(f, audio, allow_pickle = False))
+    for i in glob.glob(os.path.join(glob.escape(cache), f'{prefix}_*.npy')):
+        if os.path.basename(i) != name:
+            try: os.remove(i)
+            except OSError: pass
+
+def info(path: str) -> tuple:
+    """(frames, samplerate) from file header without decoding the audio, or None if it can't be read"""
+    try:
+        import soundfile
+        i = soundfile.info(path)
+        return i.frames, i.samplerate
+    except Exception: pass
+    try:
+        import pedalboard.io
+        with pedalboard.io.AudioFile(path) as f: return f.frames, f.samplerate
+    except Exception: pass
+    return None
+
+# decoders, each returns (audio, samplerate) with channels first
+def _pedalboard(path):
+    import pedalboard.io
+    with pedalboard.io.AudioFile(path) as f: return f.read(f.frames), f.samplerate
+
+def _librosa(path):
+    import librosa
+    return librosa.load(path, sr=None, mono=False)
+
+def _soundfile(path):
+    import soundfile
+    audio, sr = soundfile.read(path)
+    return audio.T, sr
+
+def _madmom(path):
+    import madmom
+    audio, sr = madmom.io.audio.load_audio_file(path, dtype=float)
+    return audio.T, sr
+
+decoders = {'soundfile': _soundfile, 'pedalboard.io': _pedalboard, 'librosa': _librosa, 'madmom': _madmom}
+
+# order in which decoders are tried for each format, fastest native readers first. madmom spawns ffmpeg, so it is always last
+_order = {
+    'wav': ('soundfile', 'pedalboard.io', 'librosa', 'madmom'),
+    'flac': ('soundfile', 'pedalboard.io', 'librosa', 'madmom'),
+    'aiff': ('soundfile', 'pedalboard.io', 'librosa', 'madmom'),
+    'ogg': ('soundfile', 'pedalboard.io', 'librosa', 'madmom'),
+    'mp3': ('pedalboard.io', 'soundfile', 'librosa', 'madmom'),
+    None: ('pedalboard.io', 'librosa', 'madmom', 'soundfile'),
+}
+# formats that soundfile reads natively, they always go to soundfile first
+_native = ('wav', 'flac', 'aiff', 'ogg')
+# decoder that last worked for each format that isn't native
+_remembered = {}
+# decoder name: [files decoded, failures, frames, seconds]
+_stats = {}
+
+def _format(path: str) -> str:
+    """Audio format from magic bytes, or from extension if they are unknown"""
+    try:
+        with open(path, 'rb') as f: head = f.read(12)
+    except OSError: head = b''
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE': return 'wav'
+    if head[:4] == b'fLaC': return 'flac'
+    if head[:4] == b'OggS': return 'ogg'
+    if head[:4] == b'FORM' and head[8:11] == b'AIF': return 'aiff'
+    if head[:3] == b'ID3' or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0 and head[1] & 0x06 != 0): return 'mp3'
+    if head[4:8] == b'ftyp': return 'mp4'
+    ext = os.path.splitext(path)[1][1:].lower()
+    return {'wave': 'wav', 'aif': 'aiff', 'oga': 'ogg', 'opus': 'ogg', 'm4a': 'mp4', 'aac': 'mp4'}.get(ext, ext) or None
+
+def _decoders_for(fmt: str) -> list:
+    """Installed decoders in the order they should be tried for a format. For formats that soundfile doesn't read natively, the one that last worked goes first"""
+    import importlib.util
+    order = list(_order.get(fmt, _order[None]))
+    if fmt in _remembered and fmt not in _native: order.insert(0, order.pop(order.index(_remembered[fmt])))
+    return [i for i in order if importlib.util.find_spec(i.split('.')[0]) is not None]
+
+def _decode(path: str, lib: str) -> tuple:
+    """Decodes with one decoder and records its throughput"""
+    import time
+    assert lib in decoders, f'`{lib}` is not a decoder, available decoders are {list(decoders)} and `auto`'
+    stats = _stats.setdefault(lib, [0, 0, 0, 0.])
+    start = time.perf_counter()
+    try: audio, sr = decoders[lib](path)
+    except Exception:
+        stats[1] += 1
+        raise
+    stats[0] += 1
+    stats[2] += np.shape(audio)[-1]
+    stats[3] += time.perf_counter() - start
+    return audio, sr
+
+def decoder_info() -> dict:
+    """Files decoded, failures, frames decoded and frames per second of each decoder that has been used"""
+    return {k: {'decoded': v[0], 'failed': v[1], 'frames': v[2], 'fps': v[2] / v[3] if v[3] > 0 else None} for k, v in _stats.items()}
+
+def open_audio(path:str = None, lib:str = 'auto', normalize = True, cache: str = None) -> tuple:
     """Opens audio from path, returns (audio, samplerate) tuple.
     
     Audio is returned as an array with normal volume range between -1, 1.
@@ -13,7 +137,9 @@ def open_audio(path:str = None, lib:str = 'auto', normalize = True) -> tuple:
         [0.35, -0.25, ... -0.15, -0.15], 
     
         [0.31, -0.21, ... -0.11, -0.07]
-    ]"""
+    ]
+    
+    `cache` is a directory where decoded audio is saved as `.npy`, defaults to `io.decode_cache`, False disables it. If file path, size and modification time are the same, and audio was decoded by `lib` or by a decoder that `auto` would try, it is memory mapped from there instead of decoded. Memory map is copy-on-write, changes to it never reach the file."""
 
     if path is None:
         from tkinter.filedialog import askopenfilename
@@ -21,48 +147,45 @@ def open_audio(path:str = None, lib:str = 'auto', normalize = True) -> tuple:
     
     path=path.replace('\\', '/')
 
-    if lib=='pedalboard.io':
-        import pedalboard.io
-        with pedalboard.io.AudioFile(path) as f:
-            audio = f.read(f.frames)
-            sr = f.samplerate
-    
-    elif lib=='librosa':
-        import librosa
-        audio, sr = librosa.load(path, sr=None, mono=False)
-    
-    elif lib=='soundfile':
-        import soundfile
-        audio, sr = soundfile.read(path)
-        audio=audio.T
-    
-    elif lib=='madmom':
-        import madmom
-        audio, sr = madmom.io.audio.load_audio_file(path, dtype=float)
-        audio=audio.T
-    
-    # elif lib=='pydub':
-    #     from pydub import AudioSegment
-    #     song=AudioSegment.from_file(filename)
-    #     audio = song.get_array_of_samples()
-    #     samplerate=song.frame_rate
-    #     print(audio)
-    #     print(filename)
-
-    elif lib=='auto':
-        for i in ('madmom', 'soundfile', 'librosa', 'pedalboard.io'):
-            try: 
-                audio,sr=open_audio(path, i)
+    if cache is None: cache = decode_cache
+    elif cache is False: cache = None
+    if lib=='auto': fmt = _format(path)
+    if cache is not None:
+        decoded = _decoded_get(path, _decoders_for(fmt) if lib == 'auto' else [lib], normalize, cache)
+        if decoded is not None: return decoded
+
+    if lib=='auto':
+        errors = []
+        for i in _decoders_for(fmt):
+            try:
+                audio,sr=_decode(path, i)
+                if fmt not in _native: _remembered[fmt] = i
+                lib = i
                 break
-            except Exception as e:
-                print(f'open_audio with {i}: {e}')
-    
+            except Exception as e: errors.append(f'{i}: {e}')
+        else: assert False, f'Failed to open `{path}`, ' + ('; '.join(errors) if len(errors) > 0 else 'no audio libraries are installed')
+    else: audio,sr=_decode(path, lib)
+
     if len(audio)>16: audio=np.array([audio, audio], copy=False)
     if normalize is True: 
         audio = np.clip(audio, -1, 1)
         audio = audio*(1/np.max(np.abs(audio)))
-    return audio.astype(np.float32),sr
+    audio = audio.astype(np.float32)
+    # keyed on the decoder that was used, `auto` can pick another one when decoders are installed or fail
+    if cache is not None: _decoded_put(path, lib, normalize, cache, audio, sr)
+    return audio,sr
     
+def blocks(path: str, block: int = 4096):
+    """Generator of float32 `(channels, block)` arrays read from an audio file, the last one can be shorter. Stands in for live input, audio isn't normalized."""
+    import importlib.util
+    if importlib.util.find_spec('soundfile') is not None and _format(path) in _native:
+        import soundfile
+        for i in soundfile.blocks(path, blocksize = block, dtype = 'float32', always_2d = True): yield i.T
+    else:
+        import pedalboard.io
+        with pedalboard.io.AudioFile(path) as f:
+            while f.tell() < f.frames: yield f.read(block)
+
 def _sr(sr):
     try: return int(sr)
     except (ValueError, TypeError): assert False, f"Audio is an array, but `sr` argument is not valid. If audio is an array, you have to provide samplerate as an integer in the `sr` argument. Currently sr = {sr} of type {type(sr)}"
@@ -73,6 +196,7 @@ def write_audio(audio:np.ndarray, sr:int, output:str, lib:str='auto', libs=('ped
         assert _iterable(audio), f"audio should be an array/iterable object, but it is {type(audio)}"
         sr = _sr(sr)
         if not isinstance(audio, np.ndarray): audio = np.array(audio, copy=False)
+        if os.path.dirname(output) != '': os.makedirs(os.path.dirname(output), exist_ok=True)
         if lib=='pedalboard.io':
             #print(audio)
             import pedalboard.io
@@ -1,29 +1,97 @@
-import numpy as np, scipy.interpolate
+import numpy as np
 from . import io, utils
 from .effects import BM_EFFECTS
 from .metrics import BM_METRICS
-from .presets import BM_SAMPLES
+from .utils import BM_SAMPLES
 import os
-if not os.path.isdir('output'):os.mkdir('output')
 
 class song:
-    def __init__(self, audio = None, sr:int=None, log=True):
+    _audio = None
+    _lazy = None
+    # whether beatmap was generated with caching, feature tables of `%` metrics are only cached if it was
+    caching = False
+    def __init__(self, audio = None, sr:int=None, log=True, lazy = False, sampled = False):
+        """If `lazy` is True and audio is a path, only file header is read, audio is decoded on first access to `song.audio`.
+        Fingerprint and cached beatmaps of a file that was opened before are then found without decoding it.
+        
+        If `sampled` is True, fingerprint only hashes evenly spaced blocks of audio, see `fingerprint.sampled`. It is much faster for long audio, but changes outside those blocks aren't noticed."""
+        self._sampled = sampled
+        # audio of a lazy song is None until first access. `_decoded` is True while audio is what was decoded from the file, fingerprint is forgotten when audio is replaced
+        self._audio = None
+        self._decoded = False
+        self._fingerprint = None
         if audio is None: 
             from tkinter import filedialog
             audio = filedialog.askopenfilename()
 
         if isinstance(audio, song): self.path = audio.path
-        self.audio, self.sr = io._load(audio=audio, sr=sr)
-
-        # unique filename is needed to generate/compare filenames for cached beatmaps
+        if lazy is True and isinstance(audio, str) and (header := io.info(audio)) is not None:
+            stat = os.stat(audio)
+            # path, key of the file in fingerprint cache, frames
+            self._lazy = (audio, f'{os.path.abspath(audio)},{stat.st_size},{stat.st_mtime_ns},{header[0]},{header[1]}' + (',sampled' if sampled is True else ''), header[0])
+            self.sr = header[1]
+        else: self.audio, self.sr = io._load(audio=audio, sr=sr)
+
+        # unique filename for output files
         if isinstance(audio, str):
             self.path = audio
         elif not isinstance(audio, song):
-            self.path = f'unknown_{hex(int(np.sum(self.audio) * 10**18))}'
+            self.path = f'unknown_{self.fingerprint[:16]}'
 
         self.log = log
         self.beatmap = None
         self.normalized = None
+        # feature tables of `%` metrics, shared by renders in `beatswap_many` threads
+        import threading
+        self._features = {}
+        self._features_lock = threading.Lock()
+
+    def __getstate__(self):
+        # locks can't be pickled or copied, every copy gets its own
+        state = self.__dict__.copy()
+        del state['_features_lock']
+        return state
+
+    def __setstate__(self, state):
+        import threading
+        self.__dict__.update(state)
+        # tables are shared, but not the dict that a copy adds its own tables to
+        self._features = dict(self._features)
+        self._features_lock = threading.Lock()
+
+    @property
+    def audio(self):
+        if self._audio is None and self._lazy is not None:
+            self._audio, self.sr = io._load(audio=self._lazy[0])
+            self._decoded = True
+        return self._audio
+
+    @audio.setter
+    def audio(self, audio):
+        self._audio = audio
+        self._decoded = False
+        self._fingerprint = None
+
+    @property
+    def frames(self) -> int:
+        """Length of audio in samples, taken from file header if audio isn't decoded yet"""
+        if self._audio is None and self._lazy is not None: return self._lazy[2]
+        return len(self.audio[0])
+
+    @property
+    def fingerprint(self) -> str:
+        """Hash of song audio and sample rate that caches use as key, see `fingerprint.full` and `fingerprint.sampled`. Computed again when `audio` is replaced"""
+        from . import cache
+        # lazy song that hasn't been decoded yet
+        if self._audio is None and self._lazy is not None:
+            record = cache.fingerprints.get(self._lazy[1])
+            if record is not None: return record[1]['fingerprint']
+        if self._fingerprint is None:
+            from . import fingerprint
+            self._fingerprint = (fingerprint.sampled if self._sampled is True else fingerprint.full)(self.audio, self.sr)
+            # audio is still what was decoded from the file
+            if self._lazy is not None and self._decoded is True: cache.fingerprints.put(self._lazy[1], {}, {'fingerprint': self._fingerprint})
+        return self._fingerprint
 
     def _slice(self, a):
         if a is None: return None
@@ -122,19 +190,30 @@ class song:
         return output
 
 
-    def beatmap_generate(self, lib='madmom.BeatDetectionProcessor', caching = True, load_settings = True):
-        """Find beat positions"""
+    def beatmap_generate(self, lib='madmom.BeatDetectionProcessor', caching = True, load_settings = True, window: int = None, workers: int = 1):
+        """Find beat positions. `window` in seconds splits long audio into overlapping windows for madmom trackers, see `beatmap.generate`"""
         from . import beatmap
-        self.beatmap = beatmap.generate(audio = self.audio, sr = self.sr, lib=lib, caching=caching, filename = self.path, log = self.log, load_settings = load_settings)
-        if load_settings is True:
-            audio_id=hex(len(self.audio[0]))
-            settingsDir="beat_manipulator/beatmaps/" + ''.join(self.path.split('/')[-1]) + "_"+lib+"_"+audio_id+'_settings.txt'
-            if os.path.exists(settingsDir):
-                with open(settingsDir, 'r') as f:
-                    settings = f.read().split(',')
-                if settings[3] != None: self.normalized = settings[3]
+        fingerprint = self.fingerprint
+        key = beatmap._key(fingerprint, lib)
+        self.beatmap, settings = beatmap.generate(audio = self.audio if self._audio is not None else (lambda: self.audio), sr = self.sr, lib=lib, caching=caching, filename = self.path, log = self.log, load_settings = load_settings, key = key, fingerprint = fingerprint, window = window, workers = workers, return_settings = True)
+        if settings is not None and settings['normalized'] is not None: self.normalized = settings['normalized']
         self.beatmap_default = self.beatmap.copy()
         self.lib = lib
+        self.caching = caching
+
+    def beat_features(self, beatmap = None, caching = None) -> dict:
+        """Feature table of every beat of `beatmap` (song beatmap by default) that `%` metrics are read from, see `metrics.features`. 
+        Tables of last used beatmaps are kept in memory. They are cached with beatmaps if `caching` is True, by default if song beatmap was generated with caching"""
+        if caching is None: caching = self.caching
+        from . import beatmap as bm
+        beatmap = np.asarray(self.beatmap if beatmap is None else beatmap, dtype = np.int64)
+        key = (self.fingerprint, beatmap.tobytes())
+        # threads that need the same table wait for the one that computes it
+        with self._features_lock:
+            if key not in self._features:
+                if len(self._features) >= 16: del self._features[next(iter(self._features))]
+                self._features[key] = bm.features(self.audio, beatmap, fingerprint = self.fingerprint, caching = caching)
+            return self._features[key]
 
     def beatmap_scale(self, scale:float):
         from . import beatmap
@@ -153,11 +232,11 @@ class song:
     def beatmap_save_settings(self, scale: float = None, shift: float = None, adjust: int = None, normalized = None, overwrite = 'ask'):
         from . import beatmap
         if self.beatmap is None: self.beatmap_generate()
-        beatmap.save_settings(audio = self.audio, filename = self.path, scale = scale, shift = shift,adjust = adjust, normalized = normalized, log=self.log, overwrite=overwrite, lib = self.lib)
+        beatmap.save_settings(audio = self.audio, filename = self.path, scale = scale, shift = shift,adjust = adjust, normalized = normalized, log=self.log, overwrite=overwrite, lib = self.lib, key = beatmap._key(self.fingerprint, self.lib))
 
     def beatswap(self, pattern = '1;"cowbell"s3v2, 2;"cowbell"s2, 3;"cowbell", 4;"cowbell"s0.5, 5;"cowbell"s0.25, 6;"cowbell"s0.4, 7;"cowbell"s0.8, 8;"cowbell"s1.6', 
-        scale:float = 1, shift:float = 0, length = None, samples:dict = BM_SAMPLES, effects:dict = BM_EFFECTS, metrics:dict = BM_METRICS, smoothing: int = 100, adjust=500, return_audio = False, normalize = False, limit_beats=10000, limit_length = 52920000):
-        
+        scale:float = 1, shift:float = 0, length = None, samples:dict = BM_SAMPLES, effects:dict = BM_EFFECTS, metrics:dict = BM_METRICS, smoothing: int = 100, adjust=500, return_audio = False, normalize = False, limit_beats=10000, limit_length = 52920000, quality: str = None):
+        """`quality` of the speed effect is "nearest", "linear" or "sinc", `effects.SPEED_QUALITY` by default"""
         if normalize is True:
             self.normalize_beats()
         if self.beatmap is None: self.beatmap_generate()
@@ -184,310 +263,144 @@ class song:
             random.shuffle(beats)
             beats = ','.join(list(str(i) for i in beats))
             if return_audio is False:
-                self.beatswap(beats)
+                self.beatswap(beats, quality = quality)
                 self.beatmap = beatmap_default.copy()
                 return
             else:
-                result = self.beatswap(beats, return_audio = True)
+                result = self.beatswap(beats, return_audio = True, quality = quality)
                 self.beatmap = beatmap_default.copy()
                 return result
         # test
         elif pattern.lower() == 'test':
             if return_audio is False:
-                self.beatswap('1;"cowbell"s3v2, 2;"cowbell"s2, 3;"cowbell", 4;"cowbell"s0.5, 5;"cowbell"s0.25, 6;"cowbell"s0.4, 7;"cowbell"s0.8, 8;"cowbell"s1.6')
+                self.beatswap('1;"cowbell"s3v2, 2;"cowbell"s2, 3;"cowbell", 4;"cowbell"s0.5, 5;"cowbell"s0.25, 6;"cowbell"s0.4, 7;"cowbell"s0.8, 8;"cowbell"s1.6', quality = quality)
                 self.beatmap = beatmap_default.copy()
                 return
             else:
-                result = self.beatswap('1;"cowbell"s3v2, 2;"cowbell"s2, 3;"cowbell", 4;"cowbell"s0.5, 5;"cowbell"s0.25, 6;"cowbell"s0.4, 7;"cowbell"s0.8, 8;"cowbell"s1.6', return_audio = True)
+                result = self.beatswap('1;"cowbell"s3v2, 2;"cowbell"s2, 3;"cowbell", 4;"cowbell"s0.5, 5;"cowbell"s0.25, 6;"cowbell"s0.4, 7;"cowbell"s0.8, 8;"cowbell"s1.6', return_audio = True, quality = quality)
                 self.beatmap = beatmap_default.copy()
                 return result
         # random
         elif pattern.lower() == 'random':
-            import random,math
-            pattern = ''
-            rand_length=0
-            limit = 10000
-            while True:
-                limit -= 1
-                rand_num = int(math.floor(random.triangular(1, 16, rand_length-1)))
-                if random.uniform(0, rand_num)>rand_length: rand_num = rand_length+1
-                rand_slice = random.choices(['','>0.5','>0.25', '<0.5', '<0.25', '<1/3', '<2/3', '>1/3', '>2/3', '<0.75', '>0.75', 
-                                             f'>{random.uniform(0.01,2)}', f'<{random.uniform(0.01,2)}'], weights = [13,1,1,1,1,1,1,1,1,1,1,1,1], k=1)[0]
-                
-                rand_effect = random.choices(['', 's0.5', 's2', f's{random.triangular(0.1,1,4)}', 'r','v0.5', 'v2', 'v0', 
-                                              f'd{int(random.triangular(1,8,16))}', 'g', 'c', 'c0', 'c1', f'b{int(random.triangular(1,8,4))}'], 
-                                              weights=[30, 2, 2, 2, 2, 1, 1, 2, 2, 1, 2, 2, 2, 1], k=1)[0]
-                
-                rand_join = random.choices([', ', ';'], weights = [5, 1], k=1)[0]
-                pattern += f'{rand_num}{rand_slice}{rand_effect}{rand_join}'
-                if rand_join == ',': rand_length+=1
-                if rand_length in [4, 8, 16]: 
-                    if random.uniform(rand_num,16)>14: break
-                else: 
-                    if random.uniform(rand_num,16)>15.5: break
-                if limit <= 0: break
-            pattern_length = 4
-            if rand_length > 6: pattern_length = 8
-            if rand_length > 12: pattern_length = 16
-            if rand_length > 24: pattern_length = 32
-
+            from . import parse
+            pattern = parse._random_pattern()
 
-
-        
         from . import parse
-        pattern, operators, pattern_length, shuffle_groups, shuffle_beats, c_slice, c_misc, c_join = parse.parse(pattern = pattern, samples = samples, pattern_length = length, log = self.log)
+        parsed = parse.parse(pattern = pattern, samples = samples, pattern_length = length, log = self.log)
         
-        #print(f'pattern length = {pattern_length}')
-
         # beatswap
-        n=-1
-        tries = 0
-        metric = None
-        result=[self.audio[:,:self.beatmap[0]]]
-        #for i in pattern: print(i)
-
-
-        stop = False
-        total_length = 0
-        
-        # loop over pattern until it reaches the last beat
-        while n*pattern_length <= len(self.beatmap):
-            n+=1
-
-            if stop is True: break
-
-            # Every time pattern loops, shuffles beats with #
-            if len(shuffle_beats) > 0:
-                pattern = parse._shuffle(pattern, shuffle_beats, shuffle_groups)
-
-            # Loops over all beats in pattern
-            for num, b in enumerate(pattern):
-
-                # check if beats limit has been reached
-                if limit_beats is not None and len(result) >= limit_beats:
-                    stop = True
-                    break
-
-                if len(b) == 4: beat = b[3] # Sample has length 4
-                else: beat = b[0] # Else take the beat
-
-                if beat is not None:
-                    beat_as_string = ''.join(beat) if isinstance(beat, list) else beat
-                    # Skips `!` beats
-                    if c_misc[9] in beat_as_string: continue
-
-                # Audio is a sample or a song
-                if len(b) == 4: 
-                    audio = b[0]
-
-                    # Audio is a song
-                    if b[2] == c_misc[10]:
-                        try:
-
-                            # Song slice is a single beat, takes it
-                            if isinstance(beat, str):
-                                # random beat if `@` in beat (`_` is separator)
-                                if c_misc[4] in beat: beat = parse._random(beat, rchar = c_misc[4], schar = c_misc[5], length = pattern_length)
-                                beat = utils._safer_eval(beat) + pattern_length*n
-                                while beat > len(audio.beatmap)-1: beat = 1 + beat - len(audio.beatmap)
-                                beat = audio[beat]
-
-                            # Song slice is a range of beats, takes the beats
-                            elif isinstance(beat, list):
-                                beat = beat.copy()
-                                for i in range(len(beat)-1): # no separator
-                                    if c_misc[4] in beat[i]: beat[i] = parse._random(beat[i], rchar = c_misc[4], schar = c_misc[5], length = pattern_length)
-                                    beat[i] = utils._safer_eval(beat[i])
-                                    while beat[i] + pattern_length*n > len(audio.beatmap)-1: beat[i] = 1 + beat[i] - len(audio.beatmap)
-                                if beat[2] == c_slice[0]: beat = audio[beat[0] + pattern_length*n : beat[1] + pattern_length*n]
-                                elif beat[2] == c_slice[1]: beat = audio[beat[0] - 1 + pattern_length*n: beat[0] - 1 + beat[1] + pattern_length*n]
-                                elif beat[2] == c_slice[2]: beat = audio[beat[0] - beat[1] + pattern_length*n : beat[0] + pattern_length*n]
-
-                            # No Song slice, take whole song
-                            elif beat is None: beat = audio.audio
-
-                        except IndexError as e:
-                            print(e) 
-                            tries += 1
-                            if tries > 30: break
-                            continue
-                    
-                    # Audio is an audio file
-                    else:
-                        # No audio slice, takes whole audio
-                        if beat is None: beat = audio
-
-                        # Audio slice, takes part of the audio
-                        elif isinstance(beat, list):
-                            audio_length = len(audio[0])
-                            beat = [min(int(utils._safer_eval(beat[0])*audio_length), audio_length-1), min(int(utils._safer_eval(beat[1])*audio_length), audio_length-1)]
-                            if beat[0] > beat[1]: 
-                                beat[0], beat[1] = beat[1], beat[0]
-                                step = -1
-                            else: step = None
-                            beat = audio[:, beat[0] : beat[1] : step]
-                
-                # Audio is a beat
-                else:
-                    try:
-                        beat_str = beat if isinstance(beat, str) else ''.join(beat)
-                        # Takes a single beat
-                        if isinstance(beat, str):
-                            if c_misc[4] in beat: beat = parse._random(beat, rchar = c_misc[4], schar = c_misc[5], length = pattern_length)
-                            beat = self[utils._safer_eval(beat) + pattern_length*n]
-
-                        # Takes a range of beats
-                        elif isinstance(beat, list):
-                            beat = beat.copy()
-                            for i in range(len(beat)-1): # no separator
-                                if c_misc[4] in beat[i]: beat[i] = parse._random(beat[i], rchar = c_misc[4], schar = c_misc[5], length = pattern_length)
-                                beat[i] = utils._safer_eval(beat[i])
-                            if beat[2] == c_slice[0]: beat = self[beat[0] + pattern_length*n : beat[1] + pattern_length*n]
-                            elif beat[2] == c_slice[1]: beat = self[beat[0] - 1 + pattern_length*n: beat[0] - 1 + beat[1] + pattern_length*n]
-                            elif beat[2] == c_slice[2]: beat = self[beat[0] - beat[1] + pattern_length*n : beat[0] + pattern_length*n]
-
-                        # create a variable if `%` in beat
-                        if c_misc[7] in beat_str: metric = parse._metric_get(beat_str, beat, metrics, c_misc[7])
-
-                    except IndexError: 
-                        tries += 1
-                        if tries > 30: break
-                        continue
-
-                if len(beat[0])<1: continue #Ignores empty beats
-                
-                # Applies effects
-                effect = b[1]
-                for e in effect:
-                    if e[0] in effects:
-                        v = e[1]
-                        e = effects[e[0]]
-                        # parse effect value
-                        if isinstance(v, str):
-                            if metric is not None: v = parse._metric_replace(v, metric, c_misc[7])
-                            v = utils._safer_eval(v)
-
-                        # effects
-                        if e == 'volume':
-                            if v is None: v = 0
-                            beat = beat * v
-                        elif e == 'downsample':
-                            if v is None: v = 8
-                            beat = np.repeat(beat[:,::v], v, axis=1)
-                        elif e == 'gradient':
-                            beat = np.gradient(beat, axis=1)
-                        elif e == 'reverse':
-                            beat = beat[:,::-1]
-                        else:
-                            beat = e(beat, v)
-
-                # clip beat to -1, 1
-                beat = np.clip(beat, -1, 1)
-
-                # checks if length limit has been reached
-                if limit_length is not None:
-                    total_length += len(beat[0])
-                    if total_length>= limit_length: 
-                        stop = True
-                        break
-                
-                # Adds the processed beat to list of beats.
-                # Separator is `,`
-                if operators[num] == c_join[0]:
-                    result.append(beat)
-                
-                # Makes sure beat doesn't get added on top of previous beat multiple times when pattern is out of range of song beats, to avoid distorted end.
-                elif tries<2:
-
-                    # Separator is `;` - always use first beat length, normalizes volume to 1.5
-                    if operators[num] == c_join[1]:
-                        length = len(beat[0])
-                        prev_length = len(result[-1][0])
-                        if length > prev_length: 
-                            result[-1] += beat[:,:prev_length]
-                        else:
-                            result[-1][:,:length] += beat
-                        limit = np.max(result[-1])
-                        if limit > 1.5:
-                            result[-1] /= limit*0.75
-                    
-                    # Separator is `~` - cuts to shortest
-                    elif operators[num] == c_join[2]:
-                        minimum = min(len(beat[0]), len(result[-1][0]))
-                        result[-1] = beat[:,:minimum-1] + result[-1][:,:minimum-1]
-
-                    # Separator is `&` - extends to longest
-                    elif operators[num] == c_join[3]:
-                        length = len(beat[0])
-                        prev_length = len(result[-1][0])
-                        if length > prev_length: 
-                            beat[:,:prev_length] += result[-1]
-                            result[-1] = beat
-                        else:
-                            result[-1][:,:length] += beat
-
-                    # Separator is `^` - uses first beat length and multiplies beats, used for sidechain
-                    elif operators[num] == c_join[4]:
-                        length = len(beat[0])
-                        prev_length = len(result[-1][0])
-                        if length > prev_length: 
-                            result[-1] *= beat[:,:prev_length]
-                        else:
-                            result[-1][:,:length] *= beat
-
-
-                    # Separator is `$` - always use first beat length, additionally sidechains first beat by second
-                    elif operators[num] == c_join[5]:
-                        from . import effects
-                        length = len(beat[0])
-                        prev_length = len(result[-1][0])
-                        if length > prev_length: 
-                            result[-1] *= effects.to_sidechain(beat[:,:prev_length])
-                            result[-1] += beat[:,:prev_length]
-                        else:
-                            result[-1][:,:length] *= effects.to_sidechain(beat)
-                            result[-1][:,:length] += beat
-
-                    # Separator is `}` - always use first beat length
-                    elif operators[num] == c_join[6]:
-                        length = len(beat[0])
-                        prev_length = len(result[-1][0])
-                        if length > prev_length: 
-                            result[-1] += beat[:,:prev_length]
-                        else:
-                            result[-1][:,:length] += beat
-
+        from . import render
+        audio, offsets = render.render(render.compile(self, parsed, effects = effects, metrics = metrics, limit_beats = limit_beats, quality = quality), limit_length = limit_length)
 
         # smoothing
-        for i in range(len(result)-1):
-            current1 = result[i][0][-2]
-            current2 = result[i][0][-1]
-            following1 = result[i+1][0][0]
-            following2 = result[i+1][0][1]
-            num = (abs(following1 - (current2 + (current2 - current1))) + abs(current2 - (following1 + (following1 - following2))))/2
-            if num > 0.0: 
-                num = int(smoothing*num)
-                if num>3:
-                    try:
-                        line = scipy.interpolate.CubicSpline([0, num+1], [0, following1], bc_type='clamped')(np.arange(0, num, 1))
-                        #print(line)
-                        line2 = np.linspace(1, 0, num)**0.5
-                        result[i][0][-num:] *= line2
-                        result[i][1][-num:] *= line2
-                        result[i][0][-num:] += line
-                        result[i][1][-num:] += line
-                    except (IndexError, ValueError): pass
+        render.smooth_all(audio, offsets, smoothing)
 
         self.beatmap = beatmap_default.copy()
-        # Beats are conjoined into a song
-        import functools
-        import operator
-        # Makes a [l, r, l, r, ...] list of beats (left and right channels)
-        result = functools.reduce(operator.iconcat, result, [])
+        if return_audio is False: self.audio = audio
+        else: return audio
+
+    def beatswap_many(self, patterns: list, scales = 1, shifts = 0, length = None, samples:dict = BM_SAMPLES, effects:dict = BM_EFFECTS, metrics:dict = BM_METRICS, smoothing: int = 100, adjust=500, limit_beats=10000, limit_length = 52920000, workers: int = None, quality: str = None) -> list:
+        """Beatswaps with many patterns at once, returns a list with a list of audio arrays for every pattern, one for each of its scales. Song audio isn't modified.
+
+        `scales` and `shifts` are either a single value for all patterns, or a list with a value for every pattern, where a value in `scales` can also be a list of scales. 
+        Song audio, parsed patterns and every scaled beatmap are computed once and shared by all renders, `workers` renders them in that many threads. `quality` is the same as in `beatswap`.
+        All renders are kept in memory, use `beatswap_iter` to handle them one at a time."""
+        if not isinstance(scales, (list, tuple)): scales = [scales] * len(patterns)
+        results = [[None] * (len(i) if isinstance(i, (list, tuple)) else 1) for i in scales]
+        for n, k, audio in self.beatswap_iter(patterns, scales = scales, shifts = shifts, length = length, samples = samples, effects = effects, metrics = metrics, smoothing = smoothing, adjust = adjust, 
+                limit_beats = limit_beats, limit_length = limit_length, workers = workers, quality = quality):
+            results[n][k] = audio
+        return results
+
+    def beatswap_iter(self, patterns: list, scales = 1, shifts = 0, length = None, samples:dict = BM_SAMPLES, effects:dict = BM_EFFECTS, metrics:dict = BM_METRICS, smoothing: int = 100, adjust=500, limit_beats=10000, limit_length = 52920000, workers: int = None, quality: str = None):
+        """Same as `beatswap_many`, but yields `(pattern index, scale index, audio)` in order, as soon as each render is done. 
+        Only `workers` renders are rendered ahead, so memory doesn't grow with the number of patterns."""
+        from . import parse, render
+        if self.beatmap is None: self.beatmap_generate()
+        if not isinstance(scales, (list, tuple)): scales = [scales] * len(patterns)
+        if not isinstance(shifts, (list, tuple)): shifts = [shifts] * len(patterns)
+        scales = [i if isinstance(i, (list, tuple)) else [i] for i in scales]
+        adjusted = np.append(np.sort(np.absolute(self.beatmap - adjust)), len(self.audio[0]))
 
-        # Every first beat is conjoined into left channel, every second beat is conjoined into right channel
-        if return_audio is False: self.audio = np.array([functools.reduce(operator.iconcat, result[::2], []), functools.reduce(operator.iconcat, result[1:][::2], [])])
-        else: return np.array([functools.reduce(operator.iconcat, result[::2], []), functools.reduce(operator.iconcat, result[1:][::2], [])])
+        # shifted and scaled beatmaps, read-only and shared by all patterns that use them
+        from . import beatmap
+        beatmaps = {}
+        def derived(shift, scale):
+            key = (utils._safer_eval(shift), utils._safer_eval(scale))
+            if key not in beatmaps:
+                beatmaps[key] = beatmap.scale(beatmap = beatmap.shift(beatmap = adjusted.copy(), shift = shift, log = self.log), scale = scale, log = self.log)
+                beatmaps[key].flags.writeable = False
+            return beatmaps[key]
+
+        # baked in presets go through beatswap, which changes song beatmap while it runs, so they aren't rendered in threads
+        baked = lambda n: patterns[n].lower() in ('reverse', 'shuffle', 'test', 'random')
+        jobs = [(n, k) for n in range(len(patterns)) for k in range(len(scales[n]))]
+        # every pattern is parsed once, before rendering, because parsing loads samples
+        parsed = {n: parse.parse(pattern = patterns[n], samples = samples, pattern_length = length, log = self.log) for n in sorted(set(n for n, k in jobs if not baked(n)))}
+
+        def task(n, k):
+            if baked(n): return self.beatswap(patterns[n], scale = scales[n][k], shift = shifts[n], length = length, samples = samples, effects = effects, metrics = metrics, smoothing = smoothing, adjust = adjust, return_audio = True, limit_beats = limit_beats, limit_length = limit_length, quality = quality)
+            audio, offsets = render.render(render.compile(self, parsed[n], effects = effects, metrics = metrics, limit_beats = limit_beats, beatmap = derived(shifts[n], scales[n][k]), quality = quality), limit_length = limit_length)
+            render.smooth_all(audio, offsets, smoothing)
+            return audio
+        if workers is None or workers <= 1:
+            for n, k in jobs: yield n, k, task(n, k)
+            return
+        import collections
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers = workers) as pool:
+            pending = collections.deque()
+            def done():
+                n, k, future = pending.popleft()
+                return n, k, future.result()
+            for n, k in jobs:
+                if baked(n):
+                    while pending: yield done()
+                    yield n, k, task(n, k)
+                    continue
+                # beatmaps are made here and not in threads, so that every one is made once
+                derived(shifts[n], scales[n][k])
+                pending.append((n, k, pool.submit(task, n, k)))
+                if len(pending) >= workers: yield done()
+            while pending: yield done()
+
+    def beatswap_stream(self, pattern = '1;"cowbell"s3v2, 2;"cowbell"s2, 3;"cowbell", 4;"cowbell"s0.5, 5;"cowbell"s0.25, 6;"cowbell"s0.4, 7;"cowbell"s0.8, 8;"cowbell"s1.6', 
+        scale:float = 1, shift:float = 0, length = None, samples:dict = BM_SAMPLES, effects:dict = BM_EFFECTS, metrics:dict = BM_METRICS, smoothing: int = 100, adjust=500, normalize = False, block = 65536, limit_beats = None, limit_length = None, quality: str = None):
+        """Same as `beatswap`, but yields the result as float32 `(2, block)` arrays while rendering, last one can be shorter. Song audio stays the same.
+
+        Memory doesn't grow with the length of the result, and there are no limits by default, so it works for multi-hour audio and for piping into an encoder or a socket.
+        Baked in presets are resolved like `beatswap` does, into patterns that `beatswap` renders with its default arguments, so most arguments are ignored for them, same as in `beatswap`."""
+        from . import render
+        if pattern.lower() in ('reverse', 'shuffle', 'test'): smoothing, limit_length = 100, 52920000
+        p = self._plan(pattern, scale = scale, shift = shift, length = length, samples = samples, effects = effects, metrics = metrics, adjust = adjust, normalize = normalize, limit_beats = limit_beats, quality = quality)
+        yield from render.stream(p, block = block, smoothing = smoothing, limit_length = limit_length)
+
+    def _plan(self, pattern, scale = 1, shift = 0, length = None, samples:dict = BM_SAMPLES, effects:dict = BM_EFFECTS, metrics:dict = BM_METRICS, adjust = 500, normalize = False, limit_beats = None, quality: str = None):
+        """Render plan of a pattern, with baked in presets resolved the same way as in `beatswap`"""
+        if normalize is True:
+            self.normalize_beats()
+        if self.beatmap is None: self.beatmap_generate()
+        beatmap_default = self.beatmap.copy()
+        self.beatmap = np.append(np.sort(np.absolute(self.beatmap - adjust)), len(self.audio[0]))
+        self.beatmap_shift(shift)
+        self.beatmap_scale(scale)
+        from . import parse, render
+        try:
+            # baked in presets, same as `self[::-1]` in `beatswap`, and a pattern that `beatswap` beatswaps again with adjusted beatmap
+            if pattern.lower() == 'reverse':
+                song_copy = song(audio = self.audio, sr = self.sr, log = False)
+                song_copy.beatmap = np.insert(self.beatmap, 0, 0)
+                return song_copy._plan(''.join(f'{i},' for i in range(len(self.beatmap) - 2, -1, -1)), limit_beats = 10000)
+            elif pattern.lower() == 'shuffle':
+                import random
+                beats = list(range(len(self.beatmap)))
+                random.shuffle(beats)
+                return self._plan(','.join(str(i) for i in beats), limit_beats = 10000, quality = quality)
+            elif pattern.lower() == 'test': 
+                return self._plan('1;"cowbell"s3v2, 2;"cowbell"s2, 3;"cowbell", 4;"cowbell"s0.5, 5;"cowbell"s0.25, 6;"cowbell"s0.4, 7;"cowbell"s0.8, 8;"cowbell"s1.6', limit_beats = 10000, quality = quality)
+            elif pattern.lower() == 'random': pattern = parse._random_pattern()
+            return render.compile(self, parse.parse(pattern = pattern, samples = samples, pattern_length = length, log = self.log), effects = effects, metrics = metrics, limit_beats = limit_beats, quality = quality)
+        finally: self.beatmap = beatmap_default.copy()
 
     def normalize_beats(self):
         if self.normalized is not None: 
@@ -527,6 +440,11 @@ def beatswap(audio = None, pattern = 'test', scale = 1, shift = 0, length = None
         return audio.write(output = output, suffix = suffix)
     else: return audio
 
+def beatswap_stream(audio = None, pattern = 'test', scale = 1, shift = 0, length = None, sr = None, log = True, block = 65536):
+    """Yields beatswapped audio in `(2, block)` arrays, see `song.beatswap_stream`"""
+    if not isinstance(audio, song): audio = song(audio = audio, sr = sr, log = log)
+    yield from audio.beatswap_stream(pattern = pattern, scale = scale, shift = shift, length = length, block = block)
+
 def image(audio, scale = 1, shift = 0, sr = None, output = '', log = True, suffix = '', max_size = 4096):
     if not isinstance(audio, song): audio = song(audio = audio, sr = sr, log = log)
     audio.image_generate(scale = scale, shift = shift)
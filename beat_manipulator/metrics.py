@@ -19,14 +19,23 @@ def locate_1st_hit(audio: np.ndarray, number: int = 1):
 def is_hit(audio: np.ndarray, threshold: float = 0.5, number:int = 1) -> int:
     return 1 if maximum_high(audio, number=number) > threshold else 0
 
+def _hit(audio: np.ndarray) -> tuple:
+    """`is_hit` and `locate_1st_hit` from one gradient"""
+    gradient = effects.gradient(audio)
+    return (1 if np.max(np.abs(gradient)) > 0.5 else 0), np.argmax(gradient, axis=1) / len(gradient[0])
+
+def _at_start(hit, position, diff = 0.1): return hit * (position <= diff)
+def _in_middle(hit, position, diff = 0.1): return hit * ((0.5 - diff) <= position <= (0.5 + diff))
+def _at_end(hit, position, diff = 0.1): return hit * (position >= (1-diff))
+
 def hit_at_start(audio: np.ndarray, diff = 0.1) -> int:
-    return is_hit(audio) * (locate_1st_hit(audio) <= diff)
+    return _at_start(*_hit(audio), diff)
 
 def hit_in_middle(audio: np.ndarray, diff = 0.1) -> int:
-    return is_hit(audio) * ((0.5 - diff) <= locate_1st_hit(audio) <= (0.5 + diff))
+    return _in_middle(*_hit(audio), diff)
 
 def hit_at_end(audio: np.ndarray, diff = 0.1) -> int:
-    return is_hit(audio) * (locate_1st_hit(audio) >= (1-diff))
+    return _at_end(*_hit(audio), diff)
 
 BM_METRICS = {
     "v": volume,
@@ -37,4 +46,81 @@ BM_METRICS = {
     "s": hit_at_start,
     "a": hit_in_middle,
     "e": hit_at_end,
-}
\ No newline at end of file
+}
+
+def _sums(audio: np.ndarray, start: np.ndarray, stop: np.ndarray, chunk: int = 128) -> np.ndarray:
+    """Sum of `audio[:, start[k]:stop[k]]` for every k. `chunk` samples are summed in audio dtype, chunks are added in float64, which is close to numpy pairwise summation"""
+    edges = np.union1d(np.arange(0, audio.shape[1], chunk), np.concatenate((start, stop)))
+    edges = edges[edges < audio.shape[1]]
+    chunks = np.sum(np.add.reduceat(audio, edges, axis = 1), axis = 0, dtype = np.float64)
+    indexes = np.stack((np.searchsorted(edges, start), np.searchsorted(edges, stop)), axis = 1).ravel()
+    # reductions over beats are at even indexes, odd ones are the gaps between them. Last one goes to the end anyway
+    if indexes[-1] == len(edges): indexes = indexes[:-1]
+    return np.add.reduceat(chunks, indexes)[::2]
+
+def features(audio: np.ndarray, beatmap: np.ndarray) -> dict:
+    """Table of features of every beat `audio[:, beatmap[k]:beatmap[k+1]]`, computed for the whole song at once with segment reductions.
+    
+    Returns arrays `start`, `stop` of the beats and `volume`, `volume_gradient`, `maximum_high`, `first_hit` - what metrics with default arguments return for them.
+    Beats shorter than 2 samples aren't in the table. Beatmap that isn't sorted gets an empty table."""
+    beatmap = np.asarray(beatmap, dtype = np.int64)
+    channels, length = audio.shape
+    start, stop = beatmap[:-1], beatmap[1:]
+    keep = (start >= 0) & (stop <= length) & (stop - start >= 2)
+    if length < 2 or np.any(np.diff(beatmap) < 0): keep[:] = False
+    start, stop = start[keep], stop[keep]
+    table = {'start': start, 'stop': stop, 'volume': np.zeros(len(start), dtype = audio.dtype), 'volume_gradient': np.zeros(len(start), dtype = audio.dtype),
+             'maximum_high': np.zeros(len(start), dtype = audio.dtype), 'first_hit': np.zeros((len(start), channels))}
+    if len(start) == 0: return table
+
+    # gradient of the song is the same as gradient of every beat, except first and last sample of a beat, where it's one-sided
+    gradient = effects.gradient(audio)
+    gradient[:, start] = audio[:, start + 1] - audio[:, start]
+    gradient[:, stop - 1] = audio[:, stop - 1] - audio[:, stop - 2]
+
+    lengths = stop - start
+    # summation order isn't the same as np.average of a single beat, so the last digits can be different
+    table['volume'] = (_sums(np.abs(audio), start, stop) / (lengths * channels)).astype(audio.dtype)
+    magnitude = np.abs(gradient)
+    table['volume_gradient'] = (_sums(magnitude, start, stop) / (lengths * channels)).astype(audio.dtype)
+    # reductions over beats are at even indexes
+    indexes = np.stack((start, stop), axis = 1).ravel()
+    if indexes[-1] == length: indexes = indexes[:-1]
+    table['maximum_high'] = np.max(np.maximum.reduceat(magnitude, indexes, axis = 1)[:, ::2], axis = 0)
+    del magnitude
+    # argmax has no reduceat, so it's the first sample of a beat that equals maximum of the beat
+    table['first_hit'] = _argmax(gradient, start, stop) / lengths[:, None]
+    return table
+
+def _argmax(audio: np.ndarray, start: np.ndarray, stop: np.ndarray) -> np.ndarray:
+    """`np.argmax(audio[:, start[k]:stop[k]], axis = 1)` for every k, as a `(beats, channels)` array"""
+    span = audio[:, start[0]:stop[-1]]
+    # beats are even segments, gaps between them are odd ones. Last beat goes to the end of the span
+    indexes = np.stack((start, stop), axis = 1).ravel()[:-1] - start[0]
+    sizes = np.diff(np.append(indexes, len(span[0])))
+    maximums = np.maximum.reduceat(span, indexes, axis = 1)
+    result = np.empty((len(start), len(span)), dtype = np.int64)
+    for c in range(len(span)):
+        repeated = np.repeat(maximums[c], sizes)
+        equal = span[c] == repeated
+        # argmax finds the first nan
+        if np.isnan(maximums[c]).any(): equal |= np.isnan(span[c]) & np.isnan(repeated)
+        # every beat has its maximum, so the first one from the start of a beat is in that beat
+        positions = np.flatnonzero(equal)
+        result[:, c] = positions[np.searchsorted(positions, indexes[::2])] - indexes[::2]
+    return result
+
+def _read_hit(table: dict, k: int) -> tuple:
+    return (1 if table['maximum_high'][k] > 0.5 else 0), table['first_hit'][k]
+
+# metrics that can be read from `features` table, they are used instead of the metric when `%` beat is a whole beat of the song
+BM_FEATURES = {
+    volume: lambda table, k: table['volume'][k],
+    volume_gradient: lambda table, k: table['volume_gradient'][k],
+    maximum_high: lambda table, k: table['maximum_high'][k],
+    locate_1st_hit: lambda table, k: table['first_hit'][k],
+    is_hit: lambda table, k: _read_hit(table, k)[0],
+    hit_at_start: lambda table, k: _at_start(*_read_hit(table, k)),
+    hit_in_middle: lambda table, k: _in_middle(*_read_hit(table, k)),
+    hit_at_end: lambda table, k: _at_end(*_read_hit(table, k)),
+}
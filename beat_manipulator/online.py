@@ -0,0 +1,298 @@
+import numpy as np
+# causal beat tracking of audio that arrives in blocks. Onset strength is spectral flux at `fps` frames per second,
+# tempo comes from autocorrelation of the last few seconds of it, and beats are decoded with the dynamic programming of Ellis (2007)
+# with a fixed lag: beat at frame `t` is decided when frame `t + lag` arrives, so every beat is reported with the same latency.
+
+class tracker:
+    """Causal beat tracker. `process(block)` takes the next block of audio of any length, `(channels, samples)` or mono,
+    and returns positions in samples of beats that were decided in it. `flush()` decides the remaining beats at the end of the stream.
+
+    Beats are reported `latency` samples after they happen: `lag` seconds of decoding lag plus half of an FFT frame."""
+    def __init__(self, sr: int, fps: int = 100, lag: float = 0.5, min_bpm: float = 60, max_bpm: float = 200, history: float = 6, tightness: float = 100):
+        self.sr = sr
+        self.hop = int(round(sr / fps))
+        self.fps = sr / self.hop
+        self.n_fft = int(2**np.ceil(np.log2(sr * 0.046)))
+        self.lag = int(round(lag * self.fps))
+        self.tightness = tightness
+        self.latency = self.lag * self.hop + self.n_fft // 2
+        # tempo candidates in frames per beat, weighted by a log-gaussian around 120 bpm
+        self._periods = np.arange(int(np.floor(self.fps * 60 / max_bpm)), int(np.ceil(self.fps * 60 / min_bpm)) + 1)
+        self._prior = np.exp(-0.5 * np.log2(self.fps * 60 / self._periods / 120)**2)
+        self.period = self.fps / 2
+        self._window = np.hanning(self.n_fft).astype(np.float32)
+        # mono samples that are still needed, first one is sample `_start`. First frame is centered on sample 0
+        self._buffer = np.zeros(self.n_fft // 2, dtype = np.float32)
+        self._start = -(self.n_fft // 2)
+        self._previous = None
+        self._history = np.zeros(int(history * self.fps))
+        # onset strength, cumulative score and best previous beat of frames starting from `_first`
+        self._onsets = []
+        self._score = []
+        self._back = []
+        self._first = 0
+        self.frames = 0
+        self._last = -1
+
+    def _spectra(self, block: np.ndarray) -> np.ndarray:
+        """Magnitude spectra of all frames that are complete after adding the block"""
+        block = np.asarray(block, dtype = np.float32)
+        if block.ndim == 2: block = block.mean(axis = 0) if len(block) <= 16 else block.mean(axis = 1)
+        self._buffer = np.concatenate((self._buffer, block))
+        count = (self._start + len(self._buffer) - self.n_fft // 2) // self.hop - self.frames + 1
+        if count <= 0: return np.zeros((0, self.n_fft // 2 + 1), dtype = np.float32)
+        offsets = (self.frames + np.arange(count)) * self.hop - self.n_fft // 2 - self._start
+        frames = np.lib.stride_tricks.sliding_window_view(self._buffer, self.n_fft)[offsets]
+        spectra = np.abs(np.fft.rfft(frames * self._window, axis = 1)).astype(np.float32)
+        drop = (self.frames + count) * self.hop - self.n_fft // 2 - self._start
+        self._buffer = self._buffer[drop:]
+        self._start += drop
+        return spectra
+
+    def _tempo(self):
+        history = self._history - self._history.mean()
+        if not np.any(history): return
+        spectrum = np.fft.rfft(history, 2 * len(history))
+        correlation = np.fft.irfft(spectrum * np.conj(spectrum))
+        # neighbouring lags are added, so that a period between two whole frames isn't beaten by twice that period
+        correlation = correlation[self._periods] + 0.5 * (correlation[self._periods - 1] + correlation[self._periods + 1])
+        best = int(np.argmax(correlation * self._prior))
+        # strong correlation at half of the period means beats are twice as fast, and the period is between two whole frames
+        half = (self._periods[best] / 2 - self._periods[0])
+        if half >= 0 and max(correlation[int(np.floor(half))], correlation[int(np.ceil(half))]) > 0.7 * correlation[best]: self.period = float(self._periods[0] + half)
+        else: self.period = float(self._periods[best])
+
+    def _step(self, onset: float):
+        """Adds one frame to the cumulative score, then decides beats that are `lag` frames old"""
+        t = self.frames
+        self._history = np.roll(self._history, -1)
+        self._history[-1] = onset
+        if t % int(self.fps // 4) == 0 and t >= self.fps * 2: self._tempo()
+        onset = (onset - np.mean(self._history)) / (np.std(self._history) + 1e-6)
+        lo, hi = max(t - int(round(2 * self.period)), self._first), t - int(round(self.period / 2))
+        score, back = onset, -1
+        if hi >= lo:
+            previous = np.arange(lo, hi + 1)
+            candidates = np.asarray(self._score[lo - self._first : hi + 1 - self._first]) - self.tightness * np.log((t - previous) / self.period)**2
+            best = int(np.argmax(candidates))
+            score, back = onset + candidates[best], int(previous[best])
+        self._onsets.append(onset)
+        self._score.append(score)
+        self._back.append(back)
+        self.frames += 1
+        beats = self._decide(t - self.lag) if t >= self.lag else []
+        # frames older than two longest periods and the lag are never looked at again
+        keep = self.lag + 2 * int(self._periods[-1]) + 1
+        if len(self._score) > 2 * keep:
+            del self._onsets[:-keep], self._score[:-keep], self._back[:-keep]
+            self._first = self.frames - keep
+        return beats
+
+    def _decide(self, until: int) -> list:
+        """Backtracks the best path from the last period and returns its beats that are after the last decided beat and not after `until`"""
+        t = self.frames - 1
+        lo = max(t - int(round(self.period)), self._first)
+        b = lo + int(np.argmax(self._score[lo - self._first:]))
+        beats = []
+        while b > self._last and b >= self._first:
+            if b <= until: beats.append(b)
+            b = self._back[b - self._first]
+        # path can differ from the one that gave the last decided beat, beat right after it is dropped if it is too close
+        if len(beats) > 0 and self._last >= 0 and beats[-1] - self._last < self.period / 2: beats.pop()
+        if len(beats) > 0: self._last = beats[0]
+        return beats[::-1]
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        spectra = np.log1p(100 * self._spectra(block))
+        beats = []
+        for spectrum in spectra:
+            onset = 0. if self._previous is None else float(np.sum(np.maximum(spectrum - self._previous, 0)))
+            self._previous = spectrum
+            beats.extend(self._step(onset))
+        return np.asarray(beats, dtype = np.int64) * self.hop
+
+    def flush(self) -> np.ndarray:
+        if self.frames == 0: return np.zeros(0, dtype = np.int64)
+        return np.asarray(self._decide(self.frames - 1), dtype = np.int64) * self.hop
+
+def track(blocks, sr: int, **kwargs):
+    """Generator that tracks beats of an iterator of audio blocks, for example `io.blocks`. Yields an array of new beat positions in samples for each block,
+    and one more with the beats that are decided at the end. Keyword arguments go to `tracker`, its `latency` is the delay of every beat."""
+    t = tracker(sr, **kwargs)
+    for block in blocks: yield t.process(block)
+    yield t.flush()
+
+class renderer:
+    """Real-time beatswap. `process(audio, beats)` takes the next input block and positions of new beats in samples, for example from `tracker`,
+    and returns a list of output blocks of exactly `block` samples.
+
+    Every `pattern_length` beats make a bar, which is rendered as soon as its last beat and audio are known, so a pattern can only use beats of its own bar.
+    Output starts `latency` beats (measured by the first two beats) after the input, and then runs at the same rate as the input. 
+    Output that isn't ready when it has to be played is silence and is counted in `underruns`, output that falls behind by more than twice the delay is dropped and counted in `dropped`.
+    Input that waits for beats for longer than `wait` seconds isn't kept: before the first beat it's dropped, later it's played as it is.
+
+    Supported pattern subset is beats, slices with `:`, `>` and `<`, all joins, and effects `r`, `v`, `d` and `s`."""
+    def __init__(self, pattern: str, sr: int, block: int = 4096, latency: float = 8, channels: int = 2, smoothing: int = 100, effects: dict = None, wait: float = 30):
+        from . import parse
+        from .effects import BM_EFFECTS
+        if effects is None: effects = {k: v for k, v in BM_EFFECTS.items() if k in 'rvds'}
+        self.parsed = parse.parse(pattern, samples = {}, log = False)
+        beats, _, self.pattern_length, _, shuffle_beats, _, c_misc, _ = self.parsed
+        for b in beats:
+            assert len(b) != 4, f'`{pattern}`: samples can\'t be used in real time'
+            beat = b[0] if isinstance(b[0], str) else ''.join(b[0])
+            assert not any(i in beat for i in c_misc[4] + c_misc[7] + c_misc[8]) and not beat.startswith('-'), f'`{beat}` in `{pattern}`: random, shuffled, `%` and negative beats can\'t be used in real time'
+            for e, v in b[1]: assert e in effects, f'`{e}` in `{pattern}` can\'t be used in real time, available effects are {list(effects)}'
+        assert len(shuffle_beats) == 0, f'`{pattern}`: shuffled beats can\'t be used in real time'
+        assert self.pattern_length < latency, f'Pattern is {self.pattern_length} beats long, latency of {latency} beats has to be longer than that and the beat tracker latency'
+        self.sr = sr
+        self.block = block
+        self.latency = latency
+        self.channels = channels
+        self.smoothing = smoothing
+        self.effects = effects
+        self.wait = wait
+        self.delay = None
+        # input samples that bars still need, first one is sample `_start`
+        self._input = np.zeros((channels, 0), dtype = np.float32)
+        self._start = 0
+        self._grid = []
+        # index of first beat of the next bar, -1 before the intro is queued
+        self._bar = -1
+        # rendered output waiting to be played, `_read` samples of the first array were played
+        self._queue = []
+        self._read = 0
+        self._queued = 0
+        self.received = 0
+        self.played = 0
+        self.underruns = 0
+        self.dropped = 0
+        self.blocks = 0
+        self.time = 0.
+        self.last = 0.
+        self.worst = 0.
+
+    def _bar_audio(self, start: int, stop: int) -> np.ndarray:
+        return self._input[:, start - self._start : stop - self._start]
+
+    def _queue_audio(self, audio: np.ndarray):
+        if len(audio[0]) == 0: return
+        from . import render
+        # smooths the click between previous and this part, only the part of previous that wasn't played yet can be faded out
+        if len(self._queue) > 0: render.smooth(self._queue[-1][:, self._read:] if len(self._queue) == 1 else self._queue[-1], audio, self.smoothing)
+        self._queue.append(audio)
+        self._queued += len(audio[0])
+
+    def _render(self):
+        """Renders all bars whose beats and audio are complete"""
+        L = self.pattern_length
+        if self._bar == -1 and len(self._grid) > 0 and self.received >= self._grid[0]:
+            self._queue_audio(self._bar_audio(self._start, self._grid[0]).copy())
+            self._bar = 0
+        while self._bar >= 0 and len(self._grid) > self._bar + L and self.received >= self._grid[self._bar + L]:
+            self._render_bar(self._grid[self._bar : self._bar + L + 1])
+            self._bar += L
+        # beats of rendered bars are never needed again
+        if self._bar > 0:
+            del self._grid[:self._bar]
+            self._bar = 0
+
+    def _trim(self):
+        """Keeps at most `wait` seconds of input"""
+        n = len(self._input[0]) - int(self.wait * self.sr)
+        if n <= 0: return
+        stop = self._start + n
+        if self._bar == -1:
+            self.dropped += n
+            self._grid = [b for b in self._grid if b >= stop]
+        else:
+            self._queue_audio(self._input[:, :n].copy())
+            # next bar starts where audio that was played as it is ends
+            self._grid = [stop] + [b for b in self._grid if b > stop]
+        self._input = self._input[:, n:]
+        self._start = stop
+
+    def _render_bar(self, grid: list):
+        """Renders the pattern over beats of one bar, pattern beats that are past the last beat are skipped like at the end of a song"""
+        from . import render
+        from types import SimpleNamespace
+        start, stop = grid[0], grid[-1]
+        p = render.compile(SimpleNamespace(audio = self._bar_audio(start, stop)), self.parsed, self.effects, limit_beats = None, beatmap = np.asarray(grid, dtype = np.int64) - start)
+        audio, offsets = render.render(p)
+        render.smooth_all(audio, offsets, self.smoothing)
+        self._queue_audio(audio)
+        # input before the next bar is never needed again
+        self._input = self._input[:, stop - self._start:]
+        self._start = stop
+
+    def _take(self, n: int) -> np.ndarray:
+        out = np.zeros((self.channels, n), dtype = np.float32)
+        filled = 0
+        while filled < n and len(self._queue) > 0:
+            part = self._queue[0][:, self._read : self._read + n - filled]
+            out[:, filled : filled + len(part[0])] = part
+            filled += len(part[0])
+            self._read += len(part[0])
+            if self._read == len(self._queue[0][0]):
+                self._queue.pop(0)
+                self._read = 0
+        self._queued -= filled
+        if filled < n: self.underruns += 1
+        return out
+
+    def process(self, audio: np.ndarray, beats = ()) -> list:
+        import time
+        begin = time.perf_counter()
+        audio = np.asarray(audio, dtype = np.float32)
+        if audio.ndim == 1: audio = np.repeat(audio[None], self.channels, axis = 0)
+        self._input = np.concatenate((self._input, audio[:self.channels]), axis = 1)
+        self.received += len(audio[0])
+        self._grid.extend(int(i) for i in beats)
+        if self.delay is None and len(self._grid) >= 2: self.delay = int(self.latency * (self._grid[1] - self._grid[0]))
+        self._render()
+        self._trim()
+        out = []
+        if self.delay is not None:
+            if self._queued > 2 * self.delay:
+                self.dropped += self._queued - 2 * self.delay
+                self._take(self._queued - 2 * self.delay)
+            while self.received - self.delay - self.played >= self.block:
+                out.append(self._take(self.block))
+                self.played += self.block
+        elapsed = time.perf_counter() - begin
+        self.blocks += 1
+        self.time += elapsed
+        self.last = elapsed
+        if len(audio[0]) > 0: self.worst = max(self.worst, elapsed / (len(audio[0]) / self.sr))
+        return out
+
+    def flush(self) -> list:
+        """Renders what is left with end of the input as the last beat, like `song.beatswap` does, and returns rest of the output padded to whole blocks"""
+        if self._bar == -1: self._queue_audio(self._input.copy())
+        else:
+            self._render()
+            grid = self._grid[self._bar:] + ([self.received] if self.received > self._grid[-1] else [])
+            if len(grid) > 1: self._render_bar(grid)
+        # last block is padded with silence
+        out = []
+        while self._queued > 0:
+            n = min(self.block, self._queued)
+            out.append(np.pad(self._take(n), ((0, 0), (0, self.block - n))))
+            self.played += self.block
+        return out
+
+    def stats(self) -> dict:
+        """`rtf` is processing time divided by duration of the input, `worst` is the highest ratio of a single block, `last` is processing time of the last block in seconds"""
+        return {'received': self.received, 'played': self.played, 'delay': self.delay, 'queued': self._queued, 'underruns': self.underruns, 'dropped': self.dropped,
+                'blocks': self.blocks, 'rtf': self.time / (self.received / self.sr) if self.received > 0 else None, 'last': self.last, 'worst': self.worst}
+
+def beatswap(blocks, sr: int, pattern: str, block: int = 4096, latency: float = 8, channels: int = 2, smoothing: int = 100, **kwargs):
+    """Generator that beatswaps an iterator of audio blocks in real time, beats are found by `tracker` and output is made by `renderer`.
+    Yields output blocks of `block` samples, keyword arguments go to `tracker`. Returns the renderer stats when it is done, `yield from` gives them."""
+    t = tracker(sr, **kwargs)
+    r = renderer(pattern, sr, block = block, latency = latency, channels = channels, smoothing = smoothing)
+    for audio in blocks:
+        yield from r.process(audio, t.process(audio))
+    r.process(np.zeros((channels, 0), dtype = np.float32), t.flush())
+    yield from r.flush()
+    return r.stats()
@@ -18,18 +18,16 @@ def generate(song, difficulties = [0.2, 0.1, 0.05, 0.025, 0.01, 0.0075, 0.005, 0
         artist = ''
         title = filename
     
+    beatmap = None
     if caching is True:
-        audio_id=hex(len(song.audio[0]))
-        import os
-        if not os.path.exists('beat_manipulator/beatmaps'):
-            os.mkdir('beat_manipulator/beatmaps')
-        cacheDir="beat_manipulator/beatmaps/" + filename + "_"+lib+"_"+audio_id+'.txt'
-        try: 
-            beatmap=np.loadtxt(cacheDir)
+        from . import cache
+        from .beatmap import _key
+        key = _key(song.fingerprint, lib)
+        record = cache.beatmaps.get(key)
+        if record is not None:
+            beatmap = record[0]['beatmap']
             if log is True: print('loaded cached beatmap.')
-        except OSError: 
-            if log is True:print("beatmap hasn't been generated yet. Generating...")
-            beatmap = None
+        elif log is True: print("beatmap hasn't been generated yet. Generating...")
 
     if beatmap is None:
         if 'madmom' in lib.lower():
@@ -37,8 +35,8 @@ def generate(song, difficulties = [0.2, 0.1, 0.05, 0.025, 0.01, 0.0075, 0.005, 0
             import madmom
             assert len(song.audio[0])>song.sr*2, f'Audio file is too short, len={len(song.audio[0])} samples, or {len(song.audio[0])/song.sr} seconds. Minimum length is 2 seconds, audio below that breaks madmom processors.'
         if lib=='madmom.RNNBeatProcessor':
-            proc = madmom.features.beats.RNNBeatProcessor()
-            beatmap = proc(madmom.audio.signal.Signal(song.audio.T, song.sr))
+            from .beatmap import _activations
+            beatmap = _activations(song.audio, song.sr, 'beats', song.fingerprint, caching)
         elif lib=='madmom.MultiModelSelectionProcessor':
             proc = madmom.features.beats.RNNBeatProcessor(post_processor=None)
             predictions = proc(madmom.audio.signal.Signal(song.audio.T, song.sr))
@@ -62,7 +60,7 @@ def generate(song, difficulties = [0.2, 0.1, 0.05, 0.025, 0.01, 0.0075, 0.005, 0
                 if spikes[i] <= 0.1: spikes[i] = 0
             beatmap = spikes
 
-        if caching is True: np.savetxt(cacheDir, beatmap)
+        if caching is True: cache.beatmaps.put(key, {'beatmap': beatmap}, {'lib': lib, 'sr': song.sr, 'samples': len(song.audio[0]), 'filename': filename, 'settings': None})
         
     if add_peaks is True:
         spikes = np.abs(np.gradient(np.clip(song.audio[0], -1, 1)))[:int(len(song.audio[0]) - (len(song.audio[0])%int(song.sr/100)))]
@@ -1,20 +1,46 @@
 from .utils import C_SLICE, C_JOIN, C_MISC, C_MATH
 import numpy as np
+from collections import OrderedDict
 from . import io, utils, main
-def _getnum(pattern, cur, symbols = '+-*/'):
-    number = ''
-    while pattern[cur].isdecimal() or pattern[cur] in symbols:
-        number+=pattern[cur]
-        cur+=1
-    return number, cur-1
+def _normalize(pattern:str, c_join:str = C_JOIN, simple_mode = False) -> str:
+    """Removes spaces, double separators and separators at start and end"""
+    #forgot separator
+    if simple_mode is True:
+        if c_join[0] not in pattern and c_join[1] not in pattern and c_join[2] not in pattern and c_join[3] not in pattern: pattern = pattern.replace(' ', c_join[0])
+    if ' ' not in c_join: pattern = pattern.replace(' ', '') # ignore spaces
+    for i in c_join:
+        while i+i in pattern: pattern = pattern.replace(i+i, i) #double separator
+        while pattern.startswith(i): pattern = pattern[1:]
+        while pattern.endswith(i): pattern = pattern[:-1]
+    return pattern
+
+# parsed patterns, LRU. Samples are stored as weak references so that cache doesn't keep audio alive
+_cache = OrderedDict()
+_cache_stats = {'hits': 0, 'misses': 0}
+cache_size = 256
+
+def cache_info() -> dict:
+    """Returns parse cache hits, misses, size and maxsize"""
+    return {**_cache_stats, 'size': len(_cache), 'maxsize': cache_size}
+
+def cache_clear():
+    _cache.clear()
+    _cache_stats['hits'] = _cache_stats['misses'] = 0
+
+def _copy(beats:list, get = lambda x: x) -> list:
+    """Copies parsed beats, `get` is applied to samples"""
+    return [[b[0], [list(e) for e in b[1]]] if len(b) == 2 else [get(b[0]), [list(e) for e in b[1]], b[2], b[3]] for b in beats]
 
 def parse(pattern:str, samples:dict, pattern_length:int = None,
         c_slice:str = C_SLICE,
         c_join:str = C_JOIN, 
         c_misc:str = C_MISC,
         log = True,
-        simple_mode = False):
-    """Returns (beats, operators, pattern_length, c_slice, c_misc, c_join)"""
+        simple_mode = False,
+        cache = True):
+    """Returns (beats, operators, pattern_length, shuffle_groups, shuffle_beats, c_slice, c_misc, c_join). 
+    
+    Results are cached by normalized pattern, pattern_length and identities of used samples, so parsing same pattern again is free."""
     if log is True: print(f'Beatswapping with `{pattern}`')
     
     #load samples:
@@ -22,163 +48,221 @@ def parse(pattern:str, samples:dict, pattern_length:int = None,
     if not isinstance(samples, dict):
         samples = {str(i+1):samples[i] for i in range(len(samples))}
 
-    #preprocess pattern
-    separator = c_join[0]
-    #forgot separator
-    if simple_mode is True:
-        if c_join[0] not in pattern and c_join[1] not in pattern and c_join[2] not in pattern and c_join[3] not in pattern: pattern = pattern.replace(' ', separator)
-    if ' ' not in c_join: pattern = pattern.replace(' ', '') # ignore spaces
-    for i in c_join:
-        while i+i in pattern: pattern = pattern.replace(i+i, i) #double separator
-        while pattern.startswith(i): pattern = pattern[1:]
-        while pattern.endswith(i): pattern = pattern[:-1]
+    pattern = _normalize(pattern, c_join, simple_mode)
+    if cache is False: return _parse(pattern, samples, pattern_length, c_slice, c_join, c_misc)
+
+    key = (pattern, pattern_length, c_slice, c_join, c_misc)
+    if key in _cache:
+        beats, used, result = _cache[key]
+        # hit only if every used sample is still the same object
+        if all(name in samples and samples[name] is ref() for name, ref in used):
+            _cache.move_to_end(key)
+            _cache_stats['hits'] += 1
+            return (_copy(beats, lambda ref: ref()), *(list(i) if isinstance(i, list) else i for i in result))
+        del _cache[key]
+    _cache_stats['misses'] += 1
+
+    parsed = _parse(pattern, samples, pattern_length, c_slice, c_join, c_misc)
+    import weakref
+    try: 
+        refs = {}
+        for b in parsed[0]:
+            if len(b) == 4 and id(b[0]) not in refs: refs[id(b[0])] = weakref.ref(b[0])
+        used = [(name, refs[id(s)]) for name, s in samples.items() if id(s) in refs]
+    except TypeError: return parsed # sample that can't be weakly referenced
+    _cache[key] = (_copy(parsed[0], lambda x: refs[id(x)]), used, tuple(list(i) if isinstance(i, list) else i for i in parsed[1:]))
+    if len(_cache) > cache_size: _cache.popitem(last = False)
+    return parsed
+
+class effect_node:
+    """Effect letter and its value string, value is None if effect has no value"""
+    __slots__ = ('name', 'value')
+    def __init__(self, name:str, value:str = None):
+        self.name = name
+        self.value = value
+
+class beat_node:
+    """One beat of a pattern. `value` is a beat expression, or `[start, stop, slice character]` for slices, `sample` is `(sample, quote)` for samples"""
+    __slots__ = ('value', 'sample', 'effects')
+    def __init__(self, value, sample:tuple = None):
+        self.value = value
+        self.sample = sample
+        self.effects = []
+
+    @property
+    def slice(self):
+        """slice character, None if beat isn't a slice"""
+        return self.value[2] if isinstance(self.value, list) else None
+
+    def to_list(self) -> list:
+        """Beat as returned by `parse`"""
+        effects = [[e.name, e.value] for e in self.effects]
+        if self.sample is None: return [self.value, effects]
+        return [self.sample[0], effects, self.sample[1], self.value]
 
-    # Creates a list of beat strings so that I can later see if there is a `!` in the string
+class pattern_tree:
+    """Parsed pattern: beats, join operator before each beat, shuffles as `(beat index, group)` and pattern length"""
+    def __init__(self):
+        self.beats = []
+        self.operators = []
+        self.shuffles = []
+        self.length = 0
+
+    def to_tuple(self, pattern_length:int = None, c_slice:str = C_SLICE, c_join:str = C_JOIN, c_misc:str = C_MISC) -> tuple:
+        """Same tuple as `parse` returns"""
+        import math
+        if pattern_length is None: pattern_length = int(math.ceil(self.length))
+        return [b.to_list() for b in self.beats], list(self.operators), pattern_length, [i[1] for i in self.shuffles], [i[0] for i in self.shuffles], c_slice, c_misc, c_join
+
+    def add(self, num:str, sample:tuple = None, counted = True, slices = True, c_slice:str = C_SLICE) -> beat_node:
+        """Adds a beat from its number string, splits slices and updates pattern length. `slices = False` skips length of slices"""
+        for c in c_slice:
+            if c in num:
+                num = num.split(c)[:2] + [c]
+                if slices is True and counted is True:
+                    num0, num1 = _number(num[0]), _number(num[1])
+                    if c == c_slice[0]: self.length = max(num0, num1, self.length)
+                    if c == c_slice[1]: self.length = max(num0-1, num0+num1-1, self.length)
+                    if c == c_slice[2]: self.length = max(num0-num1, num0, self.length)
+                break
+        else:
+            if counted is True: self.length = max(_number(num), self.length)
+        node = beat_node(num, sample)
+        self.beats.append(node)
+        return node
+
+_tokenizers = {}
+def _tokenizer(c_slice:str = C_SLICE, c_join:str = C_JOIN, c_misc:str = C_MISC) -> tuple:
+    """Returns three regexes. First one matches a whole plain beat - number, effects and join character. 
+    Second one matches one token: a run of number characters, `i`, `%`, shuffle with its group, opening quote of a sample, or any other character. 
+    Third one splits effects into letters and values."""
+    if (c_slice, c_join, c_misc) not in _tokenizers:
+        import re
+        special = c_misc[0:4] + c_misc[7] + c_misc[8] + c_misc[10:12]
+        num = '[\\d' + re.escape(''.join(i for i in C_MATH + c_slice + c_misc[4:8] + c_misc[9] if i not in special)) + ']'
+        letters = '[' + ''.join(i for i in 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ' if i not in c_join + c_misc) + ']'
+        _tokenizers[(c_slice, c_join, c_misc)] = (
+            re.compile(f'(?P<value>{num}+)(?P<effects>(?:{letters}{num}*)*)(?P<join>[{re.escape(c_join)} ])'),
+            re.compile(f'(?P<num>{num}+)|(?P<i>{re.escape(c_misc[3])})|(?P<metric>{re.escape(c_misc[7])})|'
+            f'(?P<shuffle>{re.escape(c_misc[8])}[\\d+\\-*/]*)|(?P<sample>[{re.escape(c_misc[0:3] + c_misc[10:12])}])|(?P<char>.)', re.DOTALL),
+            re.compile(f'({letters})({num}*)'))
+    return _tokenizers[(c_slice, c_join, c_misc)]
+
+def _number(string:str):
+    """`utils._safer_eval` without eval for plain numbers"""
+    if string.isascii():
+        if string.isdigit() and (string[0] != '0' or len(string) == 1): return int(string)
+        if string.count('.') == 1 and len(string) > 1 and string.replace('.', '').isdigit(): return float(string)
+    return utils._safer_eval(string)
+
+def tree(pattern:str, samples:dict, pattern_length:int = None, c_slice:str = C_SLICE, c_join:str = C_JOIN, c_misc:str = C_MISC) -> pattern_tree:
+    """Parses a normalized pattern into a `pattern_tree` in a single pass, loads used samples into `samples`"""
+    # `?` beats don't count towards pattern length
     separated = pattern
-    for i in c_join:
-        separated = separated.replace(i, c_join[0])
-    separated = separated.split(c_join[0])
-    pattern = pattern.replace(c_misc[6], '')
-    
-    # parsing
-    length = 0
+    for i in c_join: separated = separated.replace(i, c_join[0])
+    counted = [c_misc[6] not in i for i in separated.split(c_join[0])]
+    pattern = pattern.replace(c_misc[6], '') + ' '
+
+    fast, match, effects = (i.match if n < 2 else i.findall for n, i in enumerate(_tokenizer(c_slice, c_join, c_misc)))
+    result = pattern_tree()
+    beats, shuffles = result.beats, result.shuffles
+    result.operators.append(c_join[0])
+    slices = pattern_length is None
     num = ''
-    cur = 0
-    beats = []
-    operators = [separator]
-    shuffle_beats = []
-    shuffle_groups = []
-    current_beat = 0
+    current = 0
     effect = None
-    pattern += ' '
-    sample_toadd = None
-
-    # Loops over all characters
-    while cur < len(pattern):
-        char = pattern[cur]
-        #print(f'char = {char}, cur = {cur}, num = {num}, current_beat = {current_beat}, effect = {effect}, len(beats) = {len(beats)}, length = {length}')
-        if char == c_misc[3]: char = str(current_beat+1)  # Replaces `i` with current number
-
-        # If character is `", ', `, or [`: searches for closing quote and gets the sample rate, 
-        # moves cursor to the character after last quote/bracket, creates a sample_toadd variable with the sample.
-        elif char in c_misc[0:3]+c_misc[10:12]:
-            quote = char
+    sample = None
+    after_sample = False
+    pos = 0
+    while pos < len(pattern):
+        # a plain beat like `1>0.5r,` is parsed in one go
+        if len(beats) == current and sample is None and after_sample is False and num == '':
+            token = fast(pattern, pos)
+            if token is not None:
+                value, beat_effects, join = token.group('value', 'effects', 'join')
+                node = result.add(value, None, counted[current], slices, c_slice)
+                if beat_effects != '': node.effects = [effect_node(e, v if v != '' else None) for e, v in effects(beat_effects)]
+                if join != ' ':
+                    current += 1
+                    result.operators.append(join)
+                pos = token.end()
+                continue
+
+        token = match(pattern, pos)
+        kind = token.lastgroup
+        # character right after a sample isn't checked for `i` or quotes
+        if after_sample is True:
+            if kind == 'i' or kind == 'sample': kind = 'char'
+            after_sample = False
+
+        if kind == 'num':
+            num += token.group()
+            pos = token.end()
+        elif kind == 'i':
+            num += str(current+1)
+            pos += 1
+        # `%` takes the next character as well if beat hasn't been created yet
+        elif kind == 'metric':
+            num += c_misc[7]
+            pos += 1
+            if len(beats) == current:
+                num += pattern[pos]
+                pos += 1
+        elif kind == 'shuffle':
+            shuffles.append((current, token.group()[1:]))
+            pos = token.end()
+        elif kind == 'sample':
+            quote = token.group()
             if quote == c_misc[10]: quote = c_misc[11] # `[` is replaced with `]`
-            cur += 1
-            sample = ''
-
-            # Gets sample name between quote characters, moves cursor to the ending quote.
-            while pattern[cur] != quote:
-                sample += pattern[cur]
-                cur += 1
-            assert sample in samples, f"No sample named `{sample}` found in samples. Available samples: {samples.keys()}"
-            
+            end = pattern.find(quote, pos+1)
+            if end == -1: raise IndexError(f"No closing `{quote}` in `{pattern[pos:]}`")
+            name = pattern[pos+1:end]
+            assert name in samples, f"No sample named `{name}` found in samples. Available samples: {samples.keys()}"
             # If sample is a song, it will be converted to a song if needed, and beatmap will be generated
-            if quote == c_misc[11]: 
-                if not isinstance(samples[sample], main.song): samples[sample] = main.song(samples[sample])
-                if samples[sample].beatmap is None: 
-                    samples[sample].beatmap_generate()
-                    samples[sample].beatmap_adjust()
-
+            if quote == c_misc[11]:
+                if not isinstance(samples[name], main.song): samples[name] = main.song(samples[name])
+                if samples[name].beatmap is None:
+                    samples[name].beatmap_generate()
+                    samples[name].beatmap_adjust()
             # Else sample is a sound file
-            elif not isinstance(samples[sample], np.ndarray): samples[sample] = io._load(samples[sample])[0] 
-
-            sample_toadd = [samples[sample], [], quote, None] # Creates the sample_toadd variable
-            cur += 1
-            char = pattern[cur]
-
-        # If character is a math character, a slice character, or `@_?!%` - random, not count, skip, create variable -
-        # - it gets added to `num`, and the loop repeats.
-        # _safer_eval only takes part of the expression to the left of special characters (@%#), so it won't affect length calculation
-        if char.isdecimal() or char in (C_MATH + c_slice + c_misc[4:8] + c_misc[9]):
-            num += char
-            #print(f'char = {char}, added it to num: num = {num}')
-
-            # If character is `%` and beat hasn't been created yet, it takes the next character as well
-            if char == c_misc[7] and len(beats) == current_beat:
-                cur += 1
-                char = pattern[cur]
-                num += char
-
-        # If character is a shuffle character `#` + math expression, beat number gets added to `shuffle_beats`, 
-        # beat shuffle group gets added to `shuffle_groups`, cursor is moved to the character after the math expression, and loop repeats.
-        # That means operations after this will only execute once character is not a math character.
-        elif char == c_misc[8]:
-            cur+=1
-            number, cur = _getnum(pattern, cur)
-            char = pattern[cur]
-            shuffle_beats.append(current_beat)
-            shuffle_groups.append(number)
-
-        # If character is not math/shuffle, that means math expression has ended. Now it tries to figure out where the expression belongs, 
-        # and parses the further characters
+            elif not isinstance(samples[name], np.ndarray): samples[name] = io._load(samples[name])[0]
+            sample = (samples[name], quote)
+            pos = end + 1
+            after_sample = True
+
+        # any other character ends the number
         else:
-            
-            # If the beat has not been added, it adds the beat. Also figures out pattern length.
-            if len(beats) == current_beat and len(num) > 0:
-                # Checks all slice characters in the beat expression. If slice character is found, splits the slice and breaks.
-                for c in c_slice:
-                    if c in num:
-                        num = num.split(c)[:2] + [c]
-                        #print(f'slice: split num by `{c}`, num = {num}, whole beat is {separated[current_beat]}')
-                        if pattern_length is None and c_misc[6] not in separated[current_beat]:
-                            num0, num1 = utils._safer_eval(num[0]), utils._safer_eval(num[1])
-                            if c == c_slice[0]: length = max(num0, num1, length)
-                            if c == c_slice[1]: length = max(num0-1, num0+num1-1, length)
-                            if c == c_slice[2]: length = max(num0-num1, num0, length)
-                        break
-                # If it didn't break, the expression is not a slice, so it pattern length is just compared with the beat number.
-                else: 
-                    #print(f'single beat: {num}. Whole beat is {separated[current_beat]}')
-                    if c_misc[6] not in separated[current_beat]: length = max(utils._safer_eval(num), length)
-
-                # If there no sample saved in `sample_toadd`, adds the beat to list of beats.
-                if sample_toadd is None: beats.append([num, []])
-                # If `sample_toadd` is not None, beat is a sample/song. Adds the beat and sets sample_toadd to None
-                else: 
-                    sample_toadd[3] = num
-                    beats.append(sample_toadd)
-                    sample_toadd = None
-                #print(f'char = {char}, got num = {num}, appended beat {len(beats)}')
-
-            # Sample might not have a `num` with a slice, this adds the sample without a slice
-            elif len(beats) == current_beat and len(num) == 0 and sample_toadd is not None:
-                beats.append(sample_toadd)
-                sample_toadd = None
-
-            # If beat has been added, it now parses beats.
-            if len(beats) == current_beat+1:
-                #print(f'char = {char}, parsing effects:')
-
-                # If there is an effect and current character is not a math character, effect and value are added to current beat, and effect is set to None
+            char = token.group()
+            pos += 1
+            if len(beats) == current:
+                if len(num) > 0:
+                    result.add(num, sample, counted[current], slices, c_slice)
+                    sample = None
+                # sample without a slice
+                elif sample is not None:
+                    beats.append(beat_node(None, sample))
+                    sample = None
+
+            if len(beats) == current+1:
                 if effect is not None:
-                    #print(f'char = {char}, adding effect: type = {effect}, value = {num}')
-                    beats[current_beat][1].append([effect, num if num!='' else None])
+                    beats[current].effects.append(effect_node(effect, num if num != '' else None))
                     effect = None
+                if char.isalpha(): effect = char
+                # join starts the next beat
+                if char in c_join:
+                    current += 1
+                    effect = None
+                    result.operators.append(char)
+            num = ''
 
-                # If current character is a letter, it sets that letter to `effect` variable. 
-                # Since loop repeats after that, that while current character is a math character, it gets added to `num`.
-                if char.isalpha() and effect is None:
-                    #print(f'char = {char}, effect type is {effect}')
-                    effect = char
-
-            # If character is a beat separator, it starts parsing the next beat in the next loop. 
-            if char in c_join and len(beats) == current_beat + 1:
-                #print(f'char = {char}, parsing next beat')
-                current_beat += 1
-                effect = None
-                operators.append(char)
-
-            num = '' # `num` is set to empty string. btw `num` is only used in this loop so it needs to be here
-        
-        cur += 1 # cursor goes to the next character
-
-    
-    #for i in beats: print(i)
-    import math
-    if pattern_length is None: pattern_length = int(math.ceil(length))
+    return result
 
-    return beats, operators, pattern_length, shuffle_groups, shuffle_beats, c_slice, c_misc, c_join
+def _parse(pattern:str, samples:dict, pattern_length:int = None,
+        c_slice:str = C_SLICE,
+        c_join:str = C_JOIN, 
+        c_misc:str = C_MISC):
+    """Parses a normalized pattern, see `parse`"""
+    return tree(pattern, samples, pattern_length, c_slice, c_join, c_misc).to_tuple(pattern_length, c_slice, c_join, c_misc)
 
 # I can't be bothered to annotate this one. It just works, okay?
 def _random(beat:str, length:int, rchar = C_MISC[4], schar = C_MISC[5]) -> str:
@@ -224,6 +308,33 @@ def _random(beat:str, length:int, rchar = C_MISC[4], schar = C_MISC[5]) -> str:
         beat = ''.join(beat)
     return beat
 
+def _random_pattern() -> str:
+    """Generates a random pattern"""
+    import random,math
+    pattern = ''
+    rand_length=0
+    limit = 10000
+    while True:
+        limit -= 1
+        rand_num = int(math.floor(random.triangular(1, 16, rand_length-1)))
+        if random.uniform(0, rand_num)>rand_length: rand_num = rand_length+1
+        rand_slice = random.choices(['','>0.5','>0.25', '<0.5', '<0.25', '<1/3', '<2/3', '>1/3', '>2/3', '<0.75', '>0.75', 
+                                     f'>{random.uniform(0.01,2)}', f'<{random.uniform(0.01,2)}'], weights = [13,1,1,1,1,1,1,1,1,1,1,1,1], k=1)[0]
+
+        rand_effect = random.choices(['', 's0.5', 's2', f's{random.triangular(0.1,1,4)}', 'r','v0.5', 'v2', 'v0', 
+                                      f'd{int(random.triangular(1,8,16))}', 'g', 'c', 'c0', 'c1', f'b{int(random.triangular(1,8,4))}'], 
+                                      weights=[30, 2, 2, 2, 2, 1, 1, 2, 2, 1, 2, 2, 2, 1], k=1)[0]
+
+        rand_join = random.choices([', ', ';'], weights = [5, 1], k=1)[0]
+        pattern += f'{rand_num}{rand_slice}{rand_effect}{rand_join}'
+        if rand_join == ',': rand_length+=1
+        if rand_length in [4, 8, 16]: 
+            if random.uniform(rand_num,16)>14: break
+        else: 
+            if random.uniform(rand_num,16)>15.5: break
+        if limit <= 0: break
+    return pattern
+
 def _shuffle(pattern: list, shuffle_beats: list, shuffle_groups: list) -> list:
     """Shuffles pattern according to shuffle_beats and shuffle_groups"""
     import random
@@ -1,29 +1,47 @@
-from . import main, utils
-BM_SAMPLES = {'cowbell' : 'beat_manipulator/samples/cowbell.flac',
-              }
+from . import io, main, utils
+from .utils import BM_SAMPLES
+import copy, os
 
-presets = {}
+# loaded on first use, `presets` attribute of this module is available through __getattr__
+_presets = None
 
-def presets_load(path, mode = 'add'):
-    global presets
+def presets_load(path = None, mode = 'add'):
+    """Loads presets from a yaml file, by default `presets.yaml` next to this module"""
+    global _presets
     import yaml
+    if path is None: path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'presets.yaml')
     with open(path, 'r') as f:
         yaml_presets = yaml.safe_load(f.read())
     
     # if mode.lower() == 'add':
     #     presets = presets | yaml_presets
     # elif mode.lower() == 'replace':
-        presets = yaml_presets
+        _presets = yaml_presets
 
-presets_load('beat_manipulator/presets.yaml')
+def _loaded() -> dict:
+    if _presets is None: presets_load()
+    return _presets
 
-def _beatswap(song, pattern, pattern_name, scale = 1, shift = 0, output = '', modify = False):
-    if isinstance(scale, str):
-        if ',' in scale: scale = scale.replace(' ', '').split(',')
+def __getattr__(name):
+    if name == 'presets': return _loaded()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def _scales(scale) -> list:
+    """`'1, 0.5'` or `1` to a list of scales"""
+    if isinstance(scale, str): scale = scale.replace(' ', '').split(',')
     elif not isinstance(scale, list): scale = [scale]
+    return scale
+
+def _write(song, audio, pattern_name, scale, scales, output = ''):
+    output = io._outputfilename(output, filename=song.path, suffix = f' ({pattern_name}{(" x"+str(round(utils._safer_eval(scale), 4))) * (len(scales)>1)})', ext='mp3')
+    io.write_audio(audio=audio, sr=song.sr, output=output, log=song.log)
+
+def _beatswap(song, pattern, pattern_name, scale = 1, shift = 0, output = '', modify = False):
+    scale = _scales(scale)
     if modify is False:
-        for i in scale:
-            main.beatswap(song, pattern = pattern, scale = i, shift = shift, output=output, suffix = f' ({pattern_name}{(" x"+str(round(utils._safer_eval(i), 4))) * (len(scale)>1)})', copy = True)
+        if not isinstance(song, main.song): song = main.song(song)
+        for n, k, audio in song.beatswap_iter([pattern], scales = [scale], shifts = shift):
+            _write(song, audio, pattern_name, scale[k], scale, output = output)
     else:
         assert isinstance(song, main.song), f"In order to modify a song, it needs to be of a main.song type, but it is {type(song)}"
         song.beatswap(pattern, scale = scale[0], shift = shift)
@@ -31,13 +49,13 @@ def _beatswap(song, pattern, pattern_name, scale = 1, shift = 0, output = '', mo
 
 def get(preset):
     """returns (pattern, scale, shift)"""
-    global presets
+    presets = _loaded()
     assert preset in presets, f"{preset} not found in presets."
     preset = presets[preset]
     return preset['pattern'], preset['scale'] if 'scale' in preset else 1, preset['shift'] if 'shift' in preset else 0
 
 def use(song, preset, output = '', scale = 1, shift = 0):
-    global presets
+    presets = _loaded()
     assert preset in presets, f"{preset} not found in presets."
     preset_name = preset
     preset = presets[preset]
@@ -59,11 +77,20 @@ def use(song, preset, output = '', scale = 1, shift = 0):
         else:
             _beatswap(song, pattern = preset['pattern'], scale = scale*(preset['scale'] if 'scale' in preset else 1), shift = shift*(preset['shift'] if 'shift' in preset else 0), output = output, modify = False, pattern_name = preset_name)
 
-def use_all(song, output = ''):
+def use_all(song, output = '', workers = None):
     if not isinstance(song, main.song): song = main.song(song)
+    presets = _loaded()
+    # single pattern presets are rendered in one batch, sharing song audio and beatmaps, and every render is written as soon as it's done
+    batch = [key for key, preset in presets.items() if not isinstance(list(preset.values())[0], dict) and 'sample' not in preset and 'sidechain' not in preset]
+    scales = [_scales(presets[key]['scale'] if 'scale' in presets[key] else 1) for key in batch]
+    results = song.beatswap_iter([presets[key]['pattern'] for key in batch], scales = scales, workers = workers)
     for key in presets.keys():
         print(f'__ {key} __')
-        use(song, key, output = output)
+        if key in batch:
+            n = batch.index(key)
+            for i in scales[n]: _write(song, next(results)[2], key, i, scales[n], output = output)
+        # presets of many patterns modify the song they get, and batch renders are still reading it
+        else: use(copy.copy(song), key, output = output)
         print()
 
 def test(song, scale = 1, shift = 0, adjust = 0, output = '', load_settings = False):
@@ -0,0 +1,660 @@
+import functools, numpy as np
+from . import effects, metrics, parse, utils
+from .effects import BM_EFFECTS
+from .metrics import BM_METRICS
+
+class plan:
+    """Flat render table compiled from a parsed pattern and a beatmap.
+
+    Row `i` takes `sources[source[i]][:, start[i]:stop[i]]`, reversed if `step[i]` is -1, applies `chains[chain[i]]`,
+    and joins it to the output with `c_join[join[i]]`. Join -1 means the beat is rendered but thrown away.
+    
+    `features` is the feature table of song beats, `feature[i]` is row of the table that row `i` with a `%` metric is, or -1 if it isn't a whole beat of the song.
+    `quality` is quality of the speed effect, see `effects.speed`."""
+    def __init__(self, sources, intro, source, start, stop, step, chain, join, metric, chains, c_join, metrics = BM_METRICS, features = None, feature = None, quality: str = None):
+        self.sources = sources
+        self.intro = intro
+        self.source = source
+        self.start = start
+        self.stop = stop
+        self.step = step
+        self.chain = chain
+        self.join = join
+        self.metric = metric
+        self.chains = chains
+        self.c_join = c_join
+        self.metrics = metrics
+        self.features = features
+        self.feature = feature
+        self.quality = quality
+
+    def __len__(self): return len(self.start)
+
+    @property
+    def lengths(self): return self.stop - self.start
+
+    @property
+    def simple(self):
+        """True if every row is a plain beat appended with `,`, so the whole plan is a single gather"""
+        return bool(np.all(self.chain == 0) and np.all(self.join == 0) and not np.any(self.metric != ''))
+
+
+def _slice(beatmap: np.ndarray, a: np.ndarray) -> tuple:
+    """Vectorized `song._slice`: converts beat positions to sample positions. Returns (positions, mask of positions that raise IndexError)"""
+    length = len(beatmap)
+    if length == 0: return np.zeros(len(a), dtype=np.int64), np.ones(len(a), dtype=bool)
+    dec = a % 1
+    whole = dec == 0
+    i = np.trunc(a).astype(np.int64)
+    err = (i < -length) | (i >= length) | (~whole & ((i + 1 < -length) | (i + 1 >= length)))
+    i = np.where(err, 0, i)
+    start = beatmap[i]
+    following = beatmap[np.where(whole, i, i + 1)]
+    return np.where(whole, start, np.trunc(start + dec * (following - start)).astype(np.int64)), err
+
+def _beat_slice(beatmap: np.ndarray, start: np.ndarray, stop: np.ndarray) -> tuple:
+    """Vectorized `song[start:stop]`, returns (start, stop, step, error) in samples. Like in `song.__getitem__`, start > stop is swapped and sliced with step -1."""
+    reverse = start > stop
+    start, stop = np.where(reverse, stop, start), np.where(reverse, start, stop)
+    start, err_start = _slice(beatmap, start)
+    stop, err_stop = _slice(beatmap, stop)
+    return start, stop, np.where(reverse, -1, 1), err_start | err_stop
+
+def _canonical(start: np.ndarray, stop: np.ndarray, step: np.ndarray, length: int) -> tuple:
+    """Python slice semantics of `audio[:, start:stop:step]` for steps 1 and -1, as (start, stop) range with start <= stop"""
+    start = np.where(start < 0, start + length, start)
+    stop = np.where(stop < 0, stop + length, stop)
+    forward_start = np.clip(start, 0, length)
+    forward_stop = np.maximum(np.clip(stop, 0, length), forward_start)
+    backward_start = np.clip(stop, -1, length - 1) + 1
+    backward_stop = np.maximum(np.clip(start, -1, length - 1) + 1, backward_start)
+    return np.where(step > 0, forward_start, backward_start), np.where(step > 0, forward_stop, backward_stop)
+
+def _bounds(beat, a, b, offset, c_slice: str = utils.C_SLICE):
+    """Beat positions of a beat string/slice for every loop of the pattern, same arithmetic as the old beatswap loop"""
+    if b is None:
+        a = a + offset
+        return a - 1, a
+    if beat[2] == c_slice[0]: return a + offset, b + offset
+    elif beat[2] == c_slice[1]: return (a - 1) + offset, ((a - 1) + b) + offset
+    else: return (a - b) + offset, a + offset
+
+def _wrap(a, offset, length):
+    a = a.copy()
+    while (over := a + offset > length - 1).any(): a[over] = 1 + a[over] - length
+    return a
+
+def _chain(effect: list, effects: dict, c_misc7: str) -> tuple:
+    """Resolves effect letters and pre-evaluates values that don't depend on a `%` variable"""
+    chain = []
+    for e, v in effect:
+        if e in effects:
+            if isinstance(v, str) and c_misc7 not in v: v = utils._safer_eval(v)
+            chain.append((effects[e], v))
+    return tuple(chain)
+
+def _source(sources: list, audio) -> int:
+    for i, s in enumerate(sources):
+        if s is audio: return i
+    sources.append(audio)
+    return len(sources) - 1
+
+def compile(song, parsed: tuple, effects: dict = BM_EFFECTS, metrics: dict = BM_METRICS, limit_beats = 10000, beatmap: np.ndarray = None, quality: str = None) -> plan:
+    """Turns `parse.parse` output and `song.beatmap` (or `beatmap` if given) into a plan. Beats are resolved for all loops of the pattern at once.
+    `quality` of the speed effect is kept in the plan, `effects.SPEED_QUALITY` by default."""
+    pattern, operators, pattern_length, shuffle_groups, shuffle_beats, c_slice, c_misc, c_join = parsed
+    beatmap = np.asarray(song.beatmap if beatmap is None else beatmap, dtype=np.int64)
+    loops = len(beatmap) // max(pattern_length, 1) + 2
+    offset = np.arange(loops, dtype=np.int64) * pattern_length
+    width = len(pattern)
+    sources, chains = [song.audio], [()]
+    source = np.zeros((loops, width), dtype=np.int64)
+    start = np.zeros((loops, width), dtype=np.int64)
+    stop = np.zeros((loops, width), dtype=np.int64)
+    step = np.ones((loops, width), dtype=np.int64)
+    err = np.zeros((loops, width), dtype=bool)
+    skip = np.zeros(width, dtype=bool)
+    flip = np.ones(width, dtype=np.int64)
+    chain = np.zeros(width, dtype=np.int64)
+    metric = np.full(width, '', dtype='<U1')
+    randoms = {}
+    def evaluate(j, b, values):
+        """writes beat positions of pattern entry `j` for all loops, given evaluated values of its beat expression"""
+        beat = b[3] if len(b) == 4 else b[0]
+        if len(b) == 4:
+            sample = b[0]
+            if beat is None:
+                start[:, j], stop[:, j] = 0, len(sample.audio[0])
+                return
+            bm = np.asarray(sample.beatmap, dtype=np.int64)
+            if len(bm) < 2:
+                err[:, j] = True
+                return
+            # When beats go past the end of the sample song, they wrap around
+            if values[1] is None: bounds = _bounds(beat, _wrap(values[0] + offset, 0, len(bm)), None, 0, c_slice)
+            else: bounds = _bounds(beat, _wrap(values[0], offset, len(bm)), _wrap(values[1], offset, len(bm)), offset, c_slice)
+        else:
+            bm = beatmap
+            bounds = _bounds(beat, values[0], values[1], offset, c_slice)
+        s, e, step[:, j], err[:, j] = _beat_slice(bm, *bounds)
+        start[:, j], stop[:, j] = _canonical(s, e, step[:, j], len(sources[source[0, j]][0]))
+
+    for j, b in enumerate(pattern):
+        if len(b) == 4: beat = b[3] # Sample has length 4
+        else: beat = b[0] # Else take the beat
+        beat_as_string = ''.join(beat) if isinstance(beat, list) else beat
+
+        # Skips `!` beats
+        if beat is not None and c_misc[9] in beat_as_string:
+            skip[j] = True
+            continue
+
+        # `%` creates a variable from the beat before any effects
+        if len(b) != 4 and c_misc[7] in beat_as_string:
+            metric[j] = beat_as_string[beat_as_string.find(c_misc[7])+1]
+            assert metric[j] in metrics, f'`%{metric[j]}`: No metric called `{metric[j]}` found in metrics. Available metrics: {metrics.keys()}'
+
+        # leading reverses are done by the gather itself
+        effect = _chain(b[1], effects, c_misc[7])
+        if metric[j] == '':
+            while len(effect) > 0 and effect[0][0] == 'reverse':
+                effect = effect[1:]
+                flip[j] = -flip[j]
+        if effect not in chains: chains.append(effect)
+        chain[j] = chains.index(effect)
+
+        # Audio is an audio file, slice doesn't depend on the loop. Songs are stored with `]` as the quote
+        if len(b) == 4 and b[2] not in c_misc[10:12]:
+            audio = b[0]
+            source[:, j] = _source(sources, audio)
+            audio_length = len(audio[0])
+            if beat is None or not isinstance(beat, list): s, e, st = 0, audio_length, 1
+            else:
+                s, e = min(int(utils._safer_eval(beat[0])*audio_length), audio_length-1), min(int(utils._safer_eval(beat[1])*audio_length), audio_length-1)
+                if s > e: s, e, st = e, s, -1
+                else: st = 1
+            s, e = _canonical(np.array([s]), np.array([e]), np.array([st]), audio_length)
+            start[:, j], stop[:, j], step[:, j] = s[0], e[0], st
+
+        # Audio is a song or a beat
+        else:
+            if len(b) == 4: source[:, j] = _source(sources, b[0].audio)
+            if beat is None: values = [None, None]
+            elif isinstance(beat, str): values = [beat, None]
+            else: values = beat[:2]
+            # `@` is random for every loop, that is evaluated later in the same order as before
+            if any(v is not None and c_misc[4] in v for v in values):
+                randoms[j] = [np.zeros(loops) if v is not None else None for v in values]
+            else: evaluate(j, b, [np.full(loops, utils._safer_eval(v)) if v is not None else None for v in values])
+
+    # Every time pattern loops, shuffles beats with `#`, and random beats are generated
+    order = np.tile(np.arange(width), (loops, 1))
+    if len(shuffle_beats) > 0 or len(randoms) > 0:
+        current = list(range(width))
+        for n in range(loops):
+            if len(shuffle_beats) > 0: current = parse._shuffle(current, shuffle_beats, shuffle_groups)
+            order[n] = current
+            for j in current:
+                if j in randoms:
+                    beat = pattern[j][3] if len(pattern[j]) == 4 else pattern[j][0]
+                    beat = [beat] if isinstance(beat, str) else beat
+                    for i, v in enumerate(randoms[j]):
+                        if v is not None:
+                            v[n] = utils._safer_eval(parse._random(beat[i], rchar = c_misc[4], schar = c_misc[5], length = pattern_length) if c_misc[4] in beat[i] else beat[i])
+        for j, values in randoms.items(): evaluate(j, pattern[j], values)
+    step *= flip
+
+    # flattens to rows in the order they are played
+    source, start, stop, step, err = (np.take_along_axis(i, order, axis=1).ravel() for i in (source, start, stop, step, err))
+    skip, chain, metric = skip[order].ravel(), chain[order].ravel(), metric[order].ravel()
+    join = np.tile(np.array([c_join.index(i) for i in operators[:width]], dtype=np.int64), loops)
+
+    # IndexError happens when pattern goes past the last beat. After 30 of those, rest of the loop is skipped
+    tries = np.cumsum(err)
+    reached = (np.cumsum((err & (tries > 30)).reshape(loops, width), axis=1) == 0).ravel()
+    rows = reached & ~skip & ~err & (stop > start)
+
+    # Makes sure beat doesn't get added on top of previous beat multiple times when pattern is out of range of song beats, to avoid distorted end.
+    join[(join != 0) & (tries >= 2)] = -1
+
+    rows = np.flatnonzero(rows)
+    if limit_beats is not None:
+        appended = np.cumsum(join[rows] == 0)
+        rows = rows[1 + appended - (join[rows] == 0) < limit_beats]
+
+    # `%` metrics of whole beats of the song are read from the feature table
+    features = feature = None
+    if np.any(metric[rows] != '') and any(isinstance(v, str) for c in chains for e, v in c) and hasattr(song, 'beat_features'):
+        features = song.beat_features(beatmap)
+        starts = features['start']
+        k = np.minimum(np.searchsorted(starts, start[rows]), max(len(starts) - 1, 0))
+        whole = (source[rows] == 0) & (step[rows] > 0) & (metric[rows] != '')
+        if len(starts) > 0: whole &= (starts[k] == start[rows]) & (features['stop'][k] == stop[rows])
+        else: whole[:] = False
+        feature = np.where(whole, k, -1)
+
+    return plan(sources = sources, intro = int(beatmap[0]), source = source[rows], start = start[rows], stop = stop[rows], step = step[rows],
+                chain = chain[rows], join = join[rows], metric = metric[rows], chains = chains, c_join = c_join, metrics = metrics, features = features, feature = feature, quality = quality)
+
+def runs(p: plan) -> tuple:
+    """Merges rows that continue each other in the same source into runs. Returns (first row, source, start, stop, step) arrays of the runs."""
+    source, start, stop, step = p.source, p.start, p.stop, p.step
+    if len(p) == 0: return (np.zeros(0, dtype=np.int64),)*5
+    follows = (source[1:] == source[:-1]) & (step[1:] == step[:-1]) & np.where(step[1:] > 0, start[1:] == stop[:-1], stop[1:] == start[:-1])
+    first = np.flatnonzero(np.concatenate(([True], ~follows)))
+    last = np.concatenate((first[1:], [len(p)])) - 1
+    forward = step[first] > 0
+    return first, source[first], np.where(forward, start[first], start[last]), np.where(forward, stop[last], stop[first]), step[first]
+
+def gather(p: plan, out: np.ndarray = None, rows: int = None) -> np.ndarray:
+    """Copies source audio of the first `rows` rows of a plan into one `(channels, frames)` array. Consecutive beats are copied as one run, so plain playback is a single copy."""
+    if rows is None: rows = len(p)
+    first, source, start, stop, step = runs(p)
+    last = np.concatenate((first[1:], [len(p)]))
+    # last run may be cut by `rows`
+    cut = np.searchsorted(first, rows)
+    first, source, start, stop, step, last = (i[:cut].tolist() for i in (first, source, start, stop, step, last))
+    if cut > 0 and last[-1] > rows:
+        if step[-1] > 0: stop[-1] = int(p.stop[rows-1])
+        else: start[-1] = int(p.start[rows-1])
+    if out is None: out = np.empty((len(p.sources[0]), int(np.sum(p.lengths[:rows]))), dtype = p.sources[0].dtype)
+    offset = 0
+    for k, s, e, st in zip(source, start, stop, step):
+        out[:, offset:offset + e - s] = p.sources[k][:, s:e] if st > 0 else p.sources[k][:, s:e][:, ::-1]
+        offset += e - s
+    return out
+
+def _beat(p: plan, i: int) -> np.ndarray:
+    """Source audio of row `i`, as a view"""
+    beat = p.sources[p.source[i]][:, p.start[i]:p.stop[i]]
+    return beat if p.step[i] > 0 else beat[:, ::-1]
+
+def _metric(p: plan, i: int):
+    """Value of the `%` metric of row `i`, read from the feature table if the row is a whole beat of the song"""
+    function = p.metrics[p.metric[i]]
+    if p.feature is not None and p.feature[i] >= 0 and function in metrics.BM_FEATURES: return metrics.BM_FEATURES[function](p.features, p.feature[i])
+    return function(_beat(p, i))
+
+def _effect(beat: np.ndarray, e, v, quality: str = None):
+    if e is effects.speed:
+        return e(beat, v, quality = quality)
+    elif e == 'downsample':
+        if v is None: v = 8
+        return np.repeat(beat[:,::v], v, axis=1)
+    elif e == 'gradient':
+        return np.gradient(beat, axis=1)
+    elif e == 'reverse':
+        return beat[:,::-1]
+    else:
+        return e(beat, v)
+
+# effects that aren't registered can do anything to the beat
+_MUTATES = effects.capabilities(mutates = True)
+
+def _capabilities(e) -> effects.capabilities:
+    try:
+        if e in effects.BM_CAPABILITIES: return effects.BM_CAPABILITIES[e]
+    except TypeError: pass
+    return getattr(e, 'capabilities', _MUTATES)
+
+def _length(e, v, length: int):
+    """Length of a beat after an effect, or None if it can only be known by applying the effect"""
+    if _capabilities(e).length: return length
+    elif e == 'downsample':
+        if v is None: v = 8
+        return len(range(length)[::v]) * v
+    elif e is effects.speed:
+        num, den = effects._ratio(abs(v))
+        return -(-length * den // num)
+    return None
+
+def _chain_length(chain: tuple, length: int):
+    """Length of a beat after an effect chain, or None if it can only be known by applying it"""
+    for e, v in chain:
+        if length is None or isinstance(v, str): return None
+        length = _length(e, v, length)
+    return length
+
+# pointwise effects are applied this many samples at a time, so that all of them run while a block is still in cache
+_BLOCK = 65536
+
+def _pointwise(beat: np.ndarray, steps: list, out: np.ndarray) -> np.ndarray:
+    """Applies `(kernel, value)` steps to `beat` one block at a time. Steps before the last one run in a small buffer, the last one writes into `out`"""
+    # blocks of `out` would overwrite other blocks of a beat that is a different view of it
+    if out is not beat and np.may_share_memory(beat, out): beat = beat.copy()
+    buffer = np.empty((len(beat), min(len(beat[0]), _BLOCK)), dtype = beat.dtype) if len(steps) > 1 and out is not beat else None
+    for i in range(0, max(len(beat[0]), 1), _BLOCK):
+        source, target = beat[:, i:i + _BLOCK], out[:, i:i + _BLOCK]
+        temporary = buffer[:, :len(source[0])] if buffer is not None else target
+        for n, (kernel, value) in enumerate(steps):
+            kernel(source, value, target if n == len(steps) - 1 else temporary)
+            source = temporary
+    return out
+
+def _process(beat: np.ndarray, chain: tuple, metric, c_misc7: str, clip = False, out: np.ndarray = None, quality: str = None) -> np.ndarray:
+    """Applies an effect chain to a beat, and clips it to -1, 1 if `clip`. `quality` is passed to the speed effect. `beat` is never modified, it's copied only before an effect that would modify it.
+    
+    Effects with kernels run in one buffer, `out` if it fits, consecutive pointwise ones together. Result is `out`, a new array, or a view of `beat`."""
+    if len(chain) == 0:
+        if not clip: return beat
+        return np.clip(beat, -1, 1, out = out if out is not None and out.shape == beat.shape and out.dtype == beat.dtype else None)
+    source = beat
+    steps = []
+    if clip: chain = chain + ((effects.clip, None),)
+    for n, (e, v) in enumerate(chain):
+        # parse effect value
+        if isinstance(v, str):
+            if metric is not None: v = parse._metric_replace(v, metric, c_misc7)
+            v = utils._safer_eval(v)
+        capabilities = _capabilities(e)
+        if capabilities.kernel is not None:
+            steps.append((capabilities.kernel, v))
+            if capabilities.pointwise and n + 1 < len(chain):
+                following = _capabilities(chain[n+1][0])
+                if following.pointwise and following.kernel is not None: continue
+            # last kernel writes into `out` if it fits, others into the beat itself, unless it's a view of the song
+            if n == len(chain) - 1 and out is not None and out.shape == beat.shape and out.dtype == beat.dtype: target = out
+            elif np.may_share_memory(beat, source): target = np.empty(beat.shape, dtype = beat.dtype)
+            else: target = beat
+            if capabilities.pointwise: beat = _pointwise(beat, steps, target)
+            else:
+                for kernel, value in steps: beat = kernel(beat, value, target)
+            steps = []
+            continue
+        if capabilities.mutates and np.may_share_memory(beat, source): beat = beat.copy()
+        beat = _effect(beat, e, v, quality)
+    return beat
+
+# batched runs of beats are processed this many samples at a time, plugins keep their state between those calls
+_BATCH = 2**22
+
+def _batched(chain: tuple) -> bool:
+    """True if chain has an effect that processes runs of beats together, and no `%` values that have to be processed beat by beat"""
+    return any(_capabilities(e).batch for e, v in chain) and not any(isinstance(v, str) for e, v in chain)
+
+def _batch(beats: list, chain: tuple, c_misc7: str, reset: bool = True, quality: str = None) -> list:
+    """Applies an effect chain to consecutive beats. Batch effects get all beats in one call, other effects are applied to every beat"""
+    part = ()
+    for e, v in chain + ((None, None),):
+        if e is not None and not _capabilities(e).batch:
+            part += ((e, v),)
+            continue
+        if len(part) > 0: beats = [_process(beat, part, None, c_misc7, quality = quality) for beat in beats]
+        part = ()
+        if e is not None: beats = e.batch(beats, [v] * len(beats), reset = reset)
+    return beats
+
+def _runs(p: plan, i: int, rows: int, lengths: np.ndarray, done: dict) -> list:
+    """Rows from `i` that use the same chain one after another, not counting rows that are thrown away, up to `_BATCH` samples"""
+    run = [i]
+    total = lengths[i]
+    for j in range(i + 1, rows):
+        if p.join[j] == -1: continue
+        if p.chain[j] != p.chain[i] or j in done or total + lengths[j] > _BATCH: break
+        run.append(j)
+        total += lengths[j]
+    return run
+
+def render(p: plan, limit_length = None, c_misc7: str = utils.C_MISC[7]) -> tuple:
+    """Renders a plan into one float32 `(channels, frames)` array, returns (audio, offsets). 
+    
+    `audio[:, offsets[i]:offsets[i+1]]` is the intro or a beat with all beats joined to it, those are the boundaries that get smoothed."""
+    simple = p.simple
+    lengths = p.lengths
+    done = {}
+
+    # Length of every beat after effects. Beats with effects that can't tell their length in advance are processed here and kept.
+    if not simple:
+        lengths = lengths.copy()
+        variables = any(isinstance(v, str) for c in p.chains for e, v in c)
+        metric = None
+        for i in range(len(p)):
+            chain = p.chains[p.chain[i]]
+            if variables and p.metric[i] != '': metric = _metric(p, i)
+            length = _chain_length(chain, lengths[i])
+            if length is None:
+                done[i] = _process(_beat(p, i), chain, metric, c_misc7, quality = p.quality)
+                length = len(done[i][0])
+            lengths[i] = length
+
+    # checks if length limit has been reached
+    rows = len(p)
+    if limit_length is not None: rows = int(np.searchsorted(np.cumsum(lengths), limit_length))
+
+    # Size of the intro and every `,` beat after all beats are joined to it. While joining, a beat can temporarily be longer than that.
+    joins = p.join[:rows]
+    if simple:
+        sizes = np.concatenate(([p.intro], lengths[:rows]))
+        extra = 0
+    else:
+        sizes = [p.intro]
+        extra = 0
+        peak = p.intro
+        for join, length in zip(joins.tolist(), lengths[:rows].tolist()):
+            if join == 0:
+                extra = max(extra, peak - sizes[-1])
+                sizes.append(length)
+                peak = length
+            elif join == 2: sizes[-1] = max(min(length, sizes[-1]) - 1, 0)
+            elif join == 3: sizes[-1] = max(length, sizes[-1])
+            peak = max(peak, sizes[-1])
+        extra = max(extra, peak - sizes[-1])
+    offsets = np.concatenate(([0], np.cumsum(sizes)))
+    audio = np.empty((len(p.sources[0]), offsets[-1] + extra), dtype = np.float32)
+    audio[:, :p.intro] = p.sources[0][:, :p.intro]
+
+    # Common case: beats are only reordered, sliced and reversed
+    if simple:
+        gather(p, out = audio[:, p.intro:], rows = rows)
+        np.clip(audio[:, p.intro:], -1, 1, out = audio[:, p.intro:])
+        return audio, offsets
+
+    group = 0
+    size = p.intro
+    scratch = None
+    batched = [_batched(chain) and _chain_length(chain, 1) is not None for chain in p.chains]
+    following = None
+    for i in range(rows):
+        join = joins[i]
+        if join == -1: continue
+
+        # Runs of beats with a batch effect are processed together, plugins keep their state while the run continues
+        if batched[p.chain[i]] and i not in done:
+            run = _runs(p, i, rows, lengths, done)
+            for j, beat in zip(run, _batch([_beat(p, j) for j in run], p.chains[p.chain[i]], c_misc7, reset = following != (i, p.chain[i]), quality = p.quality)): done[j] = beat
+            # run that was cut at `_BATCH` samples continues from the next row
+            j = run[-1] + 1
+            while j < rows and joins[j] == -1: j += 1
+            following = (j, p.chain[i])
+
+        # Adds the processed beat to the output, clipped to -1, 1
+        # Separator is `,` - beat is processed straight into the output
+        if join == 0:
+            group += 1
+            size = int(lengths[i])
+            target = audio[:, offsets[group]:offsets[group] + size]
+            if i in done: np.clip(done.pop(i), -1, 1, out = target)
+            else:
+                beat = _process(_beat(p, i), p.chains[p.chain[i]], None, c_misc7, clip = True, out = target, quality = p.quality)
+                if beat is not target: target[:] = beat
+            continue
+
+        if i in done: beat = np.clip(done.pop(i), -1, 1)
+        else:
+            # joined beats are only read, so they all share one buffer
+            if scratch is None: scratch = np.empty((len(audio), int(np.max(lengths[:rows]))), dtype = np.float32)
+            beat = _process(_beat(p, i), p.chains[p.chain[i]], None, c_misc7, clip = True, out = scratch[:, :lengths[i]], quality = p.quality)
+        size = _join(audio[:, offsets[group]:], size, beat, join)
+
+    return audio[:, :offsets[-1]], offsets
+
+def _join(group: np.ndarray, size: int, beat: np.ndarray, join: int) -> int:
+    """Joins a clipped beat to first `size` frames of `group` in place, returns the new size. `group` needs room for the longest of the two."""
+    length = len(beat[0])
+    shortest = min(length, size)
+    current = group[:, :size]
+
+    # Separator is `;` - always use first beat length, normalizes volume to 1.5
+    if join == 1:
+        current[:, :shortest] += beat[:, :shortest]
+        limit = np.max(current)
+        if limit > 1.5:
+            current /= limit*0.75
+
+    # Separator is `~` - cuts to shortest
+    elif join == 2:
+        size = max(shortest - 1, 0)
+        current[:, :size] += beat[:, :size]
+
+    # Separator is `&` - extends to longest
+    elif join == 3:
+        current[:, :shortest] += beat[:, :shortest]
+        if length > size:
+            group[:, size:length] = beat[:, size:]
+            size = length
+
+    # Separator is `^` - uses first beat length and multiplies beats, used for sidechain
+    elif join == 4:
+        current[:, :shortest] *= beat[:, :shortest]
+
+    # Separator is `$` - always use first beat length, additionally sidechains first beat by second
+    elif join == 5:
+        current[:, :shortest] *= effects.to_sidechain(beat[:, :shortest])
+        current[:, :shortest] += beat[:, :shortest]
+
+    # Separator is `}` - always use first beat length
+    elif join == 6:
+        current[:, :shortest] += beat[:, :shortest]
+
+    return size
+
+# fade lengths depend on the clicks, so only the most recently used ones are kept
+@functools.lru_cache(maxsize = 256)
+def _fade(length: int) -> tuple:
+    """Cached fade out curve for a length, and x² and x³ that the spline is evaluated on. Arrays are shared, so they are read only"""
+    x = np.arange(0, length, 1, dtype = np.float64)
+    curves = (np.linspace(1, 0, length)**0.5, x*x, x*x*x)
+    for i in curves: i.flags.writeable = False
+    return curves
+
+def _scores(current1, current2, following1, following2, smoothing: int = 100) -> np.ndarray:
+    """Fade lengths from last two samples before and first two samples after each boundary, 0 means no smoothing"""
+    num = np.abs(following1 - (current2 + (current2 - current1))) + np.abs(current2 - (following1 + (following1 - following2)))
+    # same precision as dividing one sample by 2, numpy < 2 turns float32 scalars into float64 there
+    num = num.astype(np.asarray(num.dtype.type(1) / 2).dtype) / 2
+    length = np.zeros(len(num), dtype = np.int64)
+    positive = num > 0.0
+    length[positive] = (smoothing*num[positive]).astype(np.int64)
+    return length
+
+def _curves(following1: np.ndarray, length: int) -> tuple:
+    """Fade and `(boundaries, length)` array of lines that go from 0 to `following1`. 
+    Same as evaluating a clamped `scipy.interpolate.CubicSpline([0, length+1], [0, following1])` on `range(length)`, without building it"""
+    fade, x2, x3 = _fade(length)
+    following1 = np.asarray(following1, dtype = np.float64)[:, None]
+    dx = length + 1.0
+    slope = following1 / dx
+    t = (0.0 - 2 * slope) / dx
+    return fade, ((slope / dx - t) * x2) + ((t / dx) * x3)
+
+def _apply(channels: list, idx: np.ndarray, fade: np.ndarray, line: np.ndarray):
+    """Fades out `idx` positions of first two channels in place and adds the lines"""
+    for channel in channels[:2]: channel[idx] *= fade
+    # mono only got faded
+    if len(channels) > 1:
+        for channel in channels[:2]: channel[idx] += line
+
+def smooth(previous: np.ndarray, following: np.ndarray, smoothing: int = 100):
+    """Smooths the click between two consecutive beats by fading out end of `previous` in place"""
+    if len(previous[0]) < 2 or len(following[0]) < 2: return
+    length = int(_scores(previous[0][-2:-1], previous[0][-1:], following[0][:1], following[0][1:2], smoothing)[0])
+    if 3 < length <= len(previous[0]):
+        fade, line = _curves(following[0][:1], length)
+        _apply(previous, np.arange(len(previous[0]) - length, len(previous[0]))[None], fade, line)
+
+def smooth_all(audio: np.ndarray, offsets: np.ndarray, smoothing: int = 100):
+    """Smooths all boundaries of `render` output in place. Clicks at all boundaries are measured at once, 
+    then beats are faded out with cached curves, all boundaries with same fade length at once."""
+    offsets = np.asarray(offsets, dtype = np.int64)
+    if len(offsets) < 3: return
+    boundary = offsets[1:-1]
+    before = boundary - offsets[:-2]
+    # beats shorter than 2 samples can't be measured
+    valid = (before >= 2) & (offsets[2:] - boundary >= 2)
+    boundary, before = boundary[valid], before[valid]
+    channel = audio[0]
+    lengths = _scores(channel[boundary-2], channel[boundary-1], channel[boundary], channel[boundary+1], smoothing)
+    smoothed = (lengths > 3) & (lengths <= before)
+    boundary, lengths = boundary[smoothed], lengths[smoothed]
+    for length in np.unique(lengths):
+        same = lengths == length
+        fade, line = _curves(channel[boundary[same]], int(length))
+        _apply(audio, (boundary[same] - length)[:, None] + np.arange(length), fade, line)
+
+def stream(p: plan, block: int = 65536, smoothing: int = 100, limit_length = None, c_misc7: str = utils.C_MISC[7]):
+    """Renders a plan as a generator of float32 `(channels, block)` arrays, the last one can be shorter. Output is the same as `render` followed by smoothing.
+
+    Besides the sources only the current block, the beat being joined and the beat before it (which waits to be smoothed) are kept in memory."""
+    channels = len(p.sources[0])
+    out = np.empty((channels, block), dtype = np.float32)
+    filled = 0
+    def write(audio):
+        nonlocal out, filled
+        position = 0
+        while position < len(audio[0]):
+            n = min(block - filled, len(audio[0]) - position)
+            out[:, filled:filled + n] = audio[:, position:position + n]
+            filled += n
+            position += n
+            if filled == block:
+                yield out
+                out = np.empty((channels, block), dtype = np.float32)
+                filled = 0
+
+    variables = any(isinstance(v, str) for c in p.chains for e, v in c)
+    metric = None
+    total_length = 0
+    previous = None
+    group = p.sources[0][:, :p.intro].astype(np.float32)
+    size = p.intro
+    batched = [_batched(chain) and _chain_length(chain, 1) is not None for chain in p.chains]
+    last = None
+    for i in range(len(p)):
+        join = p.join[i]
+        chain = p.chains[p.chain[i]]
+        if variables and p.metric[i] != '': metric = _metric(p, i)
+        # beats with a batch effect keep plugin state while the same chain continues, thrown away beats don't touch it
+        if batched[p.chain[i]]:
+            if join == -1: length = _chain_length(chain, int(p.lengths[i]))
+            else:
+                beat = np.clip(_batch([_beat(p, i)], chain, c_misc7, reset = last != p.chain[i], quality = p.quality)[0], -1, 1)
+                length = len(beat[0])
+        else:
+            beat = _process(_beat(p, i), chain, metric, c_misc7, clip = True, quality = p.quality)
+            length = len(beat[0])
+        if join != -1: last = p.chain[i]
+
+        # checks if length limit has been reached
+        if limit_length is not None:
+            total_length += length
+            if total_length >= limit_length: break
+
+        if join == -1: continue
+
+        # Separator is `,` - beat before the previous one is done
+        if join == 0:
+            if previous is not None:
+                smooth(previous, group[:, :size], smoothing)
+                yield from write(previous)
+            previous = group[:, :size]
+            group = beat.astype(np.float32, copy = False)
+            size = len(beat[0])
+        else:
+            if len(beat[0]) > len(group[0]): group = np.concatenate((group[:, :size], np.empty((channels, len(beat[0]) - size), dtype = np.float32)), axis = 1)
+            size = _join(group, size, beat, join)
+
+    if previous is not None:
+        smooth(previous, group[:, :size], smoothing)
+        yield from write(previous)
+    yield from write(group[:, :size])
+    if filled > 0: yield out[:, :filled]
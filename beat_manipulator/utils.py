@@ -7,6 +7,10 @@ C_MISC = "'\"`i@_?%#![]"
 C_MATH = '+-*/.'
 C_MATH_STRICT = '.+-*/'
 
+import os
+BM_SAMPLES = {'cowbell' : os.path.join(os.path.dirname(os.path.abspath(__file__)), 'samples', 'cowbell.flac'),
+              }
+
 def _safer_eval(string:str) -> float:
     if isinstance(string, str): 
         try:
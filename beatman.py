@@ -5,39 +5,59 @@
 # if output not specified, it just goes to output folder
 # if input is not specified it opens a file selector
 # just "py -m beatman" will bring up a file selector and ask for pattern
+# py -m beatman -b "path/to/folder" -lib "madmom.BeatDetectionProcessor" -w 4
+# generates and caches beatmaps of all audio files in a folder (or of one file) using 4 processes
 import beat_manipulator as bm, sys
-args = sys.argv
-#args=['whatevr', '-i', r'"F:\Stuff\Music\Tracks\e-veryday - e-verynight.mp3"', '--pattern', '1,3,2,4']
-args=[i.replace('--', '-') if i.startswith('-') else i for i in args]
-args=[i[1:-1] if (i.startswith('"') and i.endswith('"')) else i for i in args]
-def arg(a, args:list=args):
-    if a in args and len(args)>args.index(a):return args[args.index(a)+1]
+# guarded, because worker processes of the pool import this file again
+if __name__ == '__main__':
+    args = sys.argv
+    #args=['whatevr', '-i', r'"F:\Stuff\Music\Tracks\e-veryday - e-verynight.mp3"', '--pattern', '1,3,2,4']
+    args=[i.replace('--', '-') if i.startswith('-') else i for i in args]
+    args=[i[1:-1] if (i.startswith('"') and i.endswith('"')) else i for i in args]
+    def arg(a, args:list=args):
+        if a in args and len(args)>args.index(a):return args[args.index(a)+1]
 
-#input
-inp = arg('-i')
-if inp is None: inp = arg('-in')
-if inp is None: inp = arg('-input')
-if inp is None:
-    from tkinter import filedialog
-    inp=filedialog.askopenfilename(title='Open a song for beatswapping')
+    #beatmaps of many files
+    beatmaps = arg('-b')
+    if beatmaps is None: beatmaps = arg('-beatmaps')
+    if beatmaps is not None:
+        import os
+        if os.path.isdir(beatmaps): paths = sorted(os.path.join(root, f) for root, _, files in os.walk(beatmaps) for f in files if f.split('.')[-1].lower() in ('mp3', 'wav', 'flac', 'ogg', 'wma', 'aac', 'm4a', 'aiff', 'opus'))
+        else: paths = [beatmaps]
+        lib = arg('-lib')
+        if lib is None: lib = 'madmom.BeatDetectionProcessor'
+        workers = arg('-w')
+        if workers is None: workers = arg('-workers')
+        if workers is not None: workers = int(workers)
+        results = bm.beatmap.generate_many(paths, lib = lib, workers = workers)
+        print(f'{sum(1 for i in results if isinstance(i, Exception))} of {len(paths)} files failed')
+        sys.exit()
 
-#output
-output= arg('-o')
-if output is None: output = arg('-out')
-if output is None: output = arg('-output')
-if output is None: output = 'output'
-#pattern
-pattern= arg('-p')
-if pattern is None: pattern = arg('-pat')
-if pattern is None: pattern = arg('-pattern')
-if pattern is None: pattern = input('Write the beatswapping pattern: ')
+    #input
+    inp = arg('-i')
+    if inp is None: inp = arg('-in')
+    if inp is None: inp = arg('-input')
+    if inp is None:
+        from tkinter import filedialog
+        inp=filedialog.askopenfilename(title='Open a song for beatswapping')
 
-scale= arg('-s')
-if scale is None: scale = arg('-sc')
-if scale is None: scale = arg('-scale')
-if scale is None: scale = 1
-shift= arg('-h')
-if shift is None: shift = arg('-shift')
-if shift is None: shift = 0
+    #output
+    output= arg('-o')
+    if output is None: output = arg('-out')
+    if output is None: output = arg('-output')
+    if output is None: output = 'output'
+    #pattern
+    pattern= arg('-p')
+    if pattern is None: pattern = arg('-pat')
+    if pattern is None: pattern = arg('-pattern')
+    if pattern is None: pattern = input('Write the beatswapping pattern: ')
 
-bm.beatswap(audio=inp, output=output, pattern=pattern, scale = scale, shift = shift)
+    scale= arg('-s')
+    if scale is None: scale = arg('-sc')
+    if scale is None: scale = arg('-scale')
+    if scale is None: scale = 1
+    shift= arg('-h')
+    if shift is None: shift = arg('-shift')
+    if shift is None: shift = 0
+
+    bm.beatswap(audio=inp, output=output, pattern=pattern, scale = scale, shift = shift)
@@ -0,0 +1,30 @@
+import os, sys, numpy as np, pytest
+# tests import the package from the repo, not from site-packages
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    """Caches in a temporary directory"""
+    from beat_manipulator import cache
+    old = cache.DIR
+    cache.directory(str(tmp_path / 'cache'))
+    yield tmp_path / 'cache'
+    cache.directory(old)
+
+@pytest.fixture
+def noise():
+    """Makes `(channels, sr * seconds)` uniform noise, the same for the same `seed`"""
+    def noise(seconds = 1, channels = 2, sr = 44100, seed = 0, dtype = np.float32):
+        return np.random.default_rng(seed).uniform(-0.5, 0.5, (channels, sr * seconds)).astype(dtype)
+    return noise
+
+@pytest.fixture
+def noise_song(noise):
+    """Makes a song of `noise`, with a beat every `beat` samples, or without a beatmap if `beat` is None"""
+    def noise_song(seconds = 5, beat = 20000):
+        import beat_manipulator as bm
+        audio = noise(seconds)
+        song = bm.song(audio, sr = 44100, log = False)
+        if beat is not None: song.beatmap = np.arange(0, audio.shape[1] - 100, beat)
+        return song
+    return noise_song
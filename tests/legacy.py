@@ -0,0 +1,124 @@
+"""Inputs and patterns that render and parser output is compared on, and a script that records what the old beatswap loop and parser returned for them.
+
+Recorded data is in `tests/data`. To record it again, run this file with the directory that has the old `beat_manipulator` package in it:
+
+    git archive 491eb9b beat_manipulator | tar -x -C /tmp/legacy
+    python tests/legacy.py /tmp/legacy
+"""
+import os, numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA = os.path.join(ROOT, 'tests', 'data')
+SR = 44100
+# stats of output are sums over blocks of this many samples
+BLOCK = 16384
+
+PATTERNS = ['1,3,2,4', '1>0.5', '1>1/3', '1, 2>0.5, 3, 4>0.5, 5, 6>0.5, 3, 4>0.5, 7, 8', '1, 2r, 3, 4rr', '4:1, 2', '1:2.5, 3.5<1, 2', '1.5, 2.25, 0, 1',
+    '1, 2; 3, 4', '1; 2~3, 4&5', '1^2, 3$4, 5}6', '1v0.5, 2s2, 3s0.5, 4d8, 5g, 6b3, 8c0, 9c1', '1r v2, 2 s0.4', '1%v, 2v%, 3%g, 4s%*8+1',
+    '1, 2!, 3, 4', '1, 2?, 3, 4, 5?', '1#1, 2#1, 3#1, 4#1', '1#1, 2#2, 3#1, 4#2, 5', '@1_4_1, 2, @1_8_2>0.5, 4', 'i, i, i r',
+    '1;"cowbell"s3v2, 2;"cowbell"s2, 3;"cowbell", 4;"cowbell"s0.5, 5;"cowbell"s0.25, 6;"cowbell"s0.4, 7;"cowbell"s0.8, 8;"cowbell"s1.6',
+    '1, "cowbell"0:0.5, 2, "cowbell"0.5:0.2', '1, [o], 2, [o]2, 3, [o]1:3, [o]2>0.5, [o]@1_5_1', '1, 2, 3, 4, 5, 6, 7, 8, 100', '-1, 2, -3:-1',
+    'reverse', 'test', '1, 2r, 3>0.5r', '1 ~ 2r ~ 3', '1s-1, 2s-2, 3s-1.5, 4s-0.4r, 5, 6;"cowbell"s-1']
+
+def presets() -> list:
+    """Patterns of all presets, except ones that are random every time"""
+    import yaml
+    with open(os.path.join(ROOT, 'beat_manipulator', 'presets.yaml'), 'r') as f: loaded = yaml.safe_load(f.read())
+    patterns = []
+    for preset in loaded.values():
+        if 'pattern' in preset:
+            if preset['pattern'] not in ('shuffle', 'random'): patterns.append(preset['pattern'])
+        else: patterns.extend(i['pattern'] for i in preset.values() if isinstance(i, dict) and 'pattern' in i)
+    return list(dict.fromkeys(patterns))
+
+def cases() -> list:
+    """(pattern, scale, limit_beats, limit_length). Every pattern at scale 1, patterns above also at other scales and with limits"""
+    result = [(pattern, 1, 10000, 52920000) for pattern in list(dict.fromkeys(PATTERNS + presets()))]
+    for pattern in PATTERNS:
+        result += [(pattern, scale, 10000, 52920000) for scale in (0.5, 2, 1/3)]
+        result += [(pattern, 1, 7, None), (pattern, 1, None, 300000)]
+    return result
+
+def audio(seconds = 10, channels = 2) -> np.ndarray:
+    """Sines that change volume, different in every channel"""
+    t = np.arange(SR * seconds, dtype = np.float64)
+    return np.stack([(0.45 * np.sin(t * (0.01 + 0.003*c)) * (0.6 + 0.4 * np.sin(t * 0.00007 * (c+1)))) for c in range(channels)]).astype(np.float32)
+
+def beatmap(length: int) -> np.ndarray:
+    """Uneven beats, 18000 to 26000 samples long"""
+    steps = 18000 + (np.arange(1, 200, dtype = np.int64) * 7919) % 8000
+    beatmap = np.cumsum(steps)
+    return beatmap[beatmap < length - 1000]
+
+def sample_song(bm):
+    other = bm.song((0.3 * np.cos(np.arange(SR * 4) * 0.003) * np.ones((2, 1))).astype(np.float32), sr = SR, log = False)
+    other.beatmap = np.cumsum(np.full(7, 22050))[:-1]
+    return other
+
+def beatswap(bm, pattern: str, scale = 1, limit_beats = 10000, limit_length = 52920000) -> np.ndarray:
+    """Output of `song.beatswap` of `bm` package"""
+    import random
+    random.seed(42)
+    song = bm.song(audio(), sr = SR, log = False)
+    song.beatmap = beatmap(len(song.audio[0]))
+    samples = {'cowbell': os.path.join(ROOT, 'beat_manipulator', 'samples', 'cowbell.flac'), 'o': sample_song(bm)}
+    return np.asarray(song.beatswap(pattern, scale = scale, samples = samples, return_audio = True, limit_beats = limit_beats, limit_length = limit_length))
+
+def stats(audio: np.ndarray) -> np.ndarray:
+    """(3, channels, blocks) sums of samples, squares and samples weighted by position in block, which notices moved or reversed audio"""
+    blocks = -(-len(audio[0]) // BLOCK)
+    padded = np.zeros((len(audio), blocks * BLOCK), dtype = np.float64)
+    padded[:, :len(audio[0])] = audio
+    padded = padded.reshape(len(audio), blocks, BLOCK)
+    ramp = np.linspace(0, 1, BLOCK)
+    return np.stack((padded.sum(axis = 2), (padded**2).sum(axis = 2), (padded * ramp).sum(axis = 2)))
+
+def plain(value):
+    """Parse output with sample arrays replaced by their shape and sum, so that it can be compared with == and stored as json"""
+    if isinstance(value, np.ndarray): return ['array', list(value.shape), round(float(np.sum(value, dtype = np.float64)), 3)]
+    if isinstance(value, (list, tuple)): return [plain(i) for i in value]
+    if hasattr(value, 'audio'): return ['song', plain(value.audio)]
+    return value
+
+def parse_cases() -> list:
+    """(pattern, pattern_length)"""
+    patterns = list(dict.fromkeys(PATTERNS + presets()))
+    return [(pattern, None) for pattern in patterns] + [(pattern, 4) for pattern in PATTERNS]
+
+def parsed(bm, pattern: str, pattern_length = None):
+    """`plain` output of `parse.parse` of `bm` package"""
+    samples = {'cowbell': os.path.join(ROOT, 'beat_manipulator', 'samples', 'cowbell.flac'), 'o': sample_song(bm)}
+    return plain(bm.parse.parse(pattern, samples, pattern_length = pattern_length, log = False))
+
+def record_parse(bm):
+    import contextlib, io, json
+    data = []
+    for case in parse_cases():
+        try:
+            with contextlib.redirect_stdout(io.StringIO()): data.append([list(case), parsed(bm, *case)])
+        except Exception as e: data.append([list(case), {'error': type(e).__name__}])
+    with open(os.path.join(DATA, 'legacy_parse.json'), 'w') as f: json.dump(data, f, indent = 0)
+
+def record_render(bm):
+    import contextlib, io
+    data = {'cases': np.array([repr(i) for i in cases()])}
+    for n, case in enumerate(cases()):
+        try:
+            with contextlib.redirect_stdout(io.StringIO()): result = beatswap(bm, *case)
+        except Exception as e:
+            data[f'{n}_error'] = np.array(type(e).__name__)
+            continue
+        data[f'{n}_shape'] = np.array(result.shape)
+        data[f'{n}'] = stats(result).astype(np.float32)
+    np.savez_compressed(os.path.join(DATA, 'legacy_render.npz'), **data)
+
+if __name__ == '__main__':
+    import sys
+    # old package loads presets and samples relative to the working directory
+    sys.path.insert(0, sys.argv[1])
+    os.chdir(sys.argv[1])
+    import beat_manipulator
+    assert os.path.abspath(beat_manipulator.__file__).startswith(os.path.abspath(sys.argv[1])), 'old package should be imported'
+    os.makedirs(DATA, exist_ok = True)
+    record_render(beat_manipulator)
+    record_parse(beat_manipulator)
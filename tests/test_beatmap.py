@@ -0,0 +1,170 @@
+import math, numpy as np, pytest
+import beat_manipulator as bm
+from beat_manipulator import beatmap
+
+def _scale_old(beatmap, scale, integer = True):
+    """Old `beatmap.scale`, appends one beat at a time"""
+    if scale == 1: return beatmap
+    a = 0
+    b = np.array([], dtype=int)
+    if scale%1==0:
+        while a < len(beatmap):
+            b = np.append(b, beatmap[int(a)])
+            a += scale
+    else:
+        if integer is True:
+            while a + 1 < len(beatmap):
+                b = np.append(b, int((1 - (a % 1)) * beatmap[math.floor(a)] + (a % 1) * beatmap[math.ceil(a)]))
+                a += scale
+        else:
+            while a + 1 < len(beatmap):
+                b = np.append(b, (1 - (a % 1)) * beatmap[math.floor(a)] + (a % 1) * beatmap[math.ceil(a)])
+                a += scale
+    return b
+
+def _beatmaps():
+    uneven = np.cumsum(18000 + (np.arange(1, 60, dtype = np.int64) * 7919) % 8000)
+    # long enough for rounding of summed positions to add up
+    long = np.cumsum(18000 + (np.arange(1, 1000, dtype = np.int64) * 7919) % 8000)
+    return {'uneven': uneven, 'long': long, 'float': uneven.astype(np.float64) + 0.25, 'empty': np.array([], dtype = np.int64),
+        'one': uneven[:1], 'two': uneven[:2], 'three': uneven[:3]}
+BEATMAPS = _beatmaps()
+
+@pytest.mark.parametrize('name', BEATMAPS)
+@pytest.mark.parametrize('scale', (1, 2, 3, 7, 100, 0.5, 0.25, 1/3, 2/3, 0.1, 1.5, 2.5, 0.7, 3.3))
+@pytest.mark.parametrize('integer', (True, False))
+def test_scale_matches_old_loop(name, scale, integer):
+    """Interpolated `beatmap.scale` gives the same beats and dtype as the old while loop, fractional positions summed the same way included"""
+    old = _scale_old(BEATMAPS[name].copy(), scale, integer)
+    new = beatmap.scale(BEATMAPS[name].copy(), scale, log = False, integer = integer)
+    assert new.dtype == old.dtype
+    assert np.array_equal(new, old)
+
+def test_scale_from_string():
+    assert np.array_equal(beatmap.scale(BEATMAPS['uneven'], '1/3', log = False), _scale_old(BEATMAPS['uneven'], 1/3))
+
+def _shift_old(beatmap, shift, mode = 1):
+    """Old `beatmap.shift`, moves one beat at a time"""
+    if shift == 0: return beatmap
+    elif shift > 0:
+        if shift >= 1: beatmap = beatmap[int(shift//1):]
+        if shift%1 != 0:
+            shift = shift%1
+            for i in range(len(beatmap) - int(shift) - 1):
+                beatmap[i] = int(beatmap[i] + shift * (beatmap[i + 1] - beatmap[i]))
+    else:
+        shift = -shift
+        if shift >= 1:
+            if mode == 1:
+                    step = int((beatmap[1] - beatmap[0]) / (int(shift//1) + 1))
+                    beatmap = np.insert(arr = beatmap, obj = 1, values = np.linspace(start = beatmap[0] + step - 1, stop = 1 + beatmap[1] - step, num = int(shift//1)))
+            elif mode == 2:
+                for i in range(int(shift//1)):
+                    beatmap = np.insert(arr = beatmap, obj = (i*2)+1, values = int((beatmap[i*2] + beatmap[(i*2)+1])/2))
+        if shift%1 != 0:
+            shift = shift%1
+            for i in reversed(range(len(beatmap))):
+                if i==0: continue
+                beatmap[i] = int(beatmap[i] - shift * (beatmap[i] - beatmap[i-1]))
+    return beatmap
+
+@pytest.mark.parametrize('name', BEATMAPS)
+@pytest.mark.parametrize('shift', (0, 0.5, 0.25, 1/3, 0.9, 1, 2, 1.5, 3.75, 100, -0.5, -0.25, -1/3, -1, -2, -3, -1.5, -2.25, -5.8))
+@pytest.mark.parametrize('mode', (1, 2))
+def test_shift_matches_old_loop(name, shift, mode):
+    """Vectorized `beatmap.shift` gives the same beats and dtype as the old loops, and raises where they did"""
+    try: old = _shift_old(BEATMAPS[name].copy(), shift, mode)
+    except IndexError:
+        with pytest.raises(IndexError): beatmap.shift(BEATMAPS[name].copy(), shift, log = False, mode = mode)
+        return
+    new = beatmap.shift(BEATMAPS[name].copy(), shift, log = False, mode = mode)
+    assert new.dtype == old.dtype
+    assert np.array_equal(new, old)
+
+def test_shift_from_string():
+    assert np.array_equal(beatmap.shift(BEATMAPS['uneven'].copy(), '-3/2', log = False), _shift_old(BEATMAPS['uneven'].copy(), -1.5))
+
+SR = 1000
+
+def _rnn(audio, sr, kind = 'beats'):
+    """Stands in for madmom RNN processors: one frame per 10 ms, every frame only depends on its own audio"""
+    hop = sr // 100
+    frames = int(np.ceil(len(audio[0]) / hop))
+    padded = np.zeros((len(audio), frames * hop), dtype = np.float32)
+    padded[:, :len(audio[0])] = audio
+    act = np.abs(padded).reshape(len(audio), frames, hop).mean(axis = (0, 2)).astype(np.float32)
+    return np.stack((act, act * 0.5), axis = 1) if kind == 'downbeats' else act
+
+def _stub(monkeypatch) -> list:
+    """Replaces RNN processors with `_rnn`, returns a list of kinds it was called with"""
+    calls = []
+    monkeypatch.setattr(beatmap, '_window_activations', lambda audio, sr, kind = 'beats': calls.append(kind) or _rnn(audio, sr, kind))
+    return calls
+
+def test_activations_are_cached(cache_dir, monkeypatch, noise):
+    calls = _stub(monkeypatch)
+    audio = noise(5, sr = SR)
+    first = beatmap._activations(audio, SR, 'beats', fingerprint = 'a')
+    # audio isn't needed when activations are cached
+    second = beatmap._activations(lambda: 1/0, SR, 'beats', fingerprint = 'a')
+    assert calls == ['beats'] and np.array_equal(first, second)
+    # other audio, and trackers that use downbeat activations, are misses
+    beatmap._activations(noise(5, sr = SR, seed = 1), SR, 'beats', fingerprint = 'b')
+    downbeats = beatmap._activations(audio, SR, 'downbeats', fingerprint = 'a')
+    assert calls == ['beats', 'beats', 'downbeats'] and downbeats.shape == (len(first), 2)
+    beatmap._activations(audio, SR, 'downbeats', fingerprint = 'a')
+    beatmap._activations(audio, SR, 'beats', fingerprint = 'a', caching = False)
+    assert calls == ['beats', 'beats', 'downbeats', 'beats']
+
+@pytest.mark.parametrize('kind', ('beats', 'downbeats'))
+@pytest.mark.parametrize('seconds, window, overlap', ((23, 5, 2), (20, 5, 2), (31, 7, 3), (9, 8, 2), (5, 5, 2)))
+@pytest.mark.parametrize('workers', (1, 2))
+def test_windowed_matches_full(monkeypatch, kind, seconds, window, overlap, workers, noise):
+    """Crossfaded windows give the same activations as the whole audio, at every seam, when frames only depend on their own audio"""
+    # pool processes are forked, so they get the stub too
+    monkeypatch.setattr(beatmap, '_window_activations', _rnn)
+    audio = noise(seconds, sr = SR) * np.linspace(0.2, 1, SR * seconds, dtype = np.float32)
+    full = _rnn(audio, SR, kind)
+    windowed = beatmap._windowed(audio, SR, kind, window = window, overlap = overlap, workers = workers)
+    assert windowed.shape == full.shape
+    assert np.allclose(windowed, full, rtol = 1e-5, atol = 1e-7)
+
+def test_windowed_activations_are_cached_like_full(cache_dir, monkeypatch, noise):
+    calls = _stub(monkeypatch)
+    audio = noise(23, sr = SR)
+    windowed = beatmap._activations(audio, SR, 'beats', fingerprint = 'a', window = 5, overlap = 2)
+    # windows start every 3 seconds, the last one ends at the end of audio
+    assert len(calls) == 7
+    assert np.array_equal(beatmap._activations(audio, SR, 'beats', fingerprint = 'a'), windowed) and len(calls) == 7
+
+def _files(tmp_path, n = 2):
+    import soundfile
+    paths = []
+    for i in range(n):
+        paths.append(str(tmp_path / f'{i}.wav'))
+        soundfile.write(paths[-1], np.random.default_rng(i).uniform(-0.5, 0.5, (44100 * 3, 2)), 44100)
+    return paths
+
+def test_generate_many_pool_matches_generate(tmp_path, cache_dir):
+    """Pool workers find beatmaps the same way `generate` does, a file that fails doesn't affect the others"""
+    from beat_manipulator import cache, io
+    lib = 'madmom.BeatDetectionProcessor'
+    paths = _files(tmp_path)
+    # madmom isn't needed for beatmaps that are cached
+    for n, path in enumerate(paths):
+        audio, sr = io._load(path)
+        cache.beatmaps.put(beatmap._key(bm.fingerprint.full(audio, sr), lib), {'beatmap': np.arange(1000, 130000, 20000 + 1000 * n)}, {'settings': None})
+    cache.beatmaps.flush()
+    results = beatmap.generate_many(paths + [str(tmp_path / 'missing.wav')], lib = lib, workers = 2, log = False)
+    assert isinstance(results[2], Exception)
+    for path, result in zip(paths, results):
+        assert np.array_equal(result, beatmap.generate(*bm.io._load(path), lib = lib, log = False))
+    assert not np.array_equal(results[0], results[1])
+
+def test_generate_many_detects_like_generate(tmp_path, cache_dir):
+    pytest.importorskip('madmom')
+    lib = 'madmom.BeatDetectionProcessor'
+    paths = _files(tmp_path)
+    results = beatmap.generate_many(paths, lib = lib, workers = 2, caching = False, log = False)
+    for path, result in zip(paths, results):
+        assert np.array_equal(result, beatmap.generate(*bm.io._load(path), lib = lib, caching = False, load_settings = False, log = False))
@@ -0,0 +1,68 @@
+import json, os, sys, numpy as np
+from beat_manipulator import beatmap, cache
+
+def test_stores_are_in_user_cache_dir(monkeypatch):
+    if 'BM_CACHE' not in os.environ: assert os.path.dirname(cache.beatmaps.path) == cache._user_dir()
+    if os.name == 'posix' and sys.platform != 'darwin':
+        monkeypatch.setenv('XDG_CACHE_HOME', '/tmp/xdg')
+        assert cache._user_dir() == os.path.join('/tmp/xdg', 'beat_manipulator')
+
+def test_directory(cache_dir):
+    for s in (cache.beatmaps, cache.activations, cache.features, cache.fingerprints): assert os.path.dirname(s.path) == str(cache_dir)
+    cache.beatmaps.put('key', {'a': np.arange(3)})
+    assert os.path.isdir(cache_dir / 'beatmaps')
+
+def test_generate_reads_record_once(cache_dir, monkeypatch, noise_song):
+    song = noise_song(3, beat = None)
+    key = beatmap._key(song.fingerprint, 'madmom.BeatDetectionProcessor')
+    saved = {'scale': 2, 'shift': None, 'adjust': None, 'normalized': 'test'}
+    cache.beatmaps.put(key, {'beatmap': np.arange(0, 132300, 22050)}, {'settings': saved})
+    reads = []
+    get = cache.store.get
+    monkeypatch.setattr(cache.store, 'get', lambda self, key: reads.append(key) or get(self, key))
+    song.beatmap_generate()
+    assert reads == [key]
+    assert song.normalized == 'test'
+    assert np.array_equal(song.beatmap, beatmap.scale(np.arange(0, 132300, 22050), 2, log = False))
+
+def test_generate_return_settings(cache_dir, noise_song):
+    song = noise_song(3, beat = None)
+    key = beatmap._key(song.fingerprint, 'x')
+    cache.beatmaps.put(key, {'beatmap': np.arange(0, 132300, 22050)}, {'settings': None})
+    beats, settings = beatmap.generate(song.audio, song.sr, lib = 'x', key = key, log = False, return_settings = True)
+    assert settings is None and np.array_equal(beats, np.arange(0, 132300, 22050))
+
+def _index(path):
+    with open(os.path.join(path, 'index.json')) as f: return json.load(f)
+
+def test_index_is_saved_in_batches(tmp_path):
+    s = cache.store(str(tmp_path), save_every = 3)
+    s.put('a', {'a': np.arange(3)})
+    s.put('b', {'a': np.arange(3)})
+    assert not os.path.exists(tmp_path / 'index.json')
+    s.put('c', {'a': np.arange(3)})
+    assert len(_index(tmp_path)) == 3
+    s.put('d', {'a': np.arange(3)})
+    s.flush()
+    assert len(_index(tmp_path)) == 4
+
+def test_stores_in_one_directory_keep_each_others_records(tmp_path):
+    """Processes merge the index on disk, so records of the other one are not lost"""
+    a, b = cache.store(str(tmp_path)), cache.store(str(tmp_path))
+    a.put('a', {'a': np.arange(3)})
+    b.put('b', {'a': np.arange(3)})
+    b.flush()
+    a.flush()
+    assert set(_index(tmp_path)) == {a._name('a'), a._name('b')}
+
+def test_records_missing_from_index_are_evicted(tmp_path):
+    """Record whose index entry was never saved is found when the index is loaded, and evicted like the others"""
+    s = cache.store(str(tmp_path))
+    s.put('orphan', {'a': np.zeros(1000)})
+    assert not os.path.exists(tmp_path / 'index.json')
+    s = cache.store(str(tmp_path), max_size = 10000)
+    assert s._name('orphan') in s.index
+    s.put('new', {'a': np.zeros(1000)})
+    assert s.get('orphan') is None and s.get('new') is not None
+    s.flush()
+    assert list(_index(tmp_path)) == [s._name('new')]
@@ -0,0 +1,64 @@
+import numpy as np, pytest
+from beat_manipulator import effects
+
+@pytest.mark.parametrize('quality', ('nearest', 'linear', 'sinc'))
+@pytest.mark.parametrize('s', (2, 0.5, 0.4, 1.6, 3, 1/3))
+def test_speed_length(quality, s, noise):
+    audio = noise()
+    num, den = effects._ratio(s)
+    assert effects.speed(audio, s, quality = quality).shape == (2, -(-audio.shape[1] * den // num))
+
+@pytest.mark.parametrize('quality', ('nearest', 'linear', 'sinc'))
+@pytest.mark.parametrize('s', (-1, -2, -0.5, -1.5, -1/3))
+def test_negative_speed_reverses(quality, s, noise):
+    audio = noise()
+    assert np.array_equal(effects.speed(audio, s, quality = quality), effects.speed(audio[:, ::-1], -s, quality = quality))
+    num, den = effects._ratio(-s)
+    assert effects.speed(audio, s, quality = quality).shape == (2, -(-audio.shape[1] * den // num))
+
+def test_speed_quality_argument_overrides_global(monkeypatch, noise):
+    audio = noise()
+    nearest = effects.speed(audio, 0.4)
+    monkeypatch.setattr(effects, 'SPEED_QUALITY', 'sinc')
+    assert np.array_equal(effects.speed(audio, 0.4, quality = 'nearest'), nearest)
+    assert not np.array_equal(effects.speed(audio, 0.4), nearest)
+
+def test_beatswap_quality(noise_song):
+    pattern = '1s0.4, 2s1.6, 3;"cowbell"s0.4'
+    nearest = noise_song().beatswap(pattern, return_audio = True)
+    sinc = noise_song().beatswap(pattern, return_audio = True, quality = 'sinc')
+    assert nearest.shape == sinc.shape and not np.array_equal(nearest, sinc)
+    # beatswap_many and streaming use the same quality, from any number of threads
+    many = noise_song().beatswap_many([pattern] * 4, quality = 'sinc', workers = 4)
+    for i in many: assert np.array_equal(i[0], sinc)
+    streamed = np.concatenate(list(noise_song().beatswap_stream(pattern, quality = 'sinc')), axis = 1)
+    assert np.array_equal(streamed, sinc)
+    assert effects.SPEED_QUALITY == 'nearest'
+
+def _sidechain_old(audio):
+    """Old `effects.to_sidechain`, 1000 tap box filter"""
+    audio = np.clip(np.abs(audio), -1, 1)
+    for channel in range(len(audio)):
+        audio[channel] = np.abs(1 - np.convolve(audio[channel], np.ones(shape=(1000)), mode = 'same'))
+    return audio
+
+def _sidechain_box(audio, attack, release):
+    """Reference envelope with a box filter of `attack + release` taps over `[i - release, i + attack)`"""
+    audio = np.clip(np.abs(audio), -1, 1).astype(np.float64)
+    padded = np.pad(audio, ((0, 0), (release, attack)))
+    return np.abs(1 - np.stack([np.convolve(c, np.ones(attack + release), mode = 'valid')[:audio.shape[1]] for c in padded]))
+
+@pytest.mark.parametrize('length', (1001, 4410, 44100))
+@pytest.mark.parametrize('dtype', (np.float32, np.float64))
+def test_sidechain_matches_old_convolution(length, dtype, noise):
+    audio = (noise()[:, :length] * 3).astype(dtype)
+    old = _sidechain_old(audio.copy())
+    new = effects.to_sidechain(audio.copy())
+    assert new.dtype == old.dtype and new.shape == old.shape
+    assert np.allclose(new, old, rtol = 1e-5, atol = 1e-6)
+
+@pytest.mark.parametrize('attack, release', ((0, 1), (1, 0), (1, 1), (10, 300), (300, 10), (2000, 5), (5000, 5000)))
+@pytest.mark.parametrize('length', (1, 7, 999, 4410))
+def test_sidechain_matches_box_filter(attack, release, length, noise):
+    audio = noise()[:, :length].astype(np.float64) * 3
+    assert np.allclose(effects.to_sidechain(audio, attack = attack, release = release), _sidechain_box(audio, attack, release))
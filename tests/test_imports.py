@@ -0,0 +1,43 @@
+import os, subprocess, sys, pytest
+import beat_manipulator
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _run(code: str, cwd: str):
+    env = dict(os.environ, PYTHONPATH = ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    return subprocess.run([sys.executable, '-c', code], cwd = cwd, env = env, capture_output = True, text = True)
+
+@pytest.mark.parametrize('name', beat_manipulator._submodules)
+def test_submodule_imported_first(name, tmp_path):
+    """Every submodule can be the first one imported, in a fresh interpreter, from any working directory"""
+    result = _run(f'import beat_manipulator.{name}', cwd = tmp_path)
+    assert result.returncode == 0, result.stderr
+
+@pytest.mark.parametrize('name', beat_manipulator._submodules)
+def test_submodule_attribute_first(name, tmp_path):
+    result = _run(f'import beat_manipulator as bm; bm.{name}', cwd = tmp_path)
+    assert result.returncode == 0, result.stderr
+
+def test_presets_first(tmp_path):
+    result = _run('import beat_manipulator as bm; assert "cowbell" in bm.presets.BM_SAMPLES; assert len(bm.presets.presets) > 0', cwd = tmp_path)
+    assert result.returncode == 0, result.stderr
+
+def test_import_touches_nothing(tmp_path):
+    result = _run('import beat_manipulator as bm; bm.song', cwd = tmp_path)
+    assert result.returncode == 0, result.stderr
+    assert os.listdir(tmp_path) == []
+
+def test_star_import(tmp_path):
+    result = _run('from beat_manipulator import *; song, beatswap, BM_EFFECTS, BM_SAMPLES, presets.presets, io.write_audio, osu, image', cwd = tmp_path)
+    assert result.returncode == 0, result.stderr
+
+# seconds that `import beat_manipulator` can take in a fresh interpreter
+IMPORT_BUDGET = 0.05
+
+def test_import_time(tmp_path):
+    """Fastest of a few fresh imports is within the budget, and nothing but the package itself is imported"""
+    code = 'import sys, time; before = set(sys.modules); t = time.perf_counter(); import beat_manipulator; print(time.perf_counter() - t); print(sorted(set(sys.modules) - before))'
+    results = [_run(code, cwd = tmp_path) for _ in range(3)]
+    assert all(r.returncode == 0 for r in results), results[0].stderr
+    assert min(float(r.stdout.splitlines()[0]) for r in results) < IMPORT_BUDGET
+    assert results[0].stdout.splitlines()[1] == "['beat_manipulator']"
@@ -0,0 +1,86 @@
+import numpy as np, pytest
+from beat_manipulator import io
+
+def test_native_formats_go_to_soundfile(monkeypatch):
+    import importlib.util
+    # as if every decoder was installed
+    monkeypatch.setattr(importlib.util, 'find_spec', lambda name: True)
+    monkeypatch.setattr(io, '_remembered', {fmt: 'librosa' for fmt in io._native + ('mp3',)})
+    for fmt in io._native: assert io._decoders_for(fmt) == list(io._order[fmt])
+    assert io._decoders_for('mp3') == ['librosa', 'pedalboard.io', 'soundfile', 'madmom']
+
+def test_native_format_isnt_remembered(tmp_path, monkeypatch):
+    import soundfile
+    monkeypatch.setattr(io, '_remembered', {})
+    path = str(tmp_path / 'a.wav')
+    soundfile.write(path, np.random.default_rng(0).uniform(-0.5, 0.5, (44100 * 3, 2)), 44100)
+    audio, sr = io._load(path)
+    assert sr == 44100 and audio.shape == (2, 44100 * 3)
+    assert 'wav' not in io._remembered
+
+def test_format_from_magic_bytes(tmp_path):
+    import soundfile
+    path = str(tmp_path / 'a.mp3')
+    soundfile.write(path, np.zeros((1000, 2)), 44100, format = 'WAV')
+    assert io._format(path) == 'wav'
+
+def _counted(monkeypatch):
+    """Decoders that were called, in order"""
+    calls = []
+    decode = io._decode
+    monkeypatch.setattr(io, '_decode', lambda path, lib: calls.append(lib) or decode(path, lib))
+    return calls
+
+def _wav(path, seconds = 2, seed = 0):
+    import soundfile
+    soundfile.write(path, np.random.default_rng(seed).uniform(-0.5, 0.5, (44100 * seconds, 2)), 44100)
+    return path
+
+def test_decode_cache_hit(tmp_path, monkeypatch):
+    import os
+    calls = _counted(monkeypatch)
+    path = _wav(str(tmp_path / 'a.wav'))
+    audio, sr = io.open_audio(path, cache = str(tmp_path / 'decoded'))
+    cached, cached_sr = io.open_audio(path, cache = str(tmp_path / 'decoded'))
+    assert calls == ['soundfile'] and isinstance(cached, np.memmap)
+    assert np.array_equal(cached, audio) and cached_sr == sr
+    # named after the decoder that was used
+    assert len(os.listdir(tmp_path / 'decoded')) == 1 and os.listdir(tmp_path / 'decoded')[0].endswith('_soundfile_44100.npy')
+    io.open_audio(path, lib = 'soundfile', cache = str(tmp_path / 'decoded'))
+    assert calls == ['soundfile']
+    # copy-on-write, the cache isn't changed
+    cached[:] = 0
+    assert np.array_equal(io.open_audio(path, cache = str(tmp_path / 'decoded'))[0], audio)
+
+def test_decode_cache_is_disabled_by_default(tmp_path, monkeypatch):
+    calls = _counted(monkeypatch)
+    path = _wav(str(tmp_path / 'a.wav'))
+    io.open_audio(path)
+    io.open_audio(path, cache = False)
+    assert calls == ['soundfile', 'soundfile']
+
+def test_decode_cache_other_decoder_is_a_miss(tmp_path, monkeypatch):
+    calls = _counted(monkeypatch)
+    monkeypatch.setitem(io.decoders, 'other', io._soundfile)
+    path = _wav(str(tmp_path / 'a.wav'))
+    io.open_audio(path, cache = str(tmp_path / 'decoded'))
+    io.open_audio(path, lib = 'other', cache = str(tmp_path / 'decoded'))
+    io.open_audio(path, lib = 'other', cache = str(tmp_path / 'decoded'))
+    assert calls == ['soundfile', 'other']
+
+@pytest.mark.parametrize('change', ('size', 'mtime'))
+def test_decode_cache_changed_file_is_a_miss(tmp_path, monkeypatch, change):
+    import os
+    calls = _counted(monkeypatch)
+    path = _wav(str(tmp_path / 'a.wav'))
+    io.open_audio(path, cache = str(tmp_path / 'decoded'))
+    if change == 'size': _wav(path, seconds = 3, seed = 1)
+    else:
+        stat = os.stat(path)
+        os.utime(path, ns = (stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    audio, sr = io.open_audio(path, cache = str(tmp_path / 'decoded'))
+    assert calls == ['soundfile', 'soundfile']
+    assert audio.shape == (2, 44100 * (3 if change == 'size' else 2))
+    # older version is removed
+    assert len(os.listdir(tmp_path / 'decoded')) == 1
+    assert np.array_equal(io.open_audio(path, cache = str(tmp_path / 'decoded'))[0], audio) and len(calls) == 2
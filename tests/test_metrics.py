@@ -0,0 +1,71 @@
+import os, numpy as np, pytest
+import beat_manipulator as bm
+from beat_manipulator import metrics
+
+def _beatmap(length):
+    beatmap = np.cumsum(np.random.default_rng(1).integers(1, 20000, 40))
+    return np.concatenate(([0], beatmap[beatmap < length - 1], [length]))
+
+@pytest.mark.parametrize('dtype', (np.float32, np.float64))
+@pytest.mark.parametrize('channels', (1, 2))
+def test_features_match_metrics(dtype, channels, noise):
+    audio = noise(5, channels, dtype = dtype)
+    table = metrics.features(audio, _beatmap(audio.shape[1]))
+    assert len(table['start']) > 0
+    for k, (start, stop) in enumerate(zip(table['start'], table['stop'])):
+        beat = audio[:, start:stop]
+        for function, read in metrics.BM_FEATURES.items():
+            if function is metrics.hit_in_middle and channels > 1: continue
+            value, expected = read(table, k), function(beat)
+            assert np.asarray(value).dtype == np.asarray(expected).dtype
+            if function in (metrics.volume, metrics.volume_gradient): assert value == pytest.approx(expected, rel = 1e-6)
+            else: assert np.array_equal(value, expected)
+
+def test_first_hit_matches_argmax(noise):
+    """Many beats, gaps between beats, and equal maximums in a beat"""
+    audio = np.round(noise(2) * 8)
+    beatmap = np.unique(np.random.default_rng(2).integers(0, audio.shape[1], 700))
+    table = metrics.features(audio, beatmap)
+    assert len(table['start']) > 500 and np.any(table['start'][1:] != table['stop'][:-1])
+    expected = [np.argmax(bm.effects.gradient(audio[:, s:e]), axis = 1) / (e - s) for s, e in zip(table['start'], table['stop'])]
+    assert np.array_equal(table['first_hit'], expected)
+
+@pytest.mark.parametrize('beatmap', ([], [0], [5, 3], [0, 1], [900, 1200], [0, 1, 2, 3, 500]))
+def test_features_edge_cases(beatmap, noise):
+    audio = noise(5, 1)[:, :1000]
+    table = metrics.features(audio, np.array(beatmap, dtype = np.int64))
+    assert np.all(table['stop'] - table['start'] >= 2)
+    assert np.all(table['stop'] <= 1000) and len(table['first_hit']) == len(table['start'])
+
+def test_percent_metrics_same_with_and_without_table(monkeypatch, noise_song):
+    pattern = '1%v, 2v%, 3%g, 4s%+1, 5r%v, 6v%'
+    expected = np.asarray(noise_song().beatswap(pattern, return_audio = True))
+    monkeypatch.setattr(metrics, 'BM_FEATURES', {})
+    without = np.asarray(noise_song().beatswap(pattern, return_audio = True))
+    assert expected.shape == without.shape
+    assert np.allclose(expected, without, rtol = 0, atol = 1e-6)
+
+def test_render_doesnt_cache_features(cache_dir, noise_song):
+    noise_song().beatswap('1%v, 2v%', return_audio = True)
+    assert not os.path.exists(cache_dir)
+
+def test_features_cached_if_song_caches(cache_dir, noise_song):
+    song = noise_song()
+    song.caching = True
+    song.beatswap('1%v, 2v%', return_audio = True)
+    assert len(os.listdir(cache_dir / 'features')) > 0
+    assert not os.path.exists(cache_dir / 'beatmaps')
+
+def test_features_from_threads(monkeypatch, noise_song):
+    """Renders in `beatswap_many` threads share the song's feature tables"""
+    song = noise_song()
+    calls = []
+    features = metrics.features
+    monkeypatch.setattr(metrics, 'features', lambda *args: calls.append(1) or features(*args))
+    patterns = ['1%v, 2v%', '1%g, 2v%, 3'] * 4
+    threaded = song.beatswap_many(patterns, scales = [[1, 0.5, 2, 0.25, 4]] * len(patterns), workers = 8)
+    # five scales are five beatmaps, more than one table of each would mean a race
+    assert len(calls) == 5
+    single = noise_song().beatswap_many(patterns, scales = [[1, 0.5, 2, 0.25, 4]] * len(patterns), workers = 1)
+    for a, b in zip(threaded, single):
+        for x, y in zip(a, b): assert np.array_equal(x, y)
@@ -0,0 +1,83 @@
+import numpy as np, pytest
+import beat_manipulator as bm
+from beat_manipulator import online
+import legacy
+
+def _feed(r, audio, beats, size):
+    """Feeds audio to a renderer in blocks of `size` samples, with beats that are in each block, and returns all output"""
+    out = []
+    for i in range(0, len(audio[0]), size):
+        out += r.process(audio[:, i:i + size], beats[(beats >= i) & (beats < i + size)])
+    return out + r.flush()
+
+# patterns that are at least as long as the input, so output never runs out
+@pytest.mark.parametrize('pattern', ['1, 3, 2, 4', '2, 1', '1, 2r, 3, 4v0.5', '1, 2s0.5, 3d4, 4', '1; 2, 3, 4r ~ 1, 2', '1:0.5, 1:0.5, 2, 3>0.5, 3'])
+@pytest.mark.parametrize('size', (5000, 4096, 777))
+def test_renderer_matches_beatswap(pattern, size):
+    audio = legacy.audio()
+    beats = legacy.beatmap(len(audio[0]))
+    song = bm.song(audio, sr = legacy.SR, log = False)
+    song.beatmap = beats.copy()
+    offline = song.beatswap(pattern, return_audio = True, adjust = 0)
+    r = online.renderer(pattern, legacy.SR, block = 4096)
+    out = _feed(r, audio, beats, size)
+    assert all(i.shape == (2, 4096) for i in out)
+    out = np.concatenate(out, axis = 1)
+    assert np.array_equal(out[:, :len(offline[0])], offline)
+    assert not np.any(out[:, len(offline[0]):])
+    stats = r.stats()
+    assert stats['underruns'] == 0 and stats['dropped'] == 0 and stats['played'] == len(out[0])
+    assert stats['delay'] == int(8 * (beats[1] - beats[0]))
+    # timing of every block
+    assert stats['blocks'] == -(-len(audio[0]) // size) and stats['last'] > 0 and stats['rtf'] > 0 and stats['worst'] >= stats['last'] / (size / legacy.SR)
+
+def test_renderer_input_is_bounded():
+    sr = 1000
+    r = online.renderer('2, 1', sr, block = 100, latency = 4, wait = 5)
+    noise = np.random.default_rng(0).uniform(-0.5, 0.5, (2, 100)).astype(np.float32)
+    # no beats yet, old input is dropped
+    for _ in range(100): r.process(noise)
+    assert len(r._input[0]) <= 5 * sr and r.stats()['dropped'] == 100 * 100 - 5 * sr
+    r.process(noise, [r.received - 50])
+    r.process(noise, [r.received - 50])
+    # beats stop, input that waited too long is played as it is
+    played = []
+    for _ in range(200): played += r.process(noise)
+    assert len(r._input[0]) <= 5 * sr and len(r._grid) <= 2
+    assert r.stats()['played'] == len(played) * 100 and r.stats()['queued'] <= 2 * r.delay
+
+def _clicks(bpm, sr = 44100, seconds = 20):
+    audio = np.random.default_rng(0).normal(0, 0.01, sr * seconds)
+    clicks = np.arange(1000, len(audio) - 200, sr * 60 / bpm).astype(np.int64)
+    for c in clicks: audio[c:c + 200] += np.hanning(200) * np.sin(np.arange(200) * 0.5)
+    return np.stack((audio, audio)).astype(np.float32), clicks
+
+@pytest.mark.parametrize('bpm', (90, 120, 150))
+def test_tracker_finds_click_track(bpm):
+    sr, size = 44100, 2048
+    audio, clicks = _clicks(bpm, sr)
+    t = online.tracker(sr)
+    beats = []
+    for i in range(0, len(audio[0]), size):
+        found = t.process(audio[:, i:i + size])
+        # every beat is reported after `latency`, no later than the block after it
+        received = min(i + size, len(audio[0]))
+        assert np.all(received - found >= t.latency) and np.all(received - found < t.latency + size + t.hop)
+        beats += found.tolist()
+    # beats that flush decides at the end of the stream don't have the lag to be sure of
+    beats = np.asarray(beats)
+    assert t.period == pytest.approx(t.fps * 60 / bpm, abs = 1)
+    # tempo is known after a few seconds of history
+    beats = beats[beats > 8 * sr]
+    assert len(beats) >= (12 * bpm / 60) - 1
+    assert np.all(np.abs(beats[:, None] - clicks[None]).min(axis = 1) <= 2 * t.hop)
+    assert np.all(np.abs(np.diff(beats) - sr * 60 / bpm) <= 2 * t.hop)
+
+def test_track_yields_every_block():
+    audio, clicks = _clicks(120, seconds = 10)
+    blocks = [audio[:, i:i + 4096] for i in range(0, len(audio[0]), 4096)]
+    found = list(online.track(iter(blocks), 44100))
+    assert len(found) == len(blocks) + 1
+    t = online.tracker(44100)
+    expected = [t.process(b) for b in blocks] + [t.flush()]
+    for a, b in zip(found, expected): assert np.array_equal(a, b)
@@ -0,0 +1,58 @@
+import os, numpy as np, pytest
+import beat_manipulator as bm
+from beat_manipulator import parse
+import legacy
+
+COWBELL = os.path.join(legacy.ROOT, 'beat_manipulator', 'samples', 'cowbell.flac')
+
+def _recorded():
+    import json
+    with open(os.path.join(legacy.DATA, 'legacy_parse.json'), 'r') as f: return json.load(f)
+
+RECORDED = _recorded()
+
+@pytest.mark.parametrize('case, expected', RECORDED, ids = [repr(tuple(case)) for case, _ in RECORDED])
+def test_parse_matches_old_parser(case, expected):
+    """Beats, operators, pattern length and shuffles that the single pass tokenizer and tree give are the same as the old parser's"""
+    if isinstance(expected, dict):
+        with pytest.raises(Exception): legacy.parsed(bm, *case)
+    else: assert legacy.parsed(bm, *case) == expected
+
+@pytest.fixture(autouse = True)
+def clear():
+    parse.cache_clear()
+    yield
+    parse.cache_clear()
+
+@pytest.mark.parametrize('pattern', legacy.PATTERNS)
+def test_cached_parse_is_same(pattern):
+    samples = {'cowbell': COWBELL, 'o': legacy.sample_song(bm)}
+    uncached = parse.parse(pattern, samples, log = False, cache = False)
+    first = parse.parse(pattern, samples, log = False)
+    second = parse.parse(pattern, samples, log = False)
+    assert legacy.plain(first) == legacy.plain(uncached) == legacy.plain(second)
+    assert parse.cache_info()['hits'] == 1
+
+def test_cached_parse_is_a_copy():
+    first = parse.parse('1r, 2v0.5, 3', {}, log = False)
+    first[0][1][1][0][1] = '2'
+    first[1].append('~')
+    second = parse.parse('1r, 2v0.5, 3', {}, log = False)
+    assert second[0][1][1] == [['v', '0.5']] and second[1] == [',', ',', ',']
+
+def test_changed_sample_is_a_miss():
+    samples = {'cowbell': np.zeros((2, 100), dtype = np.float32)}
+    first = parse.parse('1, "cowbell"', samples, log = False)
+    assert first[0][1][0] is samples['cowbell']
+    samples['cowbell'] = np.ones((2, 100), dtype = np.float32)
+    second = parse.parse('1, "cowbell"', samples, log = False)
+    assert second[0][1][0] is samples['cowbell']
+    assert parse.cache_info()['hits'] == 0 and parse.cache_info()['misses'] == 2
+
+def test_least_recently_used_is_evicted(monkeypatch):
+    monkeypatch.setattr(parse, 'cache_size', 2)
+    for pattern in ('1', '2', '1', '3'): parse.parse(pattern, {}, log = False)
+    assert parse.cache_info()['size'] == 2
+    parse.parse('1', {}, log = False)
+    parse.parse('2', {}, log = False)
+    assert parse.cache_info()['hits'] == 2 and parse.cache_info()['misses'] == 4
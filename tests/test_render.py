@@ -0,0 +1,143 @@
+import contextlib, io, os, numpy as np, pytest
+import beat_manipulator as bm
+import legacy
+
+CASES = legacy.cases()
+
+@pytest.fixture(scope = 'module')
+def recorded():
+    with np.load(os.path.join(legacy.DATA, 'legacy_render.npz')) as f: data = {k: f[k] for k in f.files}
+    assert list(data['cases']) == [repr(i) for i in CASES], 'cases changed, record them again with tests/legacy.py'
+    return data
+
+@pytest.mark.parametrize('n', range(len(CASES)), ids = [repr(i) for i in CASES])
+def test_render_matches_old_loop(n, recorded):
+    """Output of `song.beatswap` is the same as the old beatswap loop's"""
+    if f'{n}_error' in recorded: pytest.skip(f"old loop raised {recorded[f'{n}_error']}")
+    with contextlib.redirect_stdout(io.StringIO()): result = legacy.beatswap(bm, *CASES[n])
+    assert result.dtype == np.float32
+    assert tuple(result.shape) == tuple(recorded[f'{n}_shape'])
+    assert np.allclose(legacy.stats(result), recorded[f'{n}'], rtol = 1e-5, atol = 1e-2)
+
+def _stream(pattern, scale = 1, limit_beats = 10000, limit_length = 52920000, block = 65536):
+    import random
+    random.seed(42)
+    song = bm.song(legacy.audio(), sr = legacy.SR, log = False)
+    song.beatmap = legacy.beatmap(len(song.audio[0]))
+    samples = {'cowbell': os.path.join(legacy.ROOT, 'beat_manipulator', 'samples', 'cowbell.flac'), 'o': legacy.sample_song(bm)}
+    blocks = list(song.beatswap_stream(pattern, scale = scale, samples = samples, limit_beats = limit_beats, limit_length = limit_length, block = block))
+    assert all(len(i[0]) == block for i in blocks[:-1])
+    return np.concatenate(blocks, axis = 1)
+
+# presets include baked in ones, and the ones that are random every time
+@pytest.mark.parametrize('case', [i for i in CASES if i[0] in legacy.PATTERNS] + [('shuffle',), ('random',), ('shuffle', 0.5), ('test', 2), ('reverse', 1/3)] + [(i,) for i in legacy.presets()], ids = repr)
+def test_stream_matches_render(case):
+    with contextlib.redirect_stdout(io.StringIO()):
+        try: rendered = legacy.beatswap(bm, *case)
+        except Exception: return pytest.skip('render raises')
+        streamed = _stream(*case, block = 10000)
+    assert np.array_equal(streamed, rendered)
+
+def _smooth_old(beats: list, smoothing = 100):
+    """Smoothing loop of the old beatswap, on a list of `(2, length)` beats"""
+    import scipy.interpolate
+    for i in range(len(beats)-1):
+        current1 = beats[i][0][-2]
+        current2 = beats[i][0][-1]
+        following1 = beats[i+1][0][0]
+        following2 = beats[i+1][0][1]
+        num = (abs(following1 - (current2 + (current2 - current1))) + abs(current2 - (following1 + (following1 - following2))))/2
+        if num > 0.0:
+            num = int(smoothing*num)
+            if num>3:
+                try:
+                    line = scipy.interpolate.CubicSpline([0, num+1], [0, following1], bc_type='clamped')(np.arange(0, num, 1))
+                    line2 = np.linspace(1, 0, num)**0.5
+                    beats[i][0][-num:] *= line2
+                    beats[i][1][-num:] *= line2
+                    beats[i][0][-num:] += line
+                    beats[i][1][-num:] += line
+                except (IndexError, ValueError): pass
+
+@pytest.mark.parametrize('seed', range(8))
+@pytest.mark.parametrize('smoothing', (10, 100, 1000))
+def test_smooth_all_matches_old_loop(seed, smoothing):
+    """`render.smooth_all` smooths every boundary like the old loop did one beat at a time, including beats too short for their fade"""
+    from beat_manipulator import render
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(2, 3000, 60)
+    lengths[::7] = rng.integers(2, 6, len(lengths[::7]))
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    audio = (rng.uniform(-0.5, 0.5, (2, offsets[-1])) * rng.uniform(0, 1, len(lengths)).repeat(lengths)).astype(np.float32)
+    beats = [audio[:, offsets[i]:offsets[i+1]].copy() for i in range(len(lengths))]
+    _smooth_old(beats, smoothing)
+    render.smooth_all(audio, offsets, smoothing)
+    assert audio.dtype == np.float32
+    assert np.allclose(audio, np.concatenate(beats, axis = 1), rtol = 1e-5, atol = 1e-5)
+
+def test_fade_cache_is_bounded():
+    from beat_manipulator import render
+    for length in range(4, 1004): render._fade(length)
+    assert render._fade.cache_info().currsize <= render._fade.cache_info().maxsize < 1000
+    assert not render._fade(5)[0].flags.writeable
+
+def _plain(beat, chain, clip = False):
+    """Effect chain applied one effect at a time, each one to a copy, without kernels"""
+    from beat_manipulator import render, utils
+    for e, v in chain:
+        if isinstance(v, str): v = utils._safer_eval(v)
+        beat = beat.copy()
+        if e == 'volume': beat = beat * (0 if v is None else v)
+        else: beat = render._effect(beat, e, v)
+    return np.clip(beat, -1, 1) if clip else beat
+
+def _steps():
+    from beat_manipulator import effects
+    return [('volume', 0.5), ('volume', 3), ('volume', '1/3'), (effects.channel, None), (effects.channel, 0), (effects.channel, 1),
+        (effects.bitcrush, 3), (effects.bitcrush, 0.5), (effects.clip, None), (effects.speed, 0.5), (effects.speed, 2), ('downsample', 4), ('gradient', None), ('reverse', None)]
+STEPS = _steps()
+
+@pytest.mark.parametrize('seed', range(40))
+def test_process_matches_plain_effects(seed):
+    """Kernels, fused pointwise steps and `out` buffers give the same beat as applying every effect to a copy, and never modify the song"""
+    from beat_manipulator import render, utils
+    rng = np.random.default_rng(seed)
+    song = legacy.audio(seconds = 4)
+    original = song.copy()
+    chain = tuple(STEPS[i] for i in rng.integers(0, len(STEPS), rng.integers(1, 6)))
+    start = int(rng.integers(0, 1000))
+    # longer than a block of pointwise effects, short, and reversed
+    for beat in (song[:, start:start + render._BLOCK + 4567], song[:, start:start + 300], song[:, start:start + 9000][:, ::-1]):
+        for clip in (False, True):
+            expected = _plain(beat, chain, clip)
+            for out in (None, np.full(beat.shape, np.nan, dtype = beat.dtype), np.full((2, 5), np.nan, dtype = beat.dtype)):
+                result = render._process(beat, chain, None, utils.C_MISC[7], clip = clip, out = out)
+                assert result.dtype == expected.dtype
+                assert np.array_equal(result, expected), chain
+                assert np.array_equal(song, original), chain
+
+class _board:
+    """Stands in for a pedalboard, stateless and pointwise, so processing beats together or one by one gives the same audio"""
+    def __init__(self): self.calls = []
+    def __call__(self, audio, sr, reset = True):
+        self.calls.append(len(audio[0]))
+        return np.tanh(audio * 2) * 0.5
+
+@pytest.mark.parametrize('limit', [None, 30000])
+def test_plugin_chain_is_called_once_per_run(limit, monkeypatch):
+    """Consecutive beats with a plugin chain go to the plugins in one call, and sound the same as processing every beat by itself"""
+    # with a small limit runs are cut into single beats
+    if limit is not None: monkeypatch.setattr(bm.render, '_BATCH', limit)
+    chain, single = bm.effects.plugin_chain(sr = legacy.SR), bm.effects.plugin_chain(sr = legacy.SR)
+    chain._board, single._board = _board(), _board()
+    song = bm.song(legacy.audio(), sr = legacy.SR, log = False)
+    song.beatmap = legacy.beatmap(len(song.audio[0]))
+    with contextlib.redirect_stdout(io.StringIO()):
+        batched = song.beatswap('1R, 2R, 3, 4R0.5, 5R0.5', effects = {**bm.BM_EFFECTS, 'R': chain}, return_audio = True)
+        plain = song.beatswap('1R, 2R, 3, 4R0.5, 5R0.5', effects = {**bm.BM_EFFECTS, 'R': lambda audio, v: single(audio, v)}, return_audio = True)
+    assert np.array_equal(batched, plain)
+    # beats 1 and 2 are one run, 4 and 5 are another, because their value is different
+    lengths = single._board.calls
+    assert len(lengths) % 2 == 0
+    if limit is None: assert chain._board.calls == [sum(lengths[i:i + 2]) for i in range(0, len(lengths), 2)]
+    else: assert chain._board.calls == lengths
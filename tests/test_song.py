@@ -0,0 +1,107 @@
+import numpy as np
+import beat_manipulator as bm
+from beat_manipulator import cache
+
+def _file(tmp_path, seconds = 3, sr = 44100):
+    import soundfile
+    path = str(tmp_path / 'song.wav')
+    soundfile.write(path, np.random.default_rng(0).uniform(-0.5, 0.5, (sr * seconds, 2)), sr)
+    return path
+
+def test_lazy_song_audio_set_before_decoding(tmp_path, cache_dir):
+    path = _file(tmp_path)
+    song = bm.song(path, lazy = True, log = False)
+    audio = np.zeros((2, 1000), dtype = np.float32)
+    song.audio = audio
+    assert song.audio is audio
+    assert song.fingerprint == bm.fingerprint.full(audio, song.sr)
+    # replaced audio isn't remembered as the fingerprint of the file
+    assert cache.fingerprints.get(song._lazy[1]) is None
+
+def test_lazy_song_fingerprint_is_cached(tmp_path, cache_dir):
+    path = _file(tmp_path)
+    fingerprint = bm.song(path, lazy = True, log = False).fingerprint
+    song = bm.song(path, lazy = True, log = False)
+    assert song.fingerprint == fingerprint
+    assert song._audio is None
+    assert np.array_equal(song.audio, bm.song(path, log = False).audio)
+
+def test_sampled_fingerprint(tmp_path, cache_dir):
+    audio = np.random.default_rng(0).uniform(-0.5, 0.5, (2, 44100 * 10)).astype(np.float32)
+    full = bm.song(audio, sr = 44100, log = False)
+    sampled = bm.song(audio, sr = 44100, log = False, sampled = True)
+    assert full.fingerprint == bm.fingerprint.full(audio, 44100)
+    assert sampled.fingerprint == bm.fingerprint.sampled(audio, 44100)
+    assert full.fingerprint != sampled.fingerprint
+
+def test_lazy_sampled_fingerprint_is_cached_apart(tmp_path, cache_dir):
+    path = _file(tmp_path, seconds = 10)
+    full = bm.song(path, lazy = True, log = False).fingerprint
+    sampled = bm.song(path, lazy = True, log = False, sampled = True)
+    assert sampled.fingerprint != full
+    assert bm.song(path, lazy = True, log = False, sampled = True).fingerprint == sampled.fingerprint
+
+def _beatswapped():
+    import legacy
+    song = bm.song(legacy.audio(seconds = 5), sr = legacy.SR, log = False)
+    song.beatmap = legacy.beatmap(len(song.audio[0]))
+    return song
+
+def test_beatswap_iter_renders_ahead_by_workers(monkeypatch):
+    """Renders are yielded in order, and only `workers` of them are rendered before the first one is handled"""
+    from beat_manipulator import render
+    calls = []
+    original = render.render
+    monkeypatch.setattr(render, 'render', lambda *args, **kwargs: calls.append(1) or original(*args, **kwargs))
+    patterns = ['1, 2r', '1>0.5', 'reverse', '1v0.5, 2, 3s2', '4, 3, 2, 1']
+    scales = [[1, 2], [1], [1], [0.5, 1], [1]]
+    results = _beatswapped().beatswap_iter(patterns, scales = scales, workers = 2)
+    assert next(results)[:2] == (0, 0) and len(calls) <= 2
+    rest = [(n, k) for n, k, audio in results]
+    assert rest == [(0, 1), (1, 0), (2, 0), (3, 0), (3, 1), (4, 0)]
+    many = _beatswapped().beatswap_many(patterns, scales = scales, workers = 2)
+    for n, k, audio in _beatswapped().beatswap_iter(patterns, scales = scales):
+        assert np.array_equal(audio, many[n][k])
+        assert np.array_equal(audio, _beatswapped().beatswap(patterns[n], scale = scales[n][k], return_audio = True))
+
+def test_use_all_writes_every_render_when_done(monkeypatch):
+    from beat_manipulator import presets, render
+    calls, written = [], []
+    original = render.render
+    monkeypatch.setattr(render, 'render', lambda *args, **kwargs: calls.append(1) or original(*args, **kwargs))
+    monkeypatch.setattr(presets, '_loaded', lambda: {f'preset {i}': {'pattern': f'{i}, 1'} for i in range(1, 9)})
+    monkeypatch.setattr(presets, '_write', lambda song, audio, key, *args, **kwargs: written.append((key, len(calls))))
+    import contextlib, io
+    with contextlib.redirect_stdout(io.StringIO()): presets.use_all(_beatswapped(), workers = 2)
+    assert [key for key, n in written] == [f'preset {i}' for i in range(1, 9)]
+    # every render is written before more than `workers` renders after it are started
+    assert all(n <= i + 2 for i, (key, n) in enumerate(written))
+
+def test_copied_song_has_its_own_lock():
+    import copy
+    song = _beatswapped()
+    expected = song.beatswap('1%v, 2v%', return_audio = True)
+    for copied in (copy.deepcopy(song), copy.copy(song)):
+        assert copied._features_lock is not song._features_lock and copied._features is not song._features
+        assert np.array_equal(copied.beatswap('1%v, 2v%', return_audio = True), expected)
+
+def test_pickled_song(tmp_path, cache_dir):
+    import pickle
+    path = _file(tmp_path)
+    fingerprint = bm.song(path, lazy = True, log = False).fingerprint
+    song = bm.song(path, lazy = True, log = False)
+    lazy = pickle.loads(pickle.dumps(song))
+    assert lazy._audio is None and lazy.fingerprint == fingerprint
+    song.audio
+    decoded = pickle.loads(pickle.dumps(song))
+    assert np.array_equal(decoded.audio, song.audio) and decoded.fingerprint == fingerprint
+    decoded.audio = decoded.audio[:, :1000]
+    assert decoded.fingerprint == bm.fingerprint.full(decoded.audio, decoded.sr) != fingerprint
+
+def test_list_audio():
+    audio = np.random.default_rng(0).uniform(-0.5, 0.5, (2, 1000))
+    song = bm.song(audio, sr = 44100, log = False)
+    song.audio = audio.tolist()
+    assert song.fingerprint == bm.fingerprint.full(audio.tolist(), 44100)
+    song.audio = audio[:, :500]
+    assert song.fingerprint == bm.fingerprint.full(audio[:, :500], 44100)